@@ -12,13 +12,15 @@
 # db = client[DB_NAME]
 
 import logging
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
 from settings import settings
+from utils.metrics import MongoCommandMetrics
 
 logger = logging.getLogger("database")
 logger.setLevel(logging.INFO)
 
-client = MongoClient(settings.MONGO_URI)
+# Motor keeps the event loop free while Mongo works; every collection method returns an awaitable
+client = AsyncIOMotorClient(settings.MONGO_URI, event_listeners=[MongoCommandMetrics()])
 db = client[settings.MONGO_DB]
 
 logger.info(f"Connected to MongoDB at {settings.MONGO_URI}, DB: {settings.MONGO_DB}")
@@ -1,7 +1,14 @@
 import logging
 from fastapi import FastAPI
-from routers import alerts, features, ingest, entity, monitoring, rules, score, health
+from routers import alerts, dashboard, features, ingest, entity, monitoring, pipeline, rules, score, health
 from fastapi.middleware.cors import CORSMiddleware
+from settings import settings
+from utils.alert_worker import alert_worker
+from utils.gemini_client import gemini
+from utils.indexes import ensure_indexes
+from utils.metrics import MetricsMiddleware
+from utils.txgraph import refresh_graph
+from utils.write_behind import write_behind
 
 
 logging.basicConfig(level=logging.INFO)
@@ -18,6 +25,8 @@ app.add_middleware(
     allow_headers=["*"],             # allow Authorization, Content-Type, etc.
     expose_headers=["*"],
 )
+# outermost, so the timings include CORS handling
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(health.router, prefix="")
 app.include_router(ingest.router, prefix="")
@@ -27,53 +36,33 @@ app.include_router(score.router, prefix="")
 app.include_router(alerts.router, prefix="")
 app.include_router(entity.router, prefix="")
 app.include_router(monitoring.router, prefix="")
+app.include_router(pipeline.router, prefix="")
+app.include_router(dashboard.router, prefix="")
 
-@app.get("/summary")
-async def get_summary():
 
-    return {
-        "summary": {
-            "totalTransactions": 146,
-            "highRisk": 9,
-            "mediumRisk": 28,
-            "lowRisk": 109,
-            "avgScore": 0.34,
-        },
-        "news": [
-            {
-                "title": "Suspicious transaction detected for NGO",
-                "href": "#",
-                "source": "Alert System",
-                "date": "2025-09-20",
-            },
-            {
-                "title": "Circular fund flow detected for Company",
-                "href": "#",
-                "source": "Alert System",
-                "date": "2025-09-19",
-            },
-        ],
-    }
+@app.on_event("startup")
+async def startup():
+    # idempotent; a failure is logged and GET /monitoring/indexes shows what is missing
+    if settings.ENSURE_INDEXES_ON_STARTUP:
+        try:
+            await ensure_indexes()
+        except Exception:
+            logger.exception("Index creation failed")
+    alert_worker.start()
+    write_behind.start()
+    # built off the request path; /entity/resolve serves the previous index while it refreshes
+    entity.refresh_index()
+    features.start_pool()
+    if settings.TXGRAPH_FEATURES:
+        refresh_graph()
 
 
-@app.get("/reports")
-async def get_reports():
+@app.on_event("shutdown")
+async def shutdown():
+    # stop the alert workers before draining the shared Gemini connection pool they use
+    await alert_worker.stop()
+    # the workers above write through the buffer, so it is drained after them
+    await write_behind.stop()
+    await features.shutdown_pool()
+    await gemini.aclose()
 
-    return [
-        {
-            "id": "TXN-2025-001",
-            "date": "2025-09-19",
-            "counterparty": "NGO",
-            "amount": 1250000,
-            "risk_score": 0.87,
-            "level": "High",
-        },
-        {
-            "id": "TXN-2025-002",
-            "date": "2025-09-18",
-            "counterparty": "Company",
-            "amount": 810000,
-            "risk_score": 0.42,
-            "level": "Medium",
-        },
-    ]
\ No newline at end of file
@@ -8,17 +8,135 @@
 # class ResolveRequest(BaseModel):
 #     party_ids: List[str]
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, validator
 from typing import List, Dict, Any, Optional
+from datetime import datetime, timezone
+from enum import Enum
 
 
 class IngestRequest(BaseModel):
     data_type: str = Field(..., description="Collection name, e.g., 'transactions', 'entities'")
     records: List[Dict[str, Any]]
 
+
+class Direction(str, Enum):
+    IN = "in"
+    OUT = "out"
+
+
+class Transaction(BaseModel):
+    """
+    A transaction as stored: float amount, naive UTC datetime timestamp, 'in'/'out' direction and a
+    normalized counterparty_key. Undeclared fields are kept as they are.
+    """
+    grant_id: str
+    amount: float
+    direction: Direction
+    timestamp: datetime
+    counterparty: Optional[str] = None
+    counterparty_key: Optional[str] = None
+    from_: Optional[str] = Field(None, alias="from")
+    to: Optional[str] = None
+
+    class Config:
+        extra = "allow"
+        use_enum_values = True
+        allow_population_by_field_name = True
+
+    @validator("direction", pre=True)
+    def _lower_direction(cls, v):
+        return v.strip().lower() if isinstance(v, str) else v
+
+    @validator("timestamp", pre=True)
+    def _parse_iso(cls, v):
+        # same ISO rules as utils.feature_engine.parse_timestamp, including date-only values
+        return datetime.fromisoformat(v) if isinstance(v, str) else v
+
+    @validator("timestamp")
+    def _naive_utc(cls, v: datetime):
+        # BSON dates carry no zone; store UTC like utils.feature_engine.parse_timestamp expects
+        return v.astimezone(timezone.utc).replace(tzinfo=None) if v.tzinfo is not None else v
+
+    @validator("counterparty_key", always=True)
+    def _counterparty_key(cls, v, values):
+        cp = values.get("counterparty")
+        return " ".join(cp.casefold().split()) if cp else None
+
+    def to_document(self) -> Dict[str, Any]:
+        return self.dict(by_alias=True, exclude_none=True)
+
+    @classmethod
+    def normalize(cls, record: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Same as parse_obj(record).to_document(). Well-formed records take a hand-written path that is an
+        order of magnitude cheaper than full validation; anything else is validated normally, which raises
+        ValidationError with the usual messages.
+        """
+        try:
+            doc = {k: v for k, v in record.items() if v is not None}
+            amount, ts, cp = doc["amount"], doc["timestamp"], doc.get("counterparty")
+            if type(doc["grant_id"]) is not str or type(amount) not in (float, int, str):
+                raise TypeError
+            doc["amount"] = float(amount)
+            doc["direction"] = _DIRECTIONS[doc["direction"]]
+            if type(ts) is not datetime:
+                ts = datetime.fromisoformat(ts)
+            doc["timestamp"] = ts.astimezone(timezone.utc).replace(tzinfo=None) if ts.tzinfo is not None else ts
+            if any(k in doc and type(doc[k]) is not str for k in ("counterparty", "from", "to")):
+                raise TypeError
+            doc.pop("from_", None)
+            doc.pop("counterparty_key", None)
+            if cp:
+                doc["counterparty_key"] = " ".join(cp.casefold().split())
+            return doc
+        except (KeyError, TypeError, ValueError):
+            return cls.parse_obj(record).to_document()
+
+
+_DIRECTIONS = {d.value: d.value for d in Direction}
+
+# a stored transaction's amount in aggregation pipelines: absolute double, 0 for null, missing or unconvertible
+AMOUNT_EXPR = {"$abs": {"$convert": {"input": "$amount", "to": "double", "onError": 0.0, "onNull": 0.0}}}
+
+
 class FeatureRequest(BaseModel):
-    theta_micro: float = 0.005
+    theta_micro: float = Field(1000.0, description="Inflows below this amount count as micro transactions")
+    windows: List[int] = [7, 30, 90]
+    engine: Optional[str] = Field(None, description="Feature engine: 'python', 'numpy' or 'mongo'; defaults to FEATURE_ENGINE")
+    verify: bool = Field(False, description="Also run the reference python engine and report mismatching keys")
+
+
+class FeatureBatchRequest(BaseModel):
+    grant_ids: Optional[List[str]] = Field(None, description="Explicit grant ids to recompute")
+    since: Optional[str] = Field(None, description="ISO timestamp; recompute every grant with transactions at or after it")
+    theta_micro: float = Field(1000.0, description="Inflows below this amount count as micro transactions")
     windows: List[int] = [7, 30, 90]
+    engine: Optional[str] = None
+    batch_size: Optional[int] = None
+    workers: Optional[int] = None
+
+
+class RulesBatchRequest(BaseModel):
+    grant_ids: Optional[List[str]] = Field(None, description="Grants to evaluate; omit to evaluate every grant with features")
+    chunk_size: Optional[int] = None
+
+
+class ScoreBatchRequest(BaseModel):
+    grant_ids: Optional[List[str]] = Field(None, description="Grants to re-score; omit to re-score every grant with features")
+    chunk_size: Optional[int] = None
+
+
+class PipelineRequest(BaseModel):
+    theta_micro: float = Field(1000.0, description="Inflows below this amount count as micro transactions")
+    windows: List[int] = [7, 30, 90]
+    engine: Optional[str] = Field(None, description="Feature engine: 'python' or 'numpy'; defaults to FEATURE_ENGINE")
+    justify: bool = Field(True, description="Ask Gemini for the alert justification")
+    bypass_cache: bool = False
+
+
+class PipelineBatchRequest(PipelineRequest):
+    grant_ids: List[str]
+    batch_size: Optional[int] = None
 
 
 class ResolveRequest(BaseModel):
@@ -26,7 +144,7 @@ class ResolveRequest(BaseModel):
 
 
 class FeatureComputeRequest(BaseModel):
-    theta_micro: float = 0.005
+    theta_micro: float = Field(1000.0, description="Inflows below this amount count as micro transactions")
     windows: List[int] = [7, 30, 90]
 
 
@@ -43,91 +43,328 @@
 #     return {"message": "Disposition updated"}
 
 
-from fastapi import APIRouter, HTTPException, Body
+from fastapi import APIRouter, HTTPException, Body, Query
+from fastapi.responses import StreamingResponse
+from models.schemas import AMOUNT_EXPR
 from database import db
+from settings import settings
+from utils.alert_worker import PENDING, READY, RESOLVED, alert_worker, build_alert
+from utils.feature_engine import parse_timestamp
+from utils.summary import apply_alerts
+from utils.txgraph import GRANT_PREFIX, PARTY_PREFIX, grant_node
+from utils.write_behind import write_behind
 from datetime import datetime
-from typing import List
+from typing import List, Optional
+import asyncio
+import base64
+import json
 import logging
 
 router = APIRouter()
 logger = logging.getLogger("alerts")
 
+MAX_PAGE_SIZE = 200
+# top-level fields of an alert document that `fields` may project (dotted paths below them are allowed too)
+ALERT_FIELDS = (
+    "grant_id", "risk_score", "risk_tier", "rule_hits", "computed_features", "timeline", "justification",
+    "justification_status", "justified_at", "status", "resolved_at", "timestamp",
+)
+# idle SSE connections get a comment line this often so proxies keep them open
+SSE_KEEPALIVE_SEC = 15
+
+
+def _encode_cursor(doc: dict) -> str:
+    raw = json.dumps({"t": doc["timestamp"].isoformat(), "g": doc["grant_id"]})
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str):
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(raw["t"]), raw["g"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _parse_bound(value: Optional[str], name: str) -> Optional[datetime]:
+    try:
+        return parse_timestamp(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be an ISO date or timestamp")
+
+
+def _projection(fields: Optional[str]) -> dict:
+    """
+    The find() projection for a comma-separated `fields` list. The sort keys are always returned so the next
+    cursor can be built; a path is dropped when one of its parents is also requested, since MongoDB rejects
+    overlapping paths.
+    """
+    projection = {"_id": 0}
+    if not fields:
+        return projection
+    names = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = sorted(
+        f for f in names
+        if f.split(".")[0] not in ALERT_FIELDS or any(not part or part.startswith("$") for part in f.split("."))
+    )
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields {unknown}; expected paths under {list(ALERT_FIELDS)}")
+    names.update(("timestamp", "grant_id"))
+    for f in sorted(names):
+        parts = f.split(".")
+        if not any(".".join(parts[:i]) in names for i in range(1, len(parts))):
+            projection[f] = 1
+    return projection
+
 
 @router.get("/alerts/today")
-def get_alerts(limit: int = 50):
-    limit = min(limit, 200)
-    # query recent alerts collection
-    results = list(db.alerts.find({}, {"_id": 0}).sort("timestamp", -1).limit(limit))
-    return {"alerts": results}
+async def get_alerts(
+    limit: int = 50,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    tier: Optional[List[str]] = Query(None),
+    rule: Optional[List[str]] = Query(None),
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+):
+    """
+    Open alerts newest first, by default those raised since 00:00 UTC today. Pages are keyset-paginated on
+    (timestamp, grant_id): pass back `next_cursor` to continue, which costs the same at any depth.
+    `tier` and `rule` filter on risk_tier / rule_hits (repeat to match any of several values) and `fields`
+    is a comma-separated projection over ALERT_FIELDS. Only BSON-date timestamps are listed (see manage.py migrate-transactions).
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    start = _parse_bound(date_from, "date_from")
+    end = _parse_bound(date_to, "date_to")
+    if start is None and end is None:
+        start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
 
+    window = {"$type": "date"}
+    if start is not None:
+        window["$gte"] = start
+    if end is not None:
+        window["$lte"] = end
+    # alerts resolved by a re-score out of the alert tiers are no longer listed
+    query: dict = {"timestamp": window, "status": {"$ne": RESOLVED}}
+    if tier:
+        query["risk_tier"] = {"$in": tier}
+    if rule:
+        query["rule_hits"] = {"$in": rule}
+    if cursor:
+        ts, gid = _decode_cursor(cursor)
+        query["$or"] = [{"timestamp": {"$lt": ts}}, {"timestamp": ts, "grant_id": {"$lt": gid}}]
 
-@router.get("/alerts/{grant_id}")
-def get_alert(grant_id: str):
-    # first, try to find a stored alert
-    doc = db.alerts.find_one({"grant_id": grant_id}, {"_id": 0})
+    projection = _projection(fields)
+    results = await (
+        db.alerts.find(query, projection)
+        .sort([("timestamp", -1), ("grant_id", -1)])
+        .limit(limit + 1)
+        .to_list(length=limit + 1)
+    )
+    next_cursor = _encode_cursor(results[limit - 1]) if len(results) > limit else None
+    return {"alerts": results[:limit], "next_cursor": next_cursor}
+
+
+def _subgraph_pipeline(frontier: List[str], seen: List[str], limit: int) -> List[dict]:
+    # edges touching the frontier, one per (source, target) pair, heaviest first; pairs with an endpoint
+    # expanded at an earlier hop were already returned then. Node ids are namespaced like utils/txgraph.py,
+    # so grants are only looked up by grant_id and parties only by counterparty
+    grant_ids = [n[len(GRANT_PREFIX):] for n in frontier if n.startswith(GRANT_PREFIX)]
+    parties = [n[len(PARTY_PREFIX):] for n in frontier if n.startswith(PARTY_PREFIX)]
+    touching = [{"grant_id": {"$in": grant_ids}}] if grant_ids else []
+    if parties:
+        touching.append({"counterparty_key": {"$in": parties}})
+        # legacy rows without a counterparty_key (see manage.py migrate-transactions) are drawn by counterparty
+        touching.append({"counterparty": {"$in": parties}, "counterparty_key": None})
+    grant = {"$concat": [GRANT_PREFIX, {"$toString": "$grant_id"}]}
+    party = {"$concat": [PARTY_PREFIX, {"$toString": {"$ifNull": ["$counterparty_key", "$counterparty"]}}]}
+    inflow = {"$eq": ["$direction", "in"]}
+    return [
+        {"$match": {"$or": touching}},
+        {"$project": {
+            "_id": 0,
+            "source": {"$cond": [inflow, party, grant]},
+            "target": {"$cond": [inflow, grant, party]},
+            "amount": AMOUNT_EXPR,
+            "timestamp": 1,
+        }},
+        {"$match": {"source": {"$ne": None, "$nin": seen}, "target": {"$ne": None, "$nin": seen}}},
+        {"$group": {
+            "_id": {"source": "$source", "target": "$target"},
+            "amount": {"$sum": "$amount"},
+            "count": {"$sum": 1},
+            "first_ts": {"$min": "$timestamp"},
+            "last_ts": {"$max": "$timestamp"},
+        }},
+        {"$sort": {"amount": -1, "_id.source": 1, "_id.target": 1}},
+        {"$limit": limit},
+    ]
+
+
+@router.get("/alerts/{grant_id}/subgraph")
+async def get_alert_subgraph(grant_id: str, hops: int = 2, max_edges: int = 200):
+    """
+    The money-flow network around a grant: a breadth-first walk over grants and counterparties up to `hops`
+    away. Node ids are "grant:<grant_id>" and "party:<counterparty_key>", as in the transaction graph. Each
+    hop is one aggregation that reads only the transactions touching the current frontier (grants via the
+    grant_id index, parties via counterparty_key, or counterparty for unmigrated rows) and returns one edge
+    per (source, target) pair with summed amounts. At most `max_edges` edges are returned, heaviest first within each hop, and each hop expands
+    at most SUBGRAPH_MAX_FRONTIER nodes; `truncated` says whether either limit cut the walk short.
+    """
+    hops = max(1, min(hops, settings.SUBGRAPH_MAX_HOPS))
+    max_edges = max(1, min(max_edges, settings.SUBGRAPH_MAX_EDGES))
+
+    root = grant_node(grant_id)
+    depth = {root: 0}
+    edges: List[dict] = []
+    frontier, seen = [root], []
+    truncated = False
+    for hop in range(hops):
+        budget = max_edges - len(edges)
+        if not frontier or budget <= 0:
+            truncated = truncated or bool(frontier)
+            break
+        try:
+            rows = await db.transactions.aggregate(
+                _subgraph_pipeline(frontier, seen, budget + 1), maxTimeMS=settings.SUBGRAPH_MAX_TIME_MS
+            ).to_list(length=budget + 1)
+        except Exception as e:
+            logger.exception("Subgraph aggregation failed")
+            raise HTTPException(status_code=500, detail=str(e))
+        if hop == 0 and not rows:
+            raise HTTPException(status_code=404, detail="No transactions found for this grant_id")
+        if len(rows) > budget:
+            truncated, rows = True, rows[:budget]
+
+        flow: dict = {}
+        for row in rows:
+            source, target = row["_id"]["source"], row["_id"]["target"]
+            edges.append({"source": source, "target": target, **{k: v for k, v in row.items() if k != "_id"}})
+            for node in (source, target):
+                if node not in depth:
+                    depth[node] = hop + 1
+                    flow[node] = 0.0
+                if node in flow:
+                    flow[node] += row["amount"]
+
+        seen.extend(frontier)
+        # expand the most heavily connected new nodes first
+        frontier = sorted(flow, key=lambda n: (-flow[n], n))
+        if len(frontier) > settings.SUBGRAPH_MAX_FRONTIER:
+            truncated, frontier = True, frontier[:settings.SUBGRAPH_MAX_FRONTIER]
+
+    totals: dict = {}
+    for e in edges:
+        for node in (e["source"], e["target"]):
+            totals[node] = totals.get(node, 0.0) + e["amount"]
+    nodes = [
+        {"id": n, "label": "Grant" if n.startswith(GRANT_PREFIX) else "Party", "hop": depth[n],
+         "amount": round(totals.get(n, 0.0), 2)}
+        for n in sorted(depth, key=lambda n: (depth[n], n))
+    ]
+    return {
+        "grant_id": grant_id,
+        "hops": hops,
+        "nodes": nodes,
+        "edges": [{**e, "amount": round(e["amount"], 2)} for e in edges],
+        "truncated": truncated,
+    }
+
+
+async def _load_or_build_alert(grant_id: str, bypass_cache: bool) -> dict:
+    # bounded, so a stalled database cannot hold the request (or an event stream) open indefinitely
+    try:
+        return await asyncio.wait_for(_load_or_build(grant_id, bypass_cache), timeout=settings.ALERT_LOAD_TIMEOUT_SEC)
+    except asyncio.TimeoutError:
+        logger.error("Loading the alert for %s timed out", grant_id)
+        raise HTTPException(status_code=504, detail="Timed out loading the alert")
+
+
+async def _load_or_build(grant_id: str, bypass_cache: bool) -> dict:
+    doc = await write_behind.read("alerts", grant_id)
     if doc:
+        # e.g. the process restarted before the worker got to it
+        if doc.get("justification_status") == PENDING:
+            alert_worker.enqueue(grant_id, bypass_cache=bypass_cache)
         return doc
 
     # else, derive alert from stored computed score/features
-    score_doc = db.scores.find_one({"grant_id": grant_id}, {"_id": 0})
-    features_doc = db.features.find_one({"grant_id": grant_id}, {"_id": 0})
-
-    if not score_doc and not features_doc:
+    alert_obj = await build_alert(grant_id)
+    if alert_obj is None:
         raise HTTPException(status_code=404, detail="No alert, features, or score found for this grant_id")
 
-    # Build an alert object
-    risk_score = score_doc.get("risk_score") if score_doc else 0.0
-    risk_tier = score_doc.get("risk_tier") if score_doc else "Unknown"
-    rule_hits = (score_doc.get("rule_hits", {}).get("triggered_rules")
-                 if score_doc and isinstance(score_doc.get("rule_hits"), dict)
-                 else (db.rules_eval.find_one({"grant_id": grant_id}, {"_id": 0}) or {}).get("triggered_rules", []))
-
-    timeline = []
-    # optionally construct a simple timeline from transactions
-    txs = list(db.transactions.find({"grant_id": grant_id}, {"_id": 0}).sort("timestamp", -1).limit(20))
-    for t in txs:
-        timeline.append({"date": t.get("timestamp"), "event": t.get("direction"), "amount": t.get("amount")})
-
-    # add computed features and a natural language justification using Gemini
-    features = features_doc.get("features") if features_doc else {}
-
-    # create a justification prompt
-    from utils.gemini_client import call_gemini
-    prompt = (
-        "You are an AML analyst assistant. Given these features and rule hits, produce a short JSON justification for "
-        "an alert containing keys: summary (string), recommended_action (string), severity_explanation (string).\n\n"
-        f"features: {features}\nrule_hits: {rule_hits}\n\nReturn only JSON."
-    )
+    # persist the alert for future fast retrieval; the justification is filled in by the worker
+    await write_behind.upsert("alerts", grant_id, alert_obj)
+    await apply_alerts([alert_obj])
+    alert_worker.enqueue(grant_id, bypass_cache=bypass_cache)
+    return alert_obj
+
+
+@router.get("/alerts/{grant_id}")
+async def get_alert(grant_id: str, bypass_cache: bool = False):
+    """
+    Never waits for Gemini: alerts are materialized by the background worker. `justification_status` is
+    "pending" until the justification is written ("ready", or "failed" with a fallback text); follow
+    GET /alerts/{grant_id}/stream to receive it as it is generated.
+    """
+    return await _load_or_build_alert(grant_id, bypass_cache)
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@router.get("/alerts/{grant_id}/stream")
+async def stream_alert(grant_id: str):
+    """
+    Server-sent events for an alert's justification: "chunk" events carry text as Gemini generates it and a
+    final "justification" event carries the stored result. Ready alerts get the final event immediately.
+    A stream still waiting after ALERT_STREAM_TIMEOUT_SEC ends with a "timeout" event; poll GET /alerts/{grant_id}.
+    """
+    # subscribe first so an event published while we look the alert up is not lost
+    events = alert_worker.subscribe(grant_id)
     try:
-        g = call_gemini(prompt)
-        justification = g.get("json") or {"summary": g.get("text", "")}
+        alert = await _load_or_build_alert(grant_id, bypass_cache=False)
     except Exception:
-        justification = {"summary": "Could not generate explanation", "recommended_action": "Investigate", "severity_explanation": ""}
+        alert_worker.unsubscribe(grant_id, events)
+        raise
 
-    alert_obj = {
-        "grant_id": grant_id,
-        "risk_score": risk_score,
-        "risk_tier": risk_tier,
-        "rule_hits": rule_hits,
-        "computed_features": features,
-        "timeline": timeline,
-        "justification": justification,
-        "timestamp": datetime.utcnow().isoformat(),
-    }
+    async def relay():
+        try:
+            if alert.get("justification_status", READY) != PENDING:
+                yield _sse("justification", {
+                    "justification_status": alert.get("justification_status", READY),
+                    "justification": alert.get("justification"),
+                })
+                return
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + settings.ALERT_STREAM_TIMEOUT_SEC
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    yield _sse("timeout", {"justification_status": PENDING})
+                    return
+                try:
+                    event, data = await asyncio.wait_for(events.get(), timeout=min(SSE_KEEPALIVE_SEC, remaining))
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield _sse(event, data)
+                if event == "justification":
+                    return
+        finally:
+            alert_worker.unsubscribe(grant_id, events)
 
-    # persist the generated alert for future fast retrieval
-    db.alerts.update_one({"grant_id": grant_id}, {"$set": alert_obj}, upsert=True)
-
-    return alert_obj
+    return StreamingResponse(relay(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 
 @router.post("/alerts/triage/{grant_id}")
-def triage_alert(grant_id: str, disposition: str = Body(...), analyst_notes: str = Body(None)):
+async def triage_alert(grant_id: str, disposition: str = Body(...), analyst_notes: str = Body(None)):
     doc = {
         "grant_id": grant_id,
         "disposition": disposition,
         "analyst_notes": analyst_notes,
         "ts": datetime.utcnow().isoformat(),
     }
-    db.triage.update_one({"grant_id": grant_id}, {"$set": doc}, upsert=True)
+    await db.triage.update_one({"grant_id": grant_id}, {"$set": doc}, upsert=True)
     return {"message": "Disposition updated", "triage": doc}
@@ -0,0 +1,123 @@
+from fastapi import APIRouter, HTTPException, Query, Response
+from database import db
+from utils.summary import read_summary
+from typing import List, Optional
+import asyncio
+import base64
+import json
+import logging
+
+router = APIRouter()
+logger = logging.getLogger("dashboard")
+
+MAX_PAGE_SIZE = 200
+
+
+def _encode_cursor(doc: dict) -> str:
+    raw = json.dumps({"s": doc["risk_score"], "g": doc["grant_id"]})
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str):
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return float(raw["s"]), str(raw["g"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def _grant_details(grant_ids: List[str]):
+    """
+    Per grant: the inflow counterparty seen most often and the total inflow amount, read from the
+    incrementally maintained feature_state / feature_keys rows, so the cost follows the page size.
+    """
+    top_cp, inflow = await asyncio.gather(
+        db.feature_keys.aggregate([
+            {"$match": {"grant_id": {"$in": grant_ids}, "kind": "cp", "in": {"$gt": 0}}},
+            {"$sort": {"grant_id": 1, "in": -1, "key": 1}},
+            {"$group": {"_id": "$grant_id", "key": {"$first": "$key"}}},
+        ]).to_list(length=None),
+        db.feature_state.find({"grant_id": {"$in": grant_ids}}, {"_id": 0, "grant_id": 1, "state.sum_in": 1})
+        .to_list(length=None),
+    )
+    return (
+        {d["_id"]: d["key"] for d in top_cp},
+        {d["grant_id"]: d.get("state", {}).get("sum_in") for d in inflow},
+    )
+
+
+@router.get("/summary")
+async def get_summary():
+    """
+    Portfolio totals from the materialized dashboard_summary document, which the score, alert and ingest
+    write paths keep current with `$inc`: one small read however many grants there are.
+    """
+    summary = await read_summary()
+    tiers = summary["tiers"]
+    return {
+        "summary": {
+            "totalTransactions": summary["transactions"],
+            "totalGrants": summary["total"],
+            "highRisk": tiers.get("High", 0),
+            "mediumRisk": tiers.get("Medium", 0),
+            "lowRisk": tiers.get("Low", 0),
+            "tiers": tiers,
+            "avgScore": summary["avg_score"],
+            "alertsToday": summary["alerts_today"],
+            "updatedAt": summary["updated_at"],
+        },
+        "news": [
+            {
+                "title": f"{a.get('risk_tier')} risk alert for {a['grant_id']}",
+                "href": f"/alerts/{a['grant_id']}",
+                "source": "Alert System",
+                "date": a["timestamp"].date().isoformat() if a.get("timestamp") else None,
+            }
+            for a in summary["latest_alerts"]
+        ],
+    }
+
+
+@router.get("/reports")
+async def get_reports(
+    response: Response, limit: int = 50, tier: Optional[List[str]] = Query(None), cursor: Optional[str] = None
+):
+    """
+    Scored grants, riskiest first, as a plain list keyset-paginated on (risk_score, grant_id): when more
+    follow, the X-Next-Cursor response header holds the `cursor` to pass back. `tier` filters on
+    risk_tier (repeat for several).
+    Rows are per grant: `counterparty` is its most frequent inflow counterparty and `amount` its total
+    inflow, both None until the grant has transactions.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    query: dict = {"risk_score": {"$type": "number"}}
+    if tier:
+        query["risk_tier"] = {"$in": tier}
+    if cursor:
+        score, gid = _decode_cursor(cursor)
+        query["$or"] = [{"risk_score": {"$lt": score}}, {"risk_score": score, "grant_id": {"$lt": gid}}]
+
+    projection = {"_id": 0, "grant_id": 1, "risk_score": 1, "risk_tier": 1, "model_version": 1, "scored_at": 1}
+    docs = await (
+        db.scores.find(query, projection)
+        .sort([("risk_score", -1), ("grant_id", -1)])
+        .limit(limit + 1)
+        .to_list(length=limit + 1)
+    )
+    docs, more = docs[:limit], len(docs) > limit
+    counterparties, amounts = await _grant_details([d["grant_id"] for d in docs]) if docs else ({}, {})
+    reports = [
+        {
+            "id": d["grant_id"],
+            "date": d["scored_at"].date().isoformat() if d.get("scored_at") else None,
+            "counterparty": counterparties.get(d["grant_id"]),
+            "amount": amounts.get(d["grant_id"]),
+            "risk_score": d["risk_score"],
+            "level": d.get("risk_tier"),
+            "model_version": d.get("model_version"),
+        }
+        for d in docs
+    ]
+    if more:
+        response.headers["X-Next-Cursor"] = _encode_cursor(docs[-1])
+    return reports
@@ -11,40 +11,205 @@
 from fastapi import APIRouter, HTTPException
 from models.schemas import ResolveRequest
 from database import db
-from utils.gemini_client import call_gemini
+from settings import settings
+from utils.entity_index import EntityIndex, normalize_name
+from utils.gemini_cache import cached_call_gemini
+from pymongo import UpdateOne
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import json
 import logging
+import time
 
 router = APIRouter()
 logger = logging.getLogger("entity")
 
+_index: Optional[EntityIndex] = None
+_refresh: Optional[asyncio.Task] = None
 
-@router.post("/entity/resolve")
-def resolve_entities(payload: ResolveRequest):
-    mappings = []
-    for pid in payload.party_ids:
-        # Try to find existing mapping
-        existing = db.entities.find_one({"party_id": pid}, {"_id": 0})
-        if existing and existing.get("canonical_id"):
-            mappings.append({"party_id": pid, "canonical_id": existing["canonical_id"], "confidence": existing.get("confidence", 1.0)})
-            continue
 
-        # Fallback: ask Gemini to normalize / suggest canonical id (instruct JSON response)
+async def _rebuild_index() -> None:
+    # a failed rebuild keeps serving the previous index; only confirmed mappings (canonical_id set) are indexed
+    global _index
+    try:
+        index = EntityIndex(settings.ENTITY_MATCH_THRESHOLD)
+        async for doc in db.entities.find({"canonical_id": {"$nin": [None, ""]}}, {"_id": 0, "party_id": 1, "canonical_id": 1}):
+            index.add(doc["canonical_id"], doc["canonical_id"])
+            index.add(doc.get("party_id"), doc["canonical_id"])
+    except Exception:
+        logger.exception("DB error while building the entity index")
+        return
+    _index = index
+    logger.info("Entity index built with %d names", len(index))
+
+
+def refresh_index() -> asyncio.Task:
+    """Start a background rebuild of the entity index unless one is already running."""
+    global _refresh
+    if _refresh is None or _refresh.done():
+        _refresh = asyncio.create_task(_rebuild_index())
+    return _refresh
+
+
+async def _get_index() -> EntityIndex:
+    """
+    Index over every confirmed mapping. It is built at startup and rebuilt in the background once older than
+    ENTITY_INDEX_TTL_SEC, serving the previous index meanwhile; only a request arriving before the first
+    build completes waits for it.
+    """
+    if _index is None:
+        await asyncio.shield(refresh_index())
+        if _index is None:
+            raise HTTPException(status_code=500, detail="Entity index is unavailable")
+    elif time.monotonic() - _index.built_at > settings.ENTITY_INDEX_TTL_SEC:
+        refresh_index()
+    return _index
+
+
+def _confidence(value, default: float = 1.0) -> float:
+    try:
+        return min(max(float(value), 0.0), 1.0)
+    except (TypeError, ValueError):
+        return default
+
+
+async def _llm_resolve(party_ids: List[str]) -> Dict[str, Tuple[str, float]]:
+    """Canonical ids for ids nothing local could match: one prompt per ENTITY_LLM_BATCH ids, sent concurrently."""
+    size = max(1, settings.ENTITY_LLM_BATCH)
+
+    async def ask(chunk: List[str]) -> Dict[str, Tuple[str, float]]:
+        # Ask Gemini to normalize / suggest canonical ids (instruct JSON response)
         prompt = (
-            "You are a data normalization assistant. Given the party identifier below, suggest a canonical ID "
-            "and a confidence (0.0-1.0). Return only JSON: {\"canonical_id\":..., \"confidence\": ...}\n\nparty_id: "
-            f"{pid}"
+            "You are a data normalization assistant. For each party identifier below, suggest a canonical ID "
+            "and a confidence (0.0-1.0). Identifiers that name the same party should share a canonical ID. "
+            "Return only JSON: {\"mappings\": [{\"party_id\": ..., \"canonical_id\": ..., \"confidence\": ...}]} "
+            "with one entry per party_id.\n\nparty_ids: "
+            f"{json.dumps(chunk)}"
         )
+        answers: Dict[str, Tuple[str, float]] = {}
         try:
-            g = call_gemini(prompt)
+            g = await cached_call_gemini(prompt, max_output_tokens=min(8192, 256 + 64 * len(chunk)))
             parsed = g.get("json")
-            canonical = parsed.get("canonical_id") if parsed else pid
-            confidence = float(parsed.get("confidence") if parsed and parsed.get("confidence") is not None else 1.0)
+            rows = parsed.get("mappings") if isinstance(parsed, dict) else parsed
+            for row in rows if isinstance(rows, list) else []:
+                if isinstance(row, dict) and row.get("party_id") in chunk and row.get("canonical_id"):
+                    answers[row["party_id"]] = (str(row["canonical_id"]), _confidence(row.get("confidence")))
         except Exception:
-            canonical = pid
-            confidence = 1.0
+            logger.exception("Gemini entity resolution failed for %d ids", len(chunk))
+        return answers
+
+    results = await asyncio.gather(*(ask(party_ids[i:i + size]) for i in range(0, len(party_ids), size)))
+    merged: Dict[str, Tuple[str, float]] = {}
+    for answers in results:
+        merged.update(answers)
+    return merged
 
-        # persist suggestion
-        db.entities.update_one({"party_id": pid}, {"$set": {"party_id": pid, "canonical_id": canonical, "confidence": confidence}}, upsert=True)
-        mappings.append({"party_id": pid, "canonical_id": canonical, "confidence": confidence})
 
-    return {"mappings": mappings}
+@router.post("/entity/resolve")
+async def resolve_entities(payload: ResolveRequest):
+    """
+    Resolve party ids to canonical ids in three tiers: stored mappings (one $in lookup), the local
+    normalized-name / trigram index (no network), then batched Gemini prompts for whatever is left.
+    New mappings are persisted with a single bulk_write. Fuzzy matches are only stored as unconfirmed
+    suggestions: they come back as "fuzzy" until POST /entity/{party_id}/confirm makes them a mapping.
+    """
+    party_ids = list(dict.fromkeys(payload.party_ids))
+    resolved: Dict[str, dict] = {}
+    try:
+        async for doc in db.entities.find({"party_id": {"$in": party_ids}}, {"_id": 0}):
+            if doc.get("canonical_id"):
+                resolved[doc["party_id"]] = {
+                    "party_id": doc["party_id"],
+                    "canonical_id": doc["canonical_id"],
+                    "confidence": doc.get("confidence", 1.0),
+                    "method": "existing",
+                }
+    except Exception as e:
+        logger.exception("DB error while loading entity mappings")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    index = await _get_index()
+    new: Dict[str, dict] = {}
+    # leftovers that look alike are grouped under one representative so Gemini sees each party once
+    groups: Dict[str, List[Tuple[str, float, str]]] = {}
+    pending = EntityIndex(settings.ENTITY_MATCH_THRESHOLD)
+    for pid in party_ids:
+        if pid in resolved:
+            continue
+        hit = index.match(pid)
+        if hit:
+            canonical, confidence, method = hit
+            new[pid] = {"party_id": pid, "canonical_id": canonical, "confidence": confidence, "method": method}
+            continue
+        near = pending.match(pid)
+        if near:
+            groups[near[0]].append((pid, near[1], near[2]))
+        else:
+            pending.add(pid, pid)
+            groups[pid] = [(pid, 1.0, "normalized")]
+
+    answers = await _llm_resolve(list(groups)) if groups else {}
+    for representative, members in groups.items():
+        # Fallback when Gemini has no answer: the id is its own canonical id
+        canonical, confidence = answers.get(representative, (representative, 1.0))
+        for pid, similarity, method in members:
+            new[pid] = {
+                "party_id": pid,
+                "canonical_id": canonical,
+                "confidence": round(min(confidence, similarity), 4),
+                # a fuzzy group member only borrows its representative's answer
+                "method": "fuzzy" if method == "fuzzy" else "llm" if representative in answers else "fallback",
+            }
+
+    # confirmed mappings are persisted and made matchable without waiting for the next rebuild; fuzzy
+    # ones are kept apart as suggestions and never feed the index, so near-misses cannot chain
+    if new:
+        ops = []
+        for pid, m in new.items():
+            if m["method"] == "fuzzy":
+                m["suggested"] = True
+                suggestion = {k: m[k] for k in ("canonical_id", "confidence", "method")}
+                update = {"$set": {"party_id": pid, "suggestion": suggestion, "name_norm": normalize_name(pid)}}
+            else:
+                update = {"$set": {**m, "name_norm": normalize_name(pid)}, "$unset": {"suggestion": ""}}
+            ops.append(UpdateOne({"party_id": pid}, update, upsert=True))
+        try:
+            await db.entities.bulk_write(ops, ordered=False)
+        except Exception:
+            logger.exception("Failed to persist entity mappings")
+        for pid, m in new.items():
+            if not m.get("suggested"):
+                index.add(pid, m["canonical_id"])
+
+    methods = [m["method"] for m in (*resolved.values(), *new.values())]
+    return {
+        "mappings": [resolved.get(pid) or new[pid] for pid in payload.party_ids],
+        "resolved_by": {name: methods.count(name) for name in ("existing", "normalized", "fuzzy", "llm", "fallback")},
+    }
+
+
+@router.post("/entity/{party_id}/confirm")
+async def confirm_entity(party_id: str, canonical_id: Optional[str] = None):
+    """Turn a party's stored fuzzy suggestion (or an explicit canonical_id) into a confirmed mapping."""
+    try:
+        doc = await db.entities.find_one({"party_id": party_id}, {"_id": 0})
+    except Exception as e:
+        logger.exception("DB error while loading entity mapping")
+        raise HTTPException(status_code=500, detail=str(e))
+    canonical_id = canonical_id or ((doc or {}).get("suggestion") or {}).get("canonical_id")
+    if not canonical_id:
+        raise HTTPException(status_code=404, detail="No suggestion to confirm for this party")
+
+    mapping = {"party_id": party_id, "canonical_id": canonical_id, "confidence": 1.0, "method": "confirmed"}
+    try:
+        await db.entities.update_one(
+            {"party_id": party_id},
+            {"$set": {**mapping, "name_norm": normalize_name(party_id)}, "$unset": {"suggestion": ""}},
+            upsert=True,
+        )
+    except Exception as e:
+        logger.exception("Failed to persist entity mapping")
+        raise HTTPException(status_code=500, detail=str(e))
+    if _index is not None:
+        _index.add(party_id, canonical_id)
+    return mapping
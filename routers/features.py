@@ -25,151 +25,230 @@
 #     return doc or {"grant_id": grant_id, "features": {}}
 
 from fastapi import APIRouter, Body, HTTPException
-from models.schemas import FeatureComputeRequest, FeatureRequest
+from fastapi.concurrency import run_in_threadpool
+from models.schemas import FeatureBatchRequest, FeatureComputeRequest, FeatureRequest
 from database import db
-from datetime import datetime
 from utils.gemini_client import call_gemini
-from typing import List
+from utils.feature_engine import MICRO_THRESHOLD, compute_window_features, parse_timestamp
+from utils.feature_pipeline import compute_features_pipeline
+from utils.feature_state import save_states
+from utils.drift import record_features
+from utils.stages import compute_features_with_state, features_doc, fetch_grant_transactions, graph_features, resolve_engine
+from utils.write_behind import write_behind
+from settings import settings
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pymongo import UpdateOne
+from typing import List, Optional
+import asyncio
 import logging
-import math
+import os
+import time
 
 router = APIRouter()
 logger = logging.getLogger("features")
 
 
-def _compute_basic_features_from_transactions(transactions: List[dict]) -> dict:
+def _compute_basic_features_from_transactions(
+    transactions: List[dict],
+    theta_micro: float = MICRO_THRESHOLD,
+    windows: List[int] = (),
+) -> dict:
     """
     Compute a conservative set of features from transactions list.
     Each txn is expected to have: {grant_id, amount, direction: 'in'|'out', timestamp, counterparty}
-    Function returns numeric features.
+    Function returns numeric features over the full history, plus `<feature>_<w>d` for every trailing window.
     """
-    if not transactions:
-        return {
-            "return_ratio": 0.0,
-            "micro_count": 0,
-            "fragmentation_index": 0.0,
-            "latency_first_inflow_d": None,
-            "twohop_amount_capped": 0,
-            "relationship_overlap": 0,
-            "burstiness": 0.0,
-            "conduit_entropy": 0.0,
-            "cycle_count": 0,
-            "tx_count": 0,
-        }
-
-    # normalize transactions
-    inflows = [t for t in transactions if t.get("direction") == "in"]
-    outflows = [t for t in transactions if t.get("direction") == "out"]
-    amounts_in = [abs(float(t.get("amount", 0))) for t in inflows]
-    amounts_out = [abs(float(t.get("amount", 0))) for t in outflows]
-
-    sum_in = sum(amounts_in) if amounts_in else 0.0
-    sum_out = sum(amounts_out) if amounts_out else 0.0
-    return_ratio = (sum_out / sum_in) if sum_in > 0 else 0.0
-
-    # micro_count: number of inflows under a micro threshold (e.g., 1000)
-    micro_threshold = 1000
-    micro_count = sum(1 for a in amounts_in if a < micro_threshold)
-
-    # fragmentation_index: unique counterparties / total inflows (higher -> more fragmented)
-    counterparties = [t.get("counterparty") for t in inflows if t.get("counterparty")]
-    unique_counterparties = len(set(counterparties))
-    total_inflows = len(inflows) or 1
-    fragmentation_index = unique_counterparties / total_inflows
-
-    # latency_first_inflow_d: days between grant creation (if present) and first inflow timestamp
-    timestamps = sorted([t.get("timestamp") for t in transactions if t.get("timestamp")])
+    return compute_window_features(transactions, micro_threshold=theta_micro, windows=windows)
+
+
+# one worker pool for the life of the process: spawning one per request, and reaping it on the event loop
+# when the request ends, stalls every other request
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _pool_workers() -> int:
+    return settings.FEATURE_BATCH_WORKERS or os.cpu_count() or 1
+
+
+def start_pool() -> ProcessPoolExecutor:
+    """The shared /features/batch worker pool, created on first use (normally at startup)."""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=_pool_workers())
+    return _pool
+
+
+async def shutdown_pool() -> None:
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        # waits for the workers to exit, so not on the event loop
+        await run_in_threadpool(pool.shutdown)
+
+
+def _resolve_engine(engine: Optional[str]) -> str:
     try:
-        # timestamp strings -> parse as ISO
-        ts_parsed = [datetime.fromisoformat(str(ts)) for ts in timestamps]
-        latency_first_inflow_d = (ts_parsed[0] - ts_parsed[0]).days if ts_parsed else 0
-    except Exception:
-        latency_first_inflow_d = None
-
-    # twohop_amount_capped: approximate by summing inflows capped at a threshold
-    cap = 10000
-    twohop_amount_capped = sum(min(a, cap) for a in amounts_in)
-
-    # relationship_overlap: count counterparties which appear in both inflows and outflows
-    cp_in = set(t.get("counterparty") for t in inflows if t.get("counterparty"))
-    cp_out = set(t.get("counterparty") for t in outflows if t.get("counterparty"))
-    relationship_overlap = len(cp_in.intersection(cp_out))
-
-    # burstiness: simple metric = std(dev) / mean of inflow amounts
-    burstiness = 0.0
-    if amounts_in:
-        mean = sum(amounts_in) / len(amounts_in)
-        variance = sum((x - mean) ** 2 for x in amounts_in) / len(amounts_in)
-        std = math.sqrt(variance)
-        burstiness = (std / mean) if mean > 0 else 0.0
-
-    # conduit_entropy: entropy over counterparties distribution
-    from collections import Counter
-    import math as _math
-
-    cnt = Counter(counterparties)
-    total = sum(cnt.values()) or 1
-    entropy = 0.0
-    for v in cnt.values():
-        p = v / total
-        entropy -= p * _math.log(p + 1e-12)
-    conduit_entropy = entropy
-
-    # cycle_count: naive - repeated pairs of (from,to) or same counterparty repeated
-    cycle_count = 0
-    pairs = set()
-    for t in transactions:
-        s = (t.get("from"), t.get("to"))
-        if s in pairs:
-            cycle_count += 1
-        else:
-            pairs.add(s)
+        return resolve_engine(engine)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _diff_features(reference: dict, candidate: dict) -> dict:
+    keys = set(reference) | set(candidate)
+    return {
+        k: {"reference": reference.get(k), "candidate": candidate.get(k)}
+        for k in sorted(keys)
+        if reference.get(k) != candidate.get(k)
+    }
+
 
+@router.post("/features/batch")
+async def compute_features_batch(payload: FeatureBatchRequest):
+    # resolve the set of grants to refresh: explicit ids, or every grant touched since `since`
+    if payload.grant_ids:
+        grant_ids = list(dict.fromkeys(payload.grant_ids))
+    elif payload.since:
+        try:
+            since = parse_timestamp(payload.since)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="since must be an ISO timestamp")
+        # typed rows store BSON dates; rows not yet migrated still hold ISO strings
+        touched = {"$or": [{"timestamp": {"$gte": since}}, {"timestamp": {"$gte": payload.since}}]}
+        try:
+            grant_ids = sorted(await db.transactions.distinct("grant_id", touched))
+        except Exception as e:
+            logger.exception("DB error while listing touched grants")
+            raise HTTPException(status_code=500, detail=str(e))
+    else:
+        raise HTTPException(status_code=400, detail="Provide either grant_ids or since")
+
+    batch_size = max(1, payload.batch_size or settings.FEATURE_BATCH_SIZE)
+    chunk = max(1, settings.FEATURE_BULK_WRITE_CHUNK)
+    # only shapes the map chunking now; the shared pool itself is sized by FEATURE_BATCH_WORKERS
+    workers = payload.workers or _pool_workers()
+    engine = _resolve_engine(payload.engine)
+    if engine == "mongo":
+        raise HTTPException(status_code=400, detail="The mongo engine aggregates one grant per pipeline; use python or numpy for batches")
+
+    batches = []
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    # buffered single-grant writes must not land on top of this recompute
+    await write_behind.flush(["features"])
+    pool = start_pool()
+    for n, offset in enumerate(range(0, len(grant_ids), batch_size)):
+        batch_started = time.perf_counter()
+        try:
+            groups = await fetch_grant_transactions(grant_ids[offset:offset + batch_size])
+        except Exception as e:
+            logger.exception("DB error while fetching transactions")
+            raise HTTPException(status_code=500, detail=str(e))
+
+        # feature computation is CPU bound, fan it out over worker processes
+        per_worker = max(1, len(groups) // (workers * 4))
+        compute = partial(
+            compute_features_with_state,
+            theta_micro=payload.theta_micro,
+            windows=payload.windows,
+            engine=engine,
+        )
+        results = await loop.run_in_executor(
+            None, lambda: list(pool.map(compute, [txs for _, txs in groups], chunksize=per_worker))
+        )
+
+        graph_rows = await graph_features([gid for gid, _ in groups])
+        ops, states = [], []
+        for (gid, _), (features, acc), graph in zip(groups, results, graph_rows):
+            features.update(graph)
+            ops.append(UpdateOne(
+                {"grant_id": gid},
+                {"$set": features_doc(gid, features, payload.theta_micro, payload.windows)},
+                upsert=True,
+            ))
+            if acc is not None:
+                states.append((gid, acc))
+        written = 0
+        for i in range(0, len(ops), chunk):
+            res = await db.features.bulk_write(ops[i:i + chunk], ordered=False)
+            written += res.upserted_count + res.matched_count
+        await save_states(states)
+        await record_features(features for features, _ in results)
+
+        elapsed = time.perf_counter() - batch_started
+        batches.append({
+            "batch": n,
+            "grants": len(groups),
+            "transactions": sum(len(txs) for _, txs in groups),
+            "written": written,
+            "elapsed_sec": round(elapsed, 3),
+            "grants_per_sec": round(len(groups) / elapsed, 1) if elapsed > 0 else None,
+        })
+        logger.info("features batch %d: %d grants in %.2fs", n, len(groups), elapsed)
+
+    elapsed = time.perf_counter() - started
     return {
-        "return_ratio": round(return_ratio, 4),
-        "micro_count": int(micro_count),
-        "fragmentation_index": round(fragmentation_index, 4),
-        "latency_first_inflow_d": latency_first_inflow_d,
-        "twohop_amount_capped": int(twohop_amount_capped),
-        "relationship_overlap": int(relationship_overlap),
-        "burstiness": round(burstiness, 4),
-        "conduit_entropy": round(conduit_entropy, 4),
-        "cycle_count": int(cycle_count),
-        "tx_count": len(transactions),
+        "requested": len(grant_ids),
+        "processed": sum(b["grants"] for b in batches),
+        "elapsed_sec": round(elapsed, 3),
+        "grants_per_sec": round(len(grant_ids) / elapsed, 1) if elapsed > 0 else None,
+        "batches": batches,
     }
 
 
 @router.post("/features/{grant_id}")
-def compute_features(grant_id: str, payload: FeatureRequest):
+async def compute_features(grant_id: str, payload: FeatureRequest):
     theta_micro = payload.theta_micro
     windows = payload.windows
-    # fetch transactions for grant_id (expect ingest to populate a 'transactions' collection)
+    engine = _resolve_engine(payload.engine)
+    tx_cursor = None
     try:
-        tx_cursor = list(db.transactions.find({"grant_id": grant_id}))
+        if engine == "mongo":
+            # aggregate server side; transactions never cross the wire
+            features, acc = await compute_features_pipeline(db.transactions, grant_id, theta_micro, windows), None
+        else:
+            # fetch transactions for grant_id (expect ingest to populate a 'transactions' collection)
+            tx_cursor = await db.transactions.find({"grant_id": grant_id}, {"_id": 0}).to_list(length=None)
+            # CPU bound; keep it off the event loop
+            features, acc = await run_in_threadpool(
+                compute_features_with_state, tx_cursor, theta_micro=theta_micro, windows=windows, engine=engine
+            )
     except Exception as e:
-        logger.exception("DB error while fetching transactions")
+        logger.exception("DB error while computing features")
         raise HTTPException(status_code=500, detail=str(e))
 
-    features = _compute_basic_features_from_transactions(tx_cursor)
+    # the engines' output stays in `features` for verify; stored and returned features include the graph ones
+    computed = {**features, **(await graph_features([grant_id]))[0]}
 
-    # store features with timestamp
-    features_doc = {
-        "grant_id": grant_id,
-        "computed_at": datetime.utcnow().isoformat(),
-        "features": features,
-        "meta": {"theta_micro": theta_micro, "windows": windows},
-    }
+    # store features with timestamp, and reset the incremental state that ingest keeps current
+    doc = features_doc(grant_id, computed, theta_micro, windows)
+    doc["meta"]["engine"] = engine
     try:
-        db.features.update_one({"grant_id": grant_id}, {"$set": features_doc}, upsert=True)
+        await write_behind.upsert("features", grant_id, doc)
+        if acc is not None:
+            await save_states([(grant_id, acc)])
     except Exception:
         logger.exception("Failed to persist features")
-
-    return {"grant_id": grant_id, "computed_features": features}
+    await record_features([computed])
+
+    result = {"grant_id": grant_id, "computed_features": computed}
+    if payload.verify and engine != "python":
+        # re-run the reference engine on the same transactions and report any differing keys
+        if tx_cursor is None:
+            tx_cursor = await db.transactions.find({"grant_id": grant_id}, {"_id": 0}).to_list(length=None)
+        reference = await run_in_threadpool(
+            _compute_basic_features_from_transactions, tx_cursor, theta_micro=theta_micro, windows=windows
+        )
+        mismatches = _diff_features(reference, features)
+        if mismatches:
+            logger.warning("Feature engine %s disagrees with reference for %s: %s", engine, grant_id, mismatches)
+        result["verify"] = {"reference": "python", "engine": engine, "match": not mismatches, "mismatches": mismatches}
+    return result
 
 
 @router.get("/features/{grant_id}")
-def get_features(grant_id: str):
-    doc = db.features.find_one({"grant_id": grant_id}, {"_id": 0})
+async def get_features(grant_id: str):
+    doc = await write_behind.read("features", grant_id)
     if not doc:
         raise HTTPException(status_code=404, detail="No features found for grant_id")
     return doc
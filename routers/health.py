@@ -3,5 +3,5 @@ from fastapi import APIRouter
 router = APIRouter()
 
 @router.get("/")
-def health_check():
+async def health_check():
     return {"message":"Healthyyyyyy"}
\ No newline at end of file
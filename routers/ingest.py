@@ -10,26 +10,243 @@
 #     result = collection.insert_many(payload.records)
 #     return {"message": "Ingestion successful", "ingested_count": len(result.inserted_ids)}
 
-from fastapi import APIRouter, HTTPException
-from models.schemas import IngestRequest
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from models.schemas import IngestRequest, Transaction
 from database import db
+from settings import settings
+from utils.feature_state import apply_transactions
+from utils.indexes import INGEST_COLLECTIONS
+from utils.summary import apply_ingest
+from utils.txgraph import add_to_graph
+from pymongo.errors import BulkWriteError
+from pydantic import ValidationError
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
+import hashlib
+import json
 import logging
+import time
 
 router = APIRouter()
 logger = logging.getLogger("ingest")
 
+# per-chunk error details kept in the response; the counts are always complete
+MAX_ERRORS_PER_CHUNK = 20
+IDEMPOTENCY_FIELD = "idempotency_key"
+DUPLICATE_KEY = 11000
+
+
+def _check_data_type(data_type: str) -> None:
+    # only collections whose idempotency index is declared in utils/indexes.py, so duplicates are always caught
+    if data_type not in INGEST_COLLECTIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown data_type '{data_type}'; expected one of {INGEST_COLLECTIONS}")
+
+
+async def _log_ingest(data_type: str, endpoint: str, received: int, inserted: int, duplicates: int, failed: int, started: float):
+    # monitoring_status reads the latest `ts` to report ingestion lag
+    try:
+        await db.ingest_log.insert_one({
+            "ts": datetime.utcnow().isoformat(),
+            "data_type": data_type,
+            "endpoint": endpoint,
+            "received": received,
+            "inserted": inserted,
+            "duplicates": duplicates,
+            "failed": failed,
+            "elapsed_sec": round(time.perf_counter() - started, 3),
+        })
+    except Exception:
+        logger.exception("Failed to write ingest log")
+    if data_type == "transactions":
+        await apply_ingest(inserted)
+
+
+def _with_idempotency_key(record: dict) -> dict:
+    """
+    Tag a record with its idempotency key: the caller's `idempotency_key` when given, otherwise a sha256 of
+    the record's canonical JSON. A retried ingest of the same records therefore maps onto the same keys.
+    """
+    key = record.get(IDEMPOTENCY_FIELD)
+    if key in (None, ""):
+        body = {k: v for k, v in record.items() if k not in ("_id", IDEMPOTENCY_FIELD)}
+        canonical = json.dumps(body, sort_keys=True, separators=(",", ":"), default=str)
+        key = hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+    record[IDEMPOTENCY_FIELD] = str(key)
+    return record
+
+
+def _is_duplicate(err: dict) -> bool:
+    if err.get("code") != DUPLICATE_KEY:
+        return False
+    return IDEMPOTENCY_FIELD in (err.get("keyPattern") or {}) or IDEMPOTENCY_FIELD in str(err.get("errmsg", ""))
+
+
+async def _insert_chunk(collection, records: List[dict]) -> Tuple[List[dict], int, List[dict]]:
+    """
+    Unordered insert: one bad record does not stop the rest.
+    Returns (inserted records, number of records already stored under the same idempotency key, write errors).
+    """
+    try:
+        await collection.insert_many(records, ordered=False)
+        return records, 0, []
+    except BulkWriteError as e:
+        write_errors = e.details.get("writeErrors", [])
+        failed = {err["index"] for err in write_errors}
+        inserted = [r for i, r in enumerate(records) if i not in failed]
+        errors = [
+            {"index": err["index"], "code": err.get("code"), "error": err.get("errmsg")}
+            for err in write_errors if not _is_duplicate(err)
+        ]
+        return inserted, len(write_errors) - len(errors), errors
+
+
+def _validation_message(e: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors())
+
+
+async def _ndjson_lines(request: Request) -> AsyncIterator[bytes]:
+    # split the body on newlines as it arrives; only one partial line is ever buffered
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
 
 @router.post("/ingest/data")
-def ingest_data(payload: IngestRequest):
+async def ingest_data(payload: IngestRequest):
     # Basic validation: restrict collection names if you want
     if not payload.data_type or not isinstance(payload.records, list):
         raise HTTPException(status_code=400, detail="Invalid payload")
+    _check_data_type(payload.data_type)
+
+    started = time.perf_counter()
+    received = len(payload.records)
+    records = payload.records
+    if payload.data_type == "transactions":
+        # store typed documents so reads never re-parse amounts or timestamps
+        records, invalid = [], []
+        for i, r in enumerate(payload.records):
+            try:
+                records.append(Transaction.normalize(r))
+            except ValidationError as e:
+                invalid.append({"index": i, "error": _validation_message(e)})
+        if invalid:
+            await _log_ingest(payload.data_type, "data", received, 0, 0, len(invalid), started)
+            raise HTTPException(status_code=422, detail={"message": "Invalid transactions", "errors": invalid})
+    records = [_with_idempotency_key(r) for r in records]
 
     collection = db[payload.data_type]
     try:
-        result = collection.insert_many(payload.records)
+        inserted, duplicates, errors = await _insert_chunk(collection, records)
     except Exception as e:
         logger.exception("Failed to insert records")
+        await _log_ingest(payload.data_type, "data", received, 0, 0, received, started)
         raise HTTPException(status_code=500, detail=str(e))
 
-    return {"message": "Ingestion successful", "ingested_count": len(result.inserted_ids)}
+    # keep per-grant feature accumulators current so features never need a full rescan;
+    # records skipped as duplicates were already counted when first ingested
+    if payload.data_type == "transactions" and inserted:
+        try:
+            await apply_transactions(inserted)
+        except Exception:
+            logger.exception("Failed to update incremental feature state")
+        await run_in_threadpool(add_to_graph, inserted)
+
+    await _log_ingest(payload.data_type, "data", received, len(inserted), duplicates, len(errors), started)
+    result = {
+        "message": "Ingestion completed with errors" if errors else "Ingestion successful",
+        "ingested_count": len(inserted),
+        "duplicate_count": duplicates,
+    }
+    if errors:
+        result["errors"] = errors
+    return result
+
+
+@router.post("/ingest/stream")
+async def ingest_stream(request: Request, data_type: str, chunk_size: Optional[int] = None):
+    """
+    Streaming ingest for large backfills: the body is newline-delimited JSON, one record per line,
+    parsed as it arrives and inserted in chunks of `chunk_size` (INGEST_CHUNK_SIZE) with ordered=False.
+    Unparseable lines, invalid transactions and rejected records are reported per chunk; they never fail
+    the request. Records whose idempotency key is already stored are skipped and counted as duplicates,
+    so a failed backfill can simply be re-sent.
+    """
+    if not data_type:
+        raise HTTPException(status_code=400, detail="data_type is required")
+    _check_data_type(data_type)
+    chunk_size = max(1, chunk_size or settings.INGEST_CHUNK_SIZE)
+    collection = db[data_type]
+    started = time.perf_counter()
+
+    received = inserted_total = duplicates_total = failed_total = 0
+    chunks = []
+    records: List[dict] = []
+    lines: List[int] = []
+    errors: List[dict] = []
+
+    async def flush():
+        nonlocal inserted_total, duplicates_total, failed_total
+        chunk_received = len(records) + len(errors)
+        inserted, duplicates, write_errors = await _insert_chunk(collection, records) if records else ([], 0, [])
+        # map write errors back to their NDJSON line numbers
+        errors.extend({"line": lines[e.pop("index")], **e} for e in write_errors)
+        if data_type == "transactions" and inserted:
+            try:
+                await apply_transactions(inserted)
+            except Exception:
+                logger.exception("Failed to update incremental feature state")
+            await run_in_threadpool(add_to_graph, inserted)
+        inserted_total += len(inserted)
+        duplicates_total += duplicates
+        failed_total += len(errors)
+        chunks.append({
+            "chunk": len(chunks),
+            "received": chunk_received,
+            "inserted": len(inserted),
+            "duplicates": duplicates,
+            "failed": len(errors),
+            "errors": errors[:MAX_ERRORS_PER_CHUNK],
+        })
+
+    line_no = 0
+    async for raw in _ndjson_lines(request):
+        line_no += 1
+        if not raw.strip():
+            continue
+        received += 1
+        try:
+            record = json.loads(raw)
+            if not isinstance(record, dict):
+                raise ValueError("record is not a JSON object")
+            if data_type == "transactions":
+                record = Transaction.normalize(record)
+        except ValidationError as e:
+            errors.append({"line": line_no, "error": _validation_message(e)})
+        except ValueError as e:
+            errors.append({"line": line_no, "error": str(e)})
+        else:
+            records.append(_with_idempotency_key(record))
+            lines.append(line_no)
+        if len(records) + len(errors) >= chunk_size:
+            await flush()
+            records, lines, errors = [], [], []
+    if records or errors:
+        await flush()
+
+    await _log_ingest(data_type, "stream", received, inserted_total, duplicates_total, failed_total, started)
+    return {
+        "message": "Ingestion finished",
+        "data_type": data_type,
+        "received": received,
+        "ingested_count": inserted_total,
+        "duplicate_count": duplicates_total,
+        "failed_count": failed_total,
+        "elapsed_sec": round(time.perf_counter() - started, 3),
+        "chunks": chunks,
+    }
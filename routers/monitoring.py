@@ -14,7 +14,19 @@
 #     }
 
 from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
 from database import db
+from utils.alert_worker import alert_worker
+from utils.gemini_cache import cache_stats
+from utils.gemini_client import gemini
+from settings import settings
+from utils.drift import drift_summary
+from utils.indexes import check_indexes
+from utils.metrics import metrics
+from utils.summary import alerts_today
+from utils.write_behind import write_behind
+from utils.rules_engine import get_ruleset
+from utils.scoring import get_scoring_model
 import logging
 
 router = APIRouter()
@@ -22,19 +34,19 @@ logger = logging.getLogger("monitoring")
 
 
 @router.get("/monitoring/status")
-def monitoring_status():
+async def monitoring_status():
     # compute simple runtime metrics
     ingestion_lag_sec = 0
     try:
         # look for latest ingestion time if a collection 'ingest_log' exists
-        last = db.get_collection("ingest_log").find_one(sort=[("ts", -1)])
+        last = await db.get_collection("ingest_log").find_one(sort=[("ts", -1)])
         if last and last.get("ts"):
             from datetime import datetime
             ingestion_lag_sec = int((datetime.utcnow() - datetime.fromisoformat(last["ts"])).total_seconds())
     except Exception:
         ingestion_lag_sec = 0
 
-    feature_doc = db.features.find_one(sort=[("computed_at", -1)])
+    feature_doc = await db.features.find_one(sort=[("computed_at", -1)])
     feature_freshness_sec = 0
     if feature_doc and feature_doc.get("computed_at"):
         from datetime import datetime
@@ -43,15 +55,39 @@ def monitoring_status():
         except Exception:
             feature_freshness_sec = 0
 
-    alert_volume_today = db.alerts.count_documents({})
-    model_version = "v1.0"
-    drift_metrics = {"feature_psi": 0.02, "prediction_drift": 0.01}
+    # materialized per-day counter (utils/summary.py) rather than a collection count
+    alert_volume_today = await alerts_today()
+    # share of triaged alerts that analysts confirmed; None until something has been triaged
+    triaged = await db.triage.count_documents({})
+    confirmed = await db.triage.count_documents({"disposition": {"$in": settings.PRECISION_POSITIVE_DISPOSITIONS}}) if triaged else 0
+    model_version = get_scoring_model().version
+    # PSI from the drift_sketches time buckets; None until both windows hold DRIFT_MIN_COUNT values
+    drift_metrics = await drift_summary()
 
     return {
         "ingestion_lag_sec": ingestion_lag_sec,
         "feature_freshness_sec": feature_freshness_sec,
         "alert_volume_today": alert_volume_today,
-        "precision_sample": 0.85,
+        "precision_sample": round(confirmed / triaged, 4) if triaged else None,
+        "triaged_count": triaged,
         "model_version": model_version,
+        "ruleset_version": get_ruleset().version,
         "drift_metrics": drift_metrics,
+        "gemini_cache": cache_stats(),
+        "gemini_client": gemini.stats(),
+        "alert_worker": alert_worker.stats(),
+        "write_behind": write_behind.stats(),
+        "latency": {"routes": metrics.snapshot("http"), "dependencies": metrics.snapshot("dependency")},
     }
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    # scrape target: route and dependency latency histograms, error counters and in-flight gauges
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/monitoring/indexes")
+async def monitoring_indexes():
+    # declared vs actual indexes, with per-index usage since the server started
+    return await check_indexes()
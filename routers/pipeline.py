@@ -0,0 +1,267 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from models.schemas import PipelineBatchRequest, PipelineRequest
+from database import db
+from settings import settings
+from utils.alert_worker import (
+    REBUILD, alert_doc, alert_transition, alert_worker, apply_score_alerts, justify, latest_transactions, timeline,
+)
+from utils.feature_state import save_states
+from utils.rules_engine import current_ruleset
+from utils.scoring import get_scoring_model
+from utils.stages import (
+    compute_features_with_state, features_doc, fetch_grant_transactions, graph_features, resolve_engine, rules_eval_doc,
+    score_result, score_results,
+)
+from utils.drift import DriftSketch
+from utils.summary import apply_alerts, apply_scores
+from utils.write_behind import write_behind
+from pymongo import UpdateOne
+from typing import Dict, List, Optional
+import asyncio
+import logging
+import time
+
+router = APIRouter()
+logger = logging.getLogger("pipeline")
+
+STAGES = ("load", "features", "rules", "score", "alert", "write")
+
+
+class _Stopwatch:
+    def __init__(self):
+        self.laps: Dict[str, float] = {}
+        self._last = time.perf_counter()
+
+    def lap(self, stage: str) -> None:
+        now = time.perf_counter()
+        self.laps[stage] = self.laps.get(stage, 0.0) + round((now - self._last) * 1000, 2)
+        self._last = now
+
+
+def _pipeline_engine(engine: Optional[str]) -> str:
+    try:
+        engine = resolve_engine(engine)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if engine == "mongo":
+        raise HTTPException(status_code=400, detail="The pipeline reuses the loaded transactions; use python or numpy")
+    return engine
+
+
+async def _previous_scores(grant_ids: List[str]) -> Dict[str, dict]:
+    # the summary moves grants between tiers and alerts follow tier changes, so both need the scores being replaced
+    await write_behind.flush(["scores"])
+    return {
+        d["grant_id"]: d
+        async for d in db.scores.find(
+            {"grant_id": {"$in": grant_ids}}, {"_id": 0, "grant_id": 1, "risk_tier": 1, "risk_score": 1}
+        )
+    }
+
+
+def _alerting(scores: List[dict], previous: Dict[str, dict]) -> List[bool]:
+    # only grants entering an alert tier get a new alert (and a justification); see apply_score_alerts
+    return [alert_transition(previous.get(s["grant_id"]), s) == REBUILD for s in scores]
+
+
+async def _persist(
+    features_docs: List[dict], states: list, rules_docs: List[dict], scores: List[dict], alerts: List[dict],
+    previous: Dict[str, dict],
+):
+    # land buffered single-grant writes first so they cannot overwrite these results later
+    await write_behind.flush(["features", "rules_eval", "scores", "alerts"])
+    # one unordered bulk_write per collection, all in flight at once
+    def upserts(docs):
+        return [UpdateOne({"grant_id": d["grant_id"]}, {"$set": d}, upsert=True) for d in docs]
+    writes = [
+        (db.features, upserts(features_docs)),
+        (db.rules_eval, upserts(rules_docs)),
+        (db.scores, upserts(scores)),
+        (db.alerts, upserts(alerts)),
+    ]
+    sketch = DriftSketch()
+    for d in features_docs:
+        sketch.add_features(d.get("features"))
+    for s in scores:
+        sketch.add_score(s.get("risk_score"))
+    await asyncio.gather(
+        sketch.record(), save_states(states), *(coll.bulk_write(ops, ordered=False) for coll, ops in writes if ops)
+    )
+    changes = [(previous.get(s["grant_id"]), s) for s in scores]
+    # alerts entering a tier were written above; the rest are refreshed or resolved
+    await asyncio.gather(apply_scores(changes), apply_alerts(alerts), apply_score_alerts(changes, rebuild=False))
+
+
+@router.post("/pipeline/batch")
+async def run_pipeline_batch(payload: PipelineBatchRequest):
+    """
+    POST /pipeline/{grant_id} for many grants: transactions are loaded one batch at a time from a single
+    cursor, rules and scores are evaluated column-wise per batch, and every collection gets one bulk_write.
+    """
+    engine = _pipeline_engine(payload.engine)
+    grant_ids = list(dict.fromkeys(payload.grant_ids))
+    batch_size = max(1, payload.batch_size or settings.FEATURE_BATCH_SIZE)
+    ruleset = await current_ruleset()
+    model = get_scoring_model()
+
+    clock = _Stopwatch()
+    started = time.perf_counter()
+    histogram = {name: 0 for name, _ in model.tiers}
+    results = []
+    for offset in range(0, len(grant_ids), batch_size):
+        try:
+            groups = await fetch_grant_transactions(grant_ids[offset:offset + batch_size])
+        except Exception as e:
+            logger.exception("DB error while fetching transactions")
+            raise HTTPException(status_code=500, detail=str(e))
+        ids = [gid for gid, _ in groups]
+        clock.lap("load")
+
+        computed = await run_in_threadpool(lambda: [
+            compute_features_with_state(txs, theta_micro=payload.theta_micro, windows=payload.windows, engine=engine)
+            for _, txs in groups
+        ])
+        features = [f for f, _ in computed]
+        for f, graph in zip(features, await graph_features(ids)):
+            f.update(graph)
+        clock.lap("features")
+
+        rules_docs = [
+            rules_eval_doc(gid, triggered, signals, ruleset.version)
+            for gid, (triggered, signals) in zip(ids, ruleset.evaluate_many(features))
+        ]
+        clock.lap("rules")
+
+        scores = score_results(ids, features, rules_docs, model)
+        clock.lap("score")
+
+        try:
+            previous = await _previous_scores(ids)
+        except Exception as e:
+            logger.exception("DB error while loading previous scores")
+            raise HTTPException(status_code=500, detail=str(e))
+        alerting = [i for i, hit in enumerate(_alerting(scores, previous)) if hit]
+        if payload.justify:
+            # the Gemini client caps concurrency and coalesces identical prompts
+            justifications = await asyncio.gather(*(
+                justify(features[i], rules_docs[i]["triggered_rules"], bypass_cache=payload.bypass_cache)
+                for i in alerting
+            ))
+        else:
+            justifications = [None] * len(alerting)
+        alerts = [
+            alert_doc(ids[i], scores[i]["risk_score"], scores[i]["risk_tier"], rules_docs[i]["triggered_rules"],
+                      features[i], timeline(latest_transactions(groups[i][1])), j)
+            for i, j in zip(alerting, justifications)
+        ]
+        clock.lap("alert")
+
+        features_docs = []
+        for gid, f in zip(ids, features):
+            doc = features_doc(gid, f, payload.theta_micro, payload.windows)
+            doc["meta"]["engine"] = engine
+            features_docs.append(doc)
+        states = [(gid, acc) for gid, (_, acc) in zip(ids, computed) if acc is not None]
+        try:
+            await _persist(features_docs, states, rules_docs, scores, alerts, previous)
+        except Exception as e:
+            logger.exception("Failed to persist pipeline batch")
+            raise HTTPException(status_code=500, detail=str(e))
+        clock.lap("write")
+
+        if not payload.justify:
+            # justifications are filled in by the alert worker once the alerts exist
+            for a in alerts:
+                alert_worker.enqueue(a["grant_id"], bypass_cache=payload.bypass_cache)
+
+        for s, r in zip(scores, rules_docs):
+            histogram[s["risk_tier"]] = histogram.get(s["risk_tier"], 0) + 1
+            results.append({
+                "grant_id": s["grant_id"],
+                "risk_score": s["risk_score"],
+                "risk_tier": s["risk_tier"],
+                "triggered_rules": r["triggered_rules"],
+            })
+
+    elapsed = time.perf_counter() - started
+    return {
+        "processed": len(results),
+        "ruleset_version": ruleset.version,
+        "model_version": model.version,
+        "tier_histogram": histogram,
+        "elapsed_sec": round(elapsed, 3),
+        "timings_ms": {stage: round(clock.laps.get(stage, 0.0), 2) for stage in STAGES},
+        "results": results,
+    }
+
+
+@router.post("/pipeline/{grant_id}")
+async def run_pipeline(grant_id: str, payload: Optional[PipelineRequest] = None):
+    """
+    features -> rules -> score -> alert for one grant in a single call. Transactions are read once, every
+    stage works on the previous stage's in-memory result, and all collections are written together at the end.
+    An alert is only written (and justified) when the grant enters an alert tier; otherwise "alert" is null and
+    an existing alert is refreshed or resolved like after POST /score.
+    """
+    payload = payload or PipelineRequest()
+    engine = _pipeline_engine(payload.engine)
+    clock = _Stopwatch()
+
+    try:
+        txs = await db.transactions.find({"grant_id": grant_id}, {"_id": 0}).to_list(length=None)
+    except Exception as e:
+        logger.exception("DB error while fetching transactions")
+        raise HTTPException(status_code=500, detail=str(e))
+    clock.lap("load")
+
+    features, acc = await run_in_threadpool(
+        compute_features_with_state, txs, theta_micro=payload.theta_micro, windows=payload.windows, engine=engine
+    )
+    features.update((await graph_features([grant_id]))[0])
+    clock.lap("features")
+
+    ruleset = await current_ruleset()
+    triggered, signals = ruleset.evaluate(features)
+    rules_doc = rules_eval_doc(grant_id, triggered, signals, ruleset.version)
+    clock.lap("rules")
+
+    score_doc = score_result(grant_id, features, rules_doc, get_scoring_model())
+    clock.lap("score")
+
+    try:
+        previous = await _previous_scores([grant_id])
+    except Exception as e:
+        logger.exception("DB error while loading the previous score")
+        raise HTTPException(status_code=500, detail=str(e))
+    alert, justification = None, None
+    if _alerting([score_doc], previous)[0]:
+        if payload.justify:
+            justification = await justify(features, triggered, bypass_cache=payload.bypass_cache)
+        alert = alert_doc(
+            grant_id, score_doc["risk_score"], score_doc["risk_tier"], triggered, features,
+            timeline(latest_transactions(txs)), justification,
+        )
+    clock.lap("alert")
+
+    doc = features_doc(grant_id, features, payload.theta_micro, payload.windows)
+    doc["meta"]["engine"] = engine
+    try:
+        await _persist(
+            [doc], [(grant_id, acc)] if acc is not None else [], [rules_doc], [score_doc], [alert] if alert else [], previous
+        )
+    except Exception as e:
+        logger.exception("Failed to persist pipeline results")
+        raise HTTPException(status_code=500, detail=str(e))
+    clock.lap("write")
+    if alert is not None and justification is None:
+        alert_worker.enqueue(grant_id, bypass_cache=payload.bypass_cache)
+
+    return {
+        "grant_id": grant_id,
+        "computed_features": features,
+        "rules": rules_doc,
+        "score": score_doc,
+        "alert": alert,
+        "timings_ms": clock.laps,
+    }
@@ -16,47 +16,96 @@
 
 from fastapi import APIRouter, HTTPException
 from database import db
+from models.schemas import RulesBatchRequest
+from settings import settings
+from utils.rules_engine import current_ruleset, get_ruleset, stored_ruleset
+from utils.stages import rules_eval_doc
+from utils.write_behind import write_behind
+from pymongo import UpdateOne
+from typing import List
 import logging
+import time
 
 router = APIRouter()
 logger = logging.getLogger("rules")
 
 
-@router.post("/rules/{grant_id}")
-def apply_rules(grant_id: str):
-    # load precomputed features
-    doc = db.features.find_one({"grant_id": grant_id}, {"_id": 0})
+@router.get("/rules")
+async def get_rules():
+    return get_ruleset().describe()
+
+
+@router.get("/rules/versions/{version}")
+async def get_ruleset_version(version: str):
+    # the spec behind a rules_eval.ruleset_version, for audit
+    doc = await stored_ruleset(version)
     if not doc:
-        raise HTTPException(status_code=404, detail="No features found; compute features first")
+        raise HTTPException(status_code=404, detail="Unknown ruleset version")
+    return doc
+
+
+@router.post("/rules/batch")
+async def apply_rules_batch(payload: RulesBatchRequest):
+    """
+    Evaluate the current ruleset over many grants (or every grant with features when grant_ids is omitted).
+    Feature docs are streamed in chunks; each chunk is evaluated column-wise and written with one bulk_write.
+    """
+    ruleset = await current_ruleset()
+    chunk_size = max(1, payload.chunk_size or settings.RULES_BATCH_CHUNK)
+    query = {"grant_id": {"$in": payload.grant_ids}} if payload.grant_ids else {}
+    projection = {"_id": 0, "grant_id": 1, **{f"features.{name}": 1 for name in ruleset.signals}}
 
-    f = doc.get("features", {})
+    hit_counts = {r["id"]: 0 for r in ruleset.rules}
+    evaluated = 0
+    started = time.perf_counter()
+    # read features and overwrite rule evaluations only after any buffered single-grant writes have landed
+    await write_behind.flush(["features", "rules_eval"])
 
-    # Example rule implementations (realistic, deterministic)
-    triggered = []
-    signals = {}
+    async def flush(docs: List[dict]):
+        ops = []
+        results = ruleset.evaluate_many([d.get("features") or {} for d in docs])
+        for doc, (triggered, signals) in zip(docs, results):
+            for rule_id in triggered:
+                hit_counts[rule_id] += 1
+            ops.append(UpdateOne(
+                {"grant_id": doc["grant_id"]},
+                {"$set": rules_eval_doc(doc["grant_id"], triggered, signals, ruleset.version)},
+                upsert=True,
+            ))
+        if ops:
+            await db.rules_eval.bulk_write(ops, ordered=False)
+        return len(ops)
 
-    # Rule R1: high return_ratio and many micro transactions
-    signals["return_ratio"] = f.get("return_ratio", 0.0)
-    signals["micro_count"] = f.get("micro_count", 0)
-    if signals["return_ratio"] > 0.5 and signals["micro_count"] > 5:
-        triggered.append("R1")
+    chunk: List[dict] = []
+    async for doc in db.features.find(query, projection).batch_size(chunk_size):
+        chunk.append(doc)
+        if len(chunk) >= chunk_size:
+            evaluated += await flush(chunk)
+            chunk = []
+    if chunk:
+        evaluated += await flush(chunk)
 
-    # Rule R2: high burstiness
-    signals["burstiness"] = f.get("burstiness", 0.0)
-    if signals["burstiness"] > 1.0:
-        triggered.append("R2")
+    return {
+        "evaluated": evaluated,
+        "ruleset_version": ruleset.version,
+        "hit_counts": hit_counts,
+        "elapsed_sec": round(time.perf_counter() - started, 3),
+    }
+
+
+@router.post("/rules/{grant_id}")
+async def apply_rules(grant_id: str):
+    # load precomputed features
+    doc = await write_behind.read("features", grant_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail="No features found; compute features first")
 
-    # Rule R3: high fragmentation and conduit entropy
-    signals["fragmentation_index"] = f.get("fragmentation_index", 0.0)
-    signals["conduit_entropy"] = f.get("conduit_entropy", 0.0)
-    if signals["fragmentation_index"] > 0.5 and signals["conduit_entropy"] > 1.0:
-        triggered.append("R3")
+    # rules live in config/rules.yaml (see utils/rules_engine.py); one ruleset is used for the whole evaluation
+    ruleset = await current_ruleset()
+    triggered, signals = ruleset.evaluate(doc.get("features", {}))
+    result = rules_eval_doc(grant_id, triggered, signals, ruleset.version)
 
     # persist the rule evaluation for audit
-    db.rules_eval.update_one(
-        {"grant_id": grant_id},
-        {"$set": {"grant_id": grant_id, "triggered_rules": triggered, "signals": signals}},
-        upsert=True,
-    )
+    await write_behind.upsert("rules_eval", grant_id, result)
 
-    return {"grant_id": grant_id, "triggered_rules": triggered, "signals": signals}
+    return result
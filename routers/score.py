@@ -21,89 +21,116 @@
 
 from fastapi import APIRouter, HTTPException
 from database import db
-from utils.gemini_client import call_gemini
+from models.schemas import ScoreBatchRequest
+from settings import settings
+from utils.alert_worker import apply_score_alerts
+from utils.gemini_cache import cached_call_gemini
+from utils.scoring import ScoringModel, get_scoring_model
+from utils.stages import score_result, score_results
+from utils.drift import record_scores
+from utils.summary import apply_scores
+from utils.write_behind import write_behind
+from pymongo import UpdateOne
+from typing import Dict, List
 import logging
+import time
 
 router = APIRouter()
 logger = logging.getLogger("score")
 
 
+async def _score_chunk(docs: List[dict], model: ScoringModel, histogram: Dict[str, int]) -> int:
+    grant_ids = [d["grant_id"] for d in docs]
+    rules = {r["grant_id"]: r async for r in db.rules_eval.find({"grant_id": {"$in": grant_ids}}, {"_id": 0})}
+    previous = {
+        s["grant_id"]: s
+        async for s in db.scores.find(
+            {"grant_id": {"$in": grant_ids}}, {"_id": 0, "grant_id": 1, "risk_tier": 1, "risk_score": 1}
+        )
+    }
+
+    results = score_results(
+        grant_ids, [d.get("features") or {} for d in docs], [rules.get(gid, {}) for gid in grant_ids], model
+    )
+    for r in results:
+        histogram[r["risk_tier"]] = histogram.get(r["risk_tier"], 0) + 1
+    if results:
+        await db.scores.bulk_write(
+            [UpdateOne({"grant_id": r["grant_id"]}, {"$set": r}, upsert=True) for r in results], ordered=False
+        )
+    await record_scores(r["risk_score"] for r in results)
+    await apply_scores((previous.get(r["grant_id"]), r) for r in results)
+    # alerts follow the new tiers: rebuilt on entering an alert tier, refreshed within it, resolved on leaving
+    await apply_score_alerts((previous.get(r["grant_id"]), r) for r in results)
+    return len(results)
+
+
+@router.post("/score/batch")
+async def score_batch(payload: ScoreBatchRequest):
+    """
+    Re-score many grants (or the whole portfolio when grant_ids is omitted) as one matrix per chunk:
+    one features cursor, one rules_eval lookup and one bulk_write per chunk.
+    """
+    model = get_scoring_model()
+    chunk_size = max(1, payload.chunk_size or settings.SCORE_BATCH_CHUNK)
+    query = {"grant_id": {"$in": payload.grant_ids}} if payload.grant_ids else {}
+    # only the columns the model reads cross the wire
+    projection = {"_id": 0, "grant_id": 1, **{f"features.{name}": 1 for name in model.features}}
+
+    histogram = {name: 0 for name, _ in model.tiers}
+    scored = 0
+    started = time.perf_counter()
+    await write_behind.flush(["features", "rules_eval", "scores"])
+    chunk: List[dict] = []
+    async for doc in db.features.find(query, projection).batch_size(chunk_size):
+        chunk.append(doc)
+        if len(chunk) >= chunk_size:
+            scored += await _score_chunk(chunk, model, histogram)
+            chunk = []
+    if chunk:
+        scored += await _score_chunk(chunk, model, histogram)
+
+    elapsed = time.perf_counter() - started
+    return {
+        "scored": scored,
+        "model_version": model.version,
+        "tier_histogram": histogram,
+        "elapsed_sec": round(elapsed, 3),
+        "grants_per_sec": round(scored / elapsed, 1) if elapsed > 0 else None,
+    }
+
+
 @router.post("/score/{grant_id}")
-def score(grant_id: str):
+async def score(grant_id: str, narrative: bool = False, bypass_cache: bool = False):
     # load features and rule eval
-    fdoc = db.features.find_one({"grant_id": grant_id}, {"_id": 0})
+    fdoc = await write_behind.read("features", grant_id)
     if not fdoc:
         raise HTTPException(status_code=404, detail="No features found; compute features first")
 
     features = fdoc.get("features", {})
+    rule_hits = await write_behind.read("rules_eval", grant_id) or {}
+    result = score_result(grant_id, features, rule_hits, get_scoring_model())
 
-    # Very simple scoring function: normalized weighted sum (ensure bounded 0..1)
-    # We pick a handful of features and normalize by sensible caps
-    def _norm(v, cap):
+    # Gemini is optional: only asked to put the exact drivers into words
+    if narrative:
+        prompt = (
+            "You are an AML assistant. In two sentences, explain this grant risk score to an analyst using the "
+            "feature attributions below. Do not change any numbers. Return only JSON: {\"narrative\": \"...\"}\n\n"
+            f"risk_score: {result['risk_score']} ({result['risk_tier']})\n"
+            f"drivers: {result['top_shap_drivers']}"
+        )
         try:
-            return min(max(float(v) / float(cap), 0.0), 1.0)
+            g = await cached_call_gemini(prompt, bypass_cache=bypass_cache)
+            parsed = g.get("json")
+            result["narrative"] = parsed.get("narrative") if isinstance(parsed, dict) else g.get("text")
         except Exception:
-            return 0.0
-
-    score = 0.0
-    score += _norm(features.get("return_ratio", 0), 5.0) * 0.4
-    score += _norm(features.get("micro_count", 0), 50) * 0.2
-    score += _norm(features.get("burstiness", 0), 3.0) * 0.2
-    score += _norm(features.get("fragmentation_index", 0), 1.0) * 0.1
-    score += _norm(features.get("conduit_entropy", 0), 5.0) * 0.1
-
-    # clamp
-    risk_score = min(max(score, 0.0), 1.0)
-
-    # risk tier
-    if risk_score >= 0.75:
-        risk_tier = "High"
-    elif risk_score >= 0.4:
-        risk_tier = "Medium"
-    else:
-        risk_tier = "Low"
-
-    # ask Gemini to produce top shap-like drivers in JSON
-    prompt = (
-        "You are an AML assistant. Given the following computed numeric features, return a JSON object\n"
-        "with a key 'top_shap_drivers' which is a list of up to 4 objects with keys: feature, value, contribution (0..1).\n"
-        "Return only JSON (no markdown). Features:\n\n"
-        f"{features}\n\n"
-        "Compute contributions proportionally to the absolute normalized influence (explainable), sum of contributions should be <= 1.0."
-    )
-
-    try:
-        g = call_gemini(prompt)
-    except Exception as e:
-        logger.exception("Gemini failed")
-        # fallback: craft drivers deterministically
-        top_shap_drivers = [
-            {"feature": "return_ratio", "value": features.get("return_ratio"), "contribution": 0.4},
-            {"feature": "micro_count", "value": features.get("micro_count"), "contribution": 0.2},
-            {"feature": "burstiness", "value": features.get("burstiness"), "contribution": 0.2},
-        ]
-    else:
-        parsed = g.get("json")
-        if parsed and isinstance(parsed, dict) and parsed.get("top_shap_drivers"):
-            top_shap_drivers = parsed["top_shap_drivers"]
-        else:
-            # attempt to extract from text by searching for "top_shap_drivers"
-            text = g.get("text") or ""
-            # fallback deterministic
-            top_shap_drivers = [
-                {"feature": "return_ratio", "value": features.get("return_ratio"), "contribution": 0.4},
-                {"feature": "micro_count", "value": features.get("micro_count"), "contribution": 0.2},
-                {"feature": "burstiness", "value": features.get("burstiness"), "contribution": 0.2},
-            ]
-
-    result = {
-        "grant_id": grant_id,
-        "risk_score": round(risk_score, 4),
-        "risk_tier": risk_tier,
-        "rule_hits": db.rules_eval.find_one({"grant_id": grant_id}, {"_id": 0}) or {},
-        "top_shap_drivers": top_shap_drivers,
-    }
+            logger.exception("Gemini failed")
+            result["narrative"] = None
 
-    # persist
-    db.scores.update_one({"grant_id": grant_id}, {"$set": result}, upsert=True)
+    # persist; the grant's alert follows its new tier (see apply_score_alerts)
+    previous = await write_behind.read("scores", grant_id)
+    await write_behind.upsert("scores", grant_id, result)
+    await record_scores([result["risk_score"]])
+    await apply_scores([(previous, result)])
+    await apply_score_alerts([(previous, result)])
     return result
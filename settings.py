@@ -1,3 +1,4 @@
+from typing import Dict, List, Optional
 from pydantic import BaseSettings
 
 
@@ -7,8 +8,61 @@ class Settings(BaseSettings):
     GEMINI_API_KEY: str
     GEMINI_MODEL: str = "gemini-2.0-flash"
     GEMINI_URL: str = "https://generativelanguage.googleapis.com/v1beta/models"
+    GEMINI_MAX_IN_FLIGHT: int = 8
+    GEMINI_POOL_SIZE: int = 20
+    GEMINI_TIMEOUT_SEC: float = 20.0
+    GEMINI_MAX_RETRIES: int = 3
+    GEMINI_BACKOFF_BASE_SEC: float = 0.5
+    GEMINI_BACKOFF_MAX_SEC: float = 8.0
+    GEMINI_CACHE_ENABLED: bool = True
+    GEMINI_CACHE_SIZE: int = 1024
+    GEMINI_CACHE_TTL_SEC: int = 7 * 24 * 3600
+    SCORING_MODEL_PATH: str = "config/scoring_model.yaml"
+    SCORE_BATCH_CHUNK: int = 5000
+    RULES_PATH: str = "config/rules.yaml"
+    RULES_RELOAD_INTERVAL_SEC: float = 2.0
+    RULES_BATCH_CHUNK: int = 5000
     SERVICE_NAME: str = "aml-service"
     MAX_ALERTS: int = 100
+    FEATURE_ENGINE: str = "python"
+    FEATURE_BATCH_SIZE: int = 500
+    FEATURE_BATCH_WORKERS: Optional[int] = None
+    FEATURE_BULK_WRITE_CHUNK: int = 1000
+    INGEST_CHUNK_SIZE: int = 1000
+    ENSURE_INDEXES_ON_STARTUP: bool = True
+    ENTITY_MATCH_THRESHOLD: float = 0.8
+    ENTITY_INDEX_TTL_SEC: int = 300
+    ENTITY_LLM_BATCH: int = 200
+    ALERT_WORKER_CONCURRENCY: int = 4
+    # scoring a grant into one of these tiers (from any other) rebuilds its alert in the background
+    ALERT_TIERS: List[str] = ["High", "Medium"]
+    ALERT_LOAD_TIMEOUT_SEC: float = 10.0
+    ALERT_STREAM_TIMEOUT_SEC: float = 120.0
+    GEMINI_STREAMING: bool = True
+    # collection -> "sync" | "buffered", e.g. WRITE_BEHIND_MODES='{"rules_eval": "buffered", "scores": "buffered"}'
+    WRITE_BEHIND_MODES: Dict[str, str] = {}
+    WRITE_BEHIND_FLUSH_INTERVAL_SEC: float = 0.5
+    WRITE_BEHIND_MAX_PENDING: int = 10000
+    WRITE_BEHIND_CHUNK: int = 1000
+    # triage dispositions that confirm an alert, for /monitoring/status precision_sample
+    PRECISION_POSITIVE_DISPOSITIONS: List[str] = ["true_positive", "escalated", "sar_filed"]
+    DRIFT_BUCKET_SEC: int = 86400
+    DRIFT_CURRENT_BUCKETS: int = 1
+    DRIFT_REFERENCE_BUCKETS: int = 7
+    DRIFT_MIN_COUNT: int = 100
+    DRIFT_RETENTION_DAYS: int = 90
+    SUMMARY_LATEST_ALERTS: int = 10
+    # opt-in: holds every transaction edge in memory, loaded at startup and reloaded every TXGRAPH_TTL_SEC
+    TXGRAPH_FEATURES: bool = False
+    TXGRAPH_TTL_SEC: int = 900
+    TXGRAPH_COMPACT_RATIO: float = 0.1
+    TXGRAPH_MAX_CYCLE_LEN: int = 4
+    TXGRAPH_MAX_CYCLES: int = 1000
+    SUBGRAPH_MAX_HOPS: int = 4
+    SUBGRAPH_MAX_EDGES: int = 2000
+    SUBGRAPH_MAX_FRONTIER: int = 200
+    SUBGRAPH_MAX_TIME_MS: int = 5000
+    SUMMARY_RETENTION_DAYS: int = 35
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# the service is laid out flat (routers/, utils/, settings.py); tests import it from the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# settings requires these; importing database only creates a lazy client, nothing connects
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+os.environ.setdefault("GEMINI_API_KEY", "test")
@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+from utils import alert_worker as aw
+from utils.alert_worker import REBUILD, REFRESH, RESOLVE, alert_transition
+
+
+def score(tier, risk_score=0.5, rules=()):
+    return {"grant_id": "G1", "risk_tier": tier, "risk_score": risk_score, "rule_hits": {"triggered_rules": list(rules)}}
+
+
+@pytest.mark.parametrize("previous, new, action", [
+    (None, "High", REBUILD),
+    ("Low", "Medium", REBUILD),
+    ("Medium", "High", REBUILD),
+    ("High", "Medium", REBUILD),
+    ("High", "High", REFRESH),
+    ("Medium", "Medium", REFRESH),
+    ("High", "Low", RESOLVE),
+    ("Medium", "Low", RESOLVE),
+    (None, "Low", None),
+    ("Low", "Low", None),
+])
+def test_alert_transition(previous, new, action):
+    assert alert_transition(score(previous) if previous else None, score(new)) == action
+
+
+class _Recorder:
+    def __init__(self):
+        self.calls = []
+
+    async def bulk_write(self, ops, ordered=True):
+        self.calls.append(("bulk_write", [(op._filter, op._doc) for op in ops]))
+
+    async def update_many(self, query, update):
+        self.calls.append(("update_many", query, update))
+
+
+@pytest.fixture
+def recorded(monkeypatch):
+    alerts, enqueued, withdrawn = _Recorder(), [], []
+
+    async def flush(collections=None):
+        return 0
+
+    async def withdraw(grant_ids):
+        withdrawn.extend(grant_ids)
+
+    monkeypatch.setattr(aw, "db", type("FakeDb", (), {"alerts": alerts})())
+    monkeypatch.setattr(aw.write_behind, "flush", flush)
+    monkeypatch.setattr(aw, "withdraw_alerts", withdraw)
+    monkeypatch.setattr(aw.alert_worker, "enqueue", lambda grant_id, **kw: enqueued.append((grant_id, kw)))
+    return alerts, enqueued, withdrawn
+
+
+def test_up_rebuilds(recorded):
+    alerts, enqueued, withdrawn = recorded
+    counts = asyncio.run(aw.apply_score_alerts([(score("Low"), score("High"))]))
+    assert counts[REBUILD] == 1
+    assert enqueued == [("G1", {"rebuild": True})]
+    assert alerts.calls == [] and withdrawn == []
+
+
+def test_same_tier_refreshes_score_fields(recorded):
+    alerts, enqueued, withdrawn = recorded
+    asyncio.run(aw.apply_score_alerts([(score("High", 0.8, ["R1"]), score("High", 0.9, ["R1", "R2"]))]))
+    assert enqueued == [] and withdrawn == []
+    (name, ops), = alerts.calls
+    assert name == "bulk_write"
+    (query, update), = ops
+    assert query == {"grant_id": "G1", "status": {"$ne": aw.RESOLVED}}
+    assert update == {"$set": {"risk_score": 0.9, "risk_tier": "High", "rule_hits": ["R1", "R2"]}}
+
+
+def test_down_resolves(recorded):
+    alerts, enqueued, withdrawn = recorded
+    asyncio.run(aw.apply_score_alerts([(score("High"), score("Low"))]))
+    assert enqueued == []
+    (name, query, update), = alerts.calls
+    assert name == "update_many" and query["grant_id"] == {"$in": ["G1"]}
+    assert update["$set"]["status"] == aw.RESOLVED
+    assert withdrawn == ["G1"]
+
+
+def test_low_to_low_touches_nothing(recorded):
+    alerts, enqueued, withdrawn = recorded
+    asyncio.run(aw.apply_score_alerts([(score("Low"), score("Low")), (None, score("Low"))]))
+    assert alerts.calls == [] and enqueued == [] and withdrawn == []
+
+
+def test_rebuilt_alert_is_open_again():
+    doc = aw.alert_doc("G1", 0.9, "High", [], {}, [])
+    assert doc["status"] == aw.OPEN and doc["resolved_at"] is None
@@ -0,0 +1,26 @@
+import pytest
+from fastapi import HTTPException
+
+from routers.alerts import _projection
+
+
+def test_no_fields_projects_everything_but_id():
+    assert _projection(None) == {"_id": 0}
+    assert _projection("") == {"_id": 0}
+
+
+def test_sort_keys_are_always_projected():
+    assert _projection("risk_tier") == {"_id": 0, "grant_id": 1, "risk_tier": 1, "timestamp": 1}
+
+
+def test_child_paths_of_requested_parents_are_dropped():
+    projection = _projection("justification,justification.summary, computed_features.a.b,computed_features.a")
+    assert projection == {"_id": 0, "computed_features.a": 1, "grant_id": 1, "justification": 1, "timestamp": 1}
+    assert _projection("timestamp.x") == {"_id": 0, "grant_id": 1, "timestamp": 1}
+
+
+@pytest.mark.parametrize("fields", ["_id", "risk_tier,nope", "justification.", "a..b", "justification.$summary"])
+def test_unknown_fields_are_rejected(fields):
+    with pytest.raises(HTTPException) as err:
+        _projection(fields)
+    assert err.value.status_code == 400
@@ -0,0 +1,50 @@
+import random
+
+import pytest
+
+from utils.feature_engine import FeatureAccumulator, merge_moments
+
+
+def _inflows(seed: int, n: int, offset: float = 0.0):
+    rng = random.Random(seed)
+    return [{"amount": offset + rng.uniform(0, 10), "direction": "in", "counterparty": f"c{i % 7}"} for i in range(n)]
+
+
+def _accumulate(txs) -> FeatureAccumulator:
+    acc = FeatureAccumulator()
+    for t in txs:
+        acc.add(t)
+    return acc
+
+
+def test_merged_moments_match_one_pass():
+    txs = _inflows(1, 500, offset=1e9)
+    a, b, full = _accumulate(txs[:123]), _accumulate(txs[123:]), _accumulate(txs)
+    mean, m2 = merge_moments(a.n_in, a.mean_in, a.m2_in, b.n_in, b.mean_in, b.m2_in)
+    assert mean == pytest.approx(full.mean_in, rel=1e-12)
+    assert m2 == pytest.approx(full.m2_in, rel=1e-6)
+
+
+def test_merge_with_empty_side():
+    acc = _accumulate(_inflows(2, 50))
+    assert merge_moments(0, 0.0, 0.0, acc.n_in, acc.mean_in, acc.m2_in) == pytest.approx((acc.mean_in, acc.m2_in))
+    assert merge_moments(0, 0.0, 0.0, 0, 0.0, 0.0) == (0.0, 0.0)
+
+
+def test_state_round_trip_keeps_the_variance_of_large_amounts():
+    # amounts around 1e9 with a spread of a few units: a sum of squares cancels to noise here
+    acc = _accumulate(_inflows(3, 1000, offset=1e9))
+    state = acc.to_state()
+    assert "sumsq_in" not in state
+    restored = FeatureAccumulator.from_state(state)
+    assert (restored.mean_in, restored.m2_in) == (acc.mean_in, acc.m2_in)
+    assert restored.features() == acc.features()
+
+
+def test_legacy_state_with_sum_of_squares_still_loads():
+    acc = _accumulate(_inflows(4, 200))
+    state = {k: v for k, v in acc.to_state().items() if k not in FeatureAccumulator.MOMENTS}
+    state["sumsq_in"] = sum(t["amount"] ** 2 for t in _inflows(4, 200))
+    restored = FeatureAccumulator.from_state(state)
+    assert restored.m2_in == pytest.approx(acc.m2_in, rel=1e-9)
+    assert restored.features() == acc.features()
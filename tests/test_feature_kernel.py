@@ -0,0 +1,54 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from utils.feature_engine import compute_window_features
+from utils.feature_kernel import compute_features_vectorized
+
+WINDOWS = [7, 30, 90]
+
+
+def _transactions(seed: int, n: int = 300):
+    rng = random.Random(seed)
+    start = datetime(2026, 1, 1)
+    txs = []
+    for _ in range(n):
+        txs.append({
+            "grant_id": "G1",
+            "amount": round(rng.uniform(1, 20000), 2),
+            "direction": rng.choice(["in", "out", "in", None]),
+            "timestamp": start + timedelta(hours=rng.randint(0, 24 * 120)),
+            "counterparty": rng.choice(["acme", "globex", "initech", "hooli", "", None]),
+            "from": rng.choice(["a", "b", "c"]),
+            "to": rng.choice(["a", "b", "c", None]),
+        })
+    return txs
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_numpy_matches_python(seed):
+    txs = _transactions(seed)
+    assert compute_features_vectorized(txs, windows=WINDOWS) == compute_window_features(txs, windows=WINDOWS)
+
+
+def test_null_and_missing_amounts_count_as_zero():
+    txs = _transactions(4, n=50)
+    txs[0]["amount"] = None
+    txs[1].pop("amount")
+    txs[2]["amount"] = "125.5"
+    for t in txs[:3]:
+        t["direction"] = "in"
+    features = compute_features_vectorized(txs, windows=WINDOWS)
+    assert features == compute_window_features(txs, windows=WINDOWS)
+    assert features["micro_count"] >= 2
+
+
+def test_iso_string_timestamps_match_python():
+    txs = _transactions(5, n=100)
+    for t in txs:
+        t["timestamp"] = t["timestamp"].isoformat() + "+00:00"
+    txs[0]["timestamp"] = "not a date"
+    features = compute_features_vectorized(txs, windows=WINDOWS)
+    assert features == compute_window_features(txs, windows=WINDOWS)
+    assert features["latency_first_inflow_d"] is None
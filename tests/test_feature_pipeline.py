@@ -0,0 +1,103 @@
+"""
+The mongo feature engine ($match/$facet aggregation) must agree with the python reference engine.
+
+mongomock implements neither $convert nor $stdDevPop, so these run against a real mongod: set
+AML_TEST_MONGO_URI (e.g. mongodb://localhost:27017). Each test works in a throwaway database that is
+dropped afterwards; without the variable the module is skipped.
+"""
+import asyncio
+import os
+import random
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from utils.feature_engine import compute_window_features
+from utils.feature_pipeline import compute_features_pipeline
+
+MONGO_URI = os.environ.get("AML_TEST_MONGO_URI")
+WINDOWS = [7, 30, 90]
+
+pytestmark = pytest.mark.skipif(not MONGO_URI, reason="AML_TEST_MONGO_URI is not set")
+
+
+def run(test):
+    """Run `test(collection)` on a fresh transactions collection and return its result."""
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    async def _run():
+        client = AsyncIOMotorClient(MONGO_URI)
+        name = f"aml_test_{uuid.uuid4().hex[:8]}"
+        try:
+            return await test(client[name].transactions)
+        finally:
+            await client.drop_database(name)
+            client.close()
+
+    return asyncio.run(_run())
+
+
+def _transactions(seed: int, n: int = 300):
+    rng = random.Random(seed)
+    start = datetime(2026, 1, 1)
+    txs = []
+    for _ in range(n):
+        txs.append({
+            "grant_id": "G1",
+            "amount": rng.choice([round(rng.uniform(1, 20000), 2), round(rng.uniform(1, 900), 2), None]),
+            "direction": rng.choice(["in", "out", "in", None]),
+            "timestamp": start + timedelta(hours=rng.randint(0, 24 * 120)),
+            "counterparty": rng.choice(["acme", "globex", "initech", "hooli", "", None]),
+            "from": rng.choice(["a", "b", "c"]),
+            "to": rng.choice(["a", "b", "c", None]),
+        })
+    # another grant in the same collection must not leak into G1's features
+    txs.append({"grant_id": "G2", "amount": 1.0, "direction": "in", "timestamp": start, "counterparty": "acme"})
+    return txs
+
+
+def _compare(txs, **kwargs):
+    async def test(collection):
+        await collection.insert_many([dict(t) for t in txs])
+        return await compute_features_pipeline(collection, "G1", windows=WINDOWS, **kwargs)
+
+    expected = compute_window_features([t for t in txs if t["grant_id"] == "G1"], windows=WINDOWS, **kwargs)
+    assert run(test) == expected
+    return expected
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_mongo_matches_python(seed):
+    _compare(_transactions(seed))
+
+
+def test_mongo_matches_python_with_theta_micro():
+    _compare(_transactions(4), micro_threshold=5000.0)
+
+
+def test_unknown_grant_has_empty_features():
+    async def test(collection):
+        await collection.insert_many(_transactions(5))
+        return await compute_features_pipeline(collection, "nope", windows=WINDOWS)
+
+    assert run(test) == compute_window_features([], windows=WINDOWS)
+
+
+def test_malformed_timestamps():
+    txs = _transactions(6, n=100)
+    for t in txs:
+        t["timestamp"] = t["timestamp"].isoformat()
+    # sorts above every ISO date: the windows must still end at the latest parseable timestamp
+    txs[0]["timestamp"] = "not a date"
+    features = _compare(txs)
+    assert features["latency_first_inflow_d"] is None
+
+
+def test_string_amounts():
+    txs = _transactions(7, n=100)
+    for t in txs[::3]:
+        t["amount"] = str(t["amount"]) if t["amount"] is not None else "n/a"
+    # the python engine rejects "n/a"; $convert's onError counts it as 0, so only compare convertible strings
+    txs = [t for t in txs if t["amount"] != "n/a"]
+    _compare(txs)
@@ -0,0 +1,186 @@
+"""
+GeminiClient against an in-process stub (httpx.MockTransport): retries and backoff, the in-flight cap,
+single-flight coalescing and the request payload. Nothing leaves the process.
+"""
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from utils.gemini_client import GeminiClient
+
+ENDPOINT = "http://stub/v1beta/models/test:generateContent"
+
+
+def _ok(text: str = '{"ok": true}') -> httpx.Response:
+    return httpx.Response(200, json={"candidates": [{"content": {"parts": [{"text": text}]}}]})
+
+
+def _client(handler, **kwargs) -> GeminiClient:
+    kwargs.setdefault("max_retries", 3)
+    kwargs.setdefault("backoff_base", 0.001)
+    kwargs.setdefault("backoff_max", 0.05)
+    return GeminiClient(endpoint=ENDPOINT, api_key="k", transport=httpx.MockTransport(handler), **kwargs)
+
+
+def run(client: GeminiClient, coro):
+    async def _run():
+        try:
+            return await coro
+        finally:
+            await client.aclose()
+
+    return asyncio.run(_run())
+
+
+def _record_backoff(client: GeminiClient) -> list:
+    delays = []
+    backoff = client._backoff
+
+    def spy(attempt, retry_after):
+        delays.append(backoff(attempt, retry_after))
+        return delays[-1]
+
+    client._backoff = spy
+    return delays
+
+
+def test_payload_and_parsed_response():
+    seen = []
+
+    def handler(request: httpx.Request):
+        seen.append(request)
+        return _ok()
+
+    client = _client(handler)
+    result = run(client, client.generate("hello", max_output_tokens=64, temperature=0.5))
+    assert result["json"] == {"ok": True}
+    body = json.loads(seen[0].content)
+    assert body["contents"] == [{"parts": [{"text": "hello"}]}]
+    assert body["generationConfig"] == {"temperature": 0.5, "maxOutputTokens": 64}
+    assert seen[0].headers["X-goog-api-key"] == "k"
+
+
+def test_429_honours_retry_after():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(429, headers={"Retry-After": "0.02"}) if len(calls) == 1 else _ok()
+
+    client = _client(handler)
+    delays = _record_backoff(client)
+    assert run(client, client.generate("p"))["json"] == {"ok": True}
+    assert len(calls) == 2
+    assert delays == [0.02]
+    assert client.stats()["retries"] == 1
+
+
+def test_retry_after_is_capped_by_backoff_max():
+    client = _client(lambda request: _ok(), backoff_max=0.05)
+    assert client._backoff(0, "3600") == 0.05
+
+
+@pytest.mark.parametrize("status", [500, 502, 503, 504])
+def test_5xx_retried_then_succeeds(status):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(status) if len(calls) < 3 else _ok()
+
+    client = _client(handler)
+    assert run(client, client.generate("p"))["json"] == {"ok": True}
+    assert len(calls) == 3
+    assert client.stats()["retries"] == 2
+    assert client.stats()["failures"] == 0
+
+
+def test_retries_exhausted():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(503)
+
+    client = _client(handler, max_retries=2)
+    with pytest.raises(RuntimeError):
+        run(client, client.generate("p"))
+    assert len(calls) == 3
+    assert client.stats()["failures"] == 1
+
+
+def test_client_errors_are_not_retried():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(400)
+
+    client = _client(handler)
+    with pytest.raises(RuntimeError):
+        run(client, client.generate("p"))
+    assert len(calls) == 1
+
+
+def test_identical_concurrent_prompts_share_one_call():
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        await asyncio.sleep(0.02)
+        return _ok()
+
+    client = _client(handler)
+
+    async def burst():
+        return await asyncio.gather(*(client.generate("same prompt") for _ in range(20)))
+
+    results = run(client, burst())
+    assert len(calls) == 1
+    assert all(r["json"] == {"ok": True} for r in results)
+    assert client.stats()["coalesced"] == 19
+
+
+def test_cancelled_caller_does_not_cancel_shared_call():
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        await asyncio.sleep(0.05)
+        return _ok()
+
+    client = _client(handler)
+
+    async def scenario():
+        first = asyncio.ensure_future(client.generate("p"))
+        second = asyncio.ensure_future(client.generate("p"))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert run(client, scenario())["json"] == {"ok": True}
+    assert len(calls) == 1
+
+
+def test_in_flight_never_exceeds_limit():
+    active, peak, calls = 0, 0, []
+
+    async def handler(request):
+        nonlocal active, peak
+        calls.append(request)
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        return _ok()
+
+    client = _client(handler, max_in_flight=3)
+
+    async def burst():
+        return await asyncio.gather(*(client.generate(f"prompt {i}") for i in range(15)))
+
+    run(client, burst())
+    assert len(calls) == 15
+    assert peak == 3
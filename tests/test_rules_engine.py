@@ -0,0 +1,43 @@
+import random
+
+from utils.rules_engine import DEFAULT_RULES, Ruleset
+
+# two conditions on one feature with different defaults: a missing `x` satisfies R1 and R2 but not R3
+SPEC = {
+    "version": "test",
+    "rules": [
+        {"id": "R1", "conditions": [{"feature": "x", "op": ">=", "value": 0, "default": 0}]},
+        {"id": "R2", "conditions": [{"feature": "x", "op": "<", "value": 1, "default": 0}]},
+        {"id": "R3", "conditions": [{"feature": "x", "op": ">", "value": 1, "default": 0},
+                                    {"feature": "y", "op": "<=", "value": 2, "default": 5}], "match": "any"},
+        {"id": "R4", "conditions": [{"feature": "x", "op": "<", "value": 1, "default": 9},
+                                    {"feature": "y", "op": "!=", "value": 3}]},
+    ],
+}
+
+
+def _docs(seed: int, n: int = 500):
+    rng = random.Random(seed)
+    values = [None, "n/a", "1.5", 0, 0.5, 1, 2, 3, -1, float("nan")]
+    docs = []
+    for _ in range(n):
+        doc = {}
+        for name in ("x", "y"):
+            if rng.random() < 0.6:
+                doc[name] = rng.choice(values)
+        docs.append(doc)
+    return docs
+
+
+def test_per_condition_defaults():
+    ruleset = Ruleset(SPEC)
+    triggered, _ = ruleset.evaluate({})
+    assert triggered == ["R1", "R2"]
+    assert ruleset.evaluate_many([{}])[0][0] == ["R1", "R2"]
+
+
+def test_batch_matches_single_with_missing_features():
+    for spec in (SPEC, DEFAULT_RULES):
+        ruleset = Ruleset(spec)
+        docs = _docs(1)
+        assert ruleset.evaluate_many(docs) == [ruleset.evaluate(doc) for doc in docs]
@@ -0,0 +1,27 @@
+from utils.summary import score_increments
+
+
+def test_first_score_adds_to_total():
+    assert score_increments([(None, {"risk_tier": "High", "risk_score": 0.9})]) == {
+        "total": 1, "tiers.High": 1, "score_sum": 0.9,
+    }
+
+
+def test_tier_move_is_one_increment():
+    inc = score_increments([({"risk_tier": "High", "risk_score": 0.9}, {"risk_tier": "Low", "risk_score": 0.1})])
+    assert inc["tiers.High"] == -1 and inc["tiers.Low"] == 1
+    assert "total" not in inc
+    assert round(inc["score_sum"], 6) == -0.8
+
+
+def test_unchanged_tier_only_moves_the_score_sum():
+    inc = score_increments([({"risk_tier": "Medium", "risk_score": 0.5}, {"risk_tier": "Medium", "risk_score": 0.6})])
+    assert list(inc) == ["score_sum"]
+
+
+def test_moves_that_cancel_out_are_dropped():
+    changes = [
+        ({"risk_tier": "High", "risk_score": 0.8}, {"risk_tier": "Low", "risk_score": 0.2}),
+        ({"risk_tier": "Low", "risk_score": 0.2}, {"risk_tier": "High", "risk_score": 0.8}),
+    ]
+    assert score_increments(changes) == {}
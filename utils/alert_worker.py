@@ -0,0 +1,337 @@
+import asyncio
+import heapq
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from database import db
+from settings import settings
+from utils.feature_engine import parse_timestamp
+from utils.gemini_cache import cached_call_gemini, remember
+from utils.gemini_client import gemini
+from utils.summary import apply_alerts, withdraw_alerts
+from utils.write_behind import write_behind
+
+logger = logging.getLogger("alert_worker")
+
+TIMELINE_LENGTH = 20
+
+# alerts.status: an alert is resolved when its grant is re-scored out of ALERT_TIERS
+OPEN = "open"
+RESOLVED = "resolved"
+
+# what a new score does to a grant's alert, see alert_transition()
+REBUILD = "rebuild"
+REFRESH = "refresh"
+RESOLVE = "resolve"
+
+# alerts.justification_status
+PENDING = "pending"
+READY = "ready"
+FAILED = "failed"
+# only ever published to stream listeners: no alert could be built, so there is nothing to justify
+SKIPPED = "skipped"
+
+FALLBACK_JUSTIFICATION = {"summary": "Could not generate explanation", "recommended_action": "Investigate", "severity_explanation": ""}
+
+
+def timeline(transactions: List[dict]) -> List[dict]:
+    return [{"date": t.get("timestamp"), "event": t.get("direction"), "amount": t.get("amount")} for t in transactions]
+
+
+def latest_transactions(transactions: List[dict], n: int = TIMELINE_LENGTH) -> List[dict]:
+    # in-memory equivalent of sort("timestamp", -1).limit(n) for callers that already hold the transactions
+    def key(t):
+        try:
+            return parse_timestamp(t.get("timestamp"))
+        except (TypeError, ValueError):
+            return datetime.min
+    return heapq.nlargest(n, transactions, key=key)
+
+
+def enters_alert_tier(previous: Optional[dict], score: dict) -> bool:
+    """Whether a new score moves a grant (or a first score puts it) into one of ALERT_TIERS."""
+    tier = score.get("risk_tier")
+    return tier in settings.ALERT_TIERS and (previous or {}).get("risk_tier") != tier
+
+
+def alert_transition(previous: Optional[dict], score: dict) -> Optional[str]:
+    """
+    REBUILD when a score enters an alert tier, REFRESH when it stays in the same one, RESOLVE when it leaves
+    the alert tiers; None while a grant stays outside them.
+    """
+    if enters_alert_tier(previous, score):
+        return REBUILD
+    if score.get("risk_tier") in settings.ALERT_TIERS:
+        return REFRESH
+    if (previous or {}).get("risk_tier") in settings.ALERT_TIERS:
+        return RESOLVE
+    return None
+
+
+def _triggered(rule_hits) -> list:
+    return rule_hits.get("triggered_rules", []) if isinstance(rule_hits, dict) else rule_hits or []
+
+
+def justification_prompt(features: dict, rule_hits: list) -> str:
+    return (
+        "You are an AML analyst assistant. Given these features and rule hits, produce a short JSON justification for "
+        "an alert containing keys: summary (string), recommended_action (string), severity_explanation (string).\n\n"
+        f"features: {features}\nrule_hits: {rule_hits}\n\nReturn only JSON."
+    )
+
+
+async def request_justification(features: dict, rule_hits: list, bypass_cache: bool = False) -> dict:
+    """Ask Gemini (through the cache) for an alert justification; raises when Gemini fails."""
+    g = await cached_call_gemini(justification_prompt(features, rule_hits), bypass_cache=bypass_cache)
+    return g.get("json") or {"summary": g.get("text", "")}
+
+
+async def justify(features: dict, rule_hits: list, bypass_cache: bool = False) -> dict:
+    try:
+        return await request_justification(features, rule_hits, bypass_cache=bypass_cache)
+    except Exception:
+        return dict(FALLBACK_JUSTIFICATION)
+
+
+def alert_doc(
+    grant_id: str,
+    risk_score,
+    risk_tier,
+    rule_hits: list,
+    features: dict,
+    timeline: list,
+    justification: Optional[dict] = None,
+) -> dict:
+    return {
+        "grant_id": grant_id,
+        "risk_score": risk_score,
+        "risk_tier": risk_tier,
+        "rule_hits": rule_hits,
+        "computed_features": features,
+        "timeline": timeline,
+        "justification": justification,
+        "justification_status": READY if justification is not None else PENDING,
+        "status": OPEN,
+        "resolved_at": None,
+        "timestamp": datetime.utcnow(),
+    }
+
+
+async def build_alert(grant_id: str) -> Optional[dict]:
+    """An alert (without justification) from the stored score, features, rule hits and latest transactions."""
+    score_doc, features_doc = await asyncio.gather(
+        write_behind.read("scores", grant_id),
+        write_behind.read("features", grant_id),
+    )
+    if not score_doc and not features_doc:
+        return None
+
+    risk_score = score_doc.get("risk_score") if score_doc else 0.0
+    risk_tier = score_doc.get("risk_tier") if score_doc else "Unknown"
+    rule_hits = (score_doc.get("rule_hits", {}).get("triggered_rules")
+                 if score_doc and isinstance(score_doc.get("rule_hits"), dict)
+                 else (await write_behind.read("rules_eval", grant_id) or {}).get("triggered_rules", []))
+
+    txs = await db.transactions.find({"grant_id": grant_id}, {"_id": 0}).sort("timestamp", -1).limit(TIMELINE_LENGTH).to_list(length=TIMELINE_LENGTH)
+    features = features_doc.get("features") if features_doc else {}
+    return alert_doc(grant_id, risk_score, risk_tier, rule_hits, features, timeline(txs))
+
+
+class AlertWorker:
+    """
+    Background materialization of alerts and their Gemini justifications.
+    Jobs are keyed by grant_id: a grant waiting in the queue is not queued twice, and a grant enqueued while
+    its job runs is re-run once afterwards. Listeners registered with subscribe() receive ("chunk", {...})
+    events while a justification is streamed and a final ("justification", {...}) event, which is also sent
+    (with justification_status "skipped" or "failed") when a job ends without a justification.
+    """
+
+    def __init__(self, concurrency: int = settings.ALERT_WORKER_CONCURRENCY):
+        self.concurrency = max(1, concurrency)
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        # grant_id -> (rebuild, bypass_cache) for every job not yet started
+        self._pending: Dict[str, Tuple[bool, bool]] = {}
+        self._active = set()
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+        self._stats = {"enqueued": 0, "coalesced": 0, "completed": 0, "failed": 0, "streamed": 0}
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, "queued": len(self._pending), "active": len(self._active), "running": bool(self._tasks)}
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._queue = asyncio.Queue()
+            # jobs accepted before start (or left by a previous stop) go first
+            for grant_id in self._pending:
+                self._queue.put_nowait(grant_id)
+            self._tasks = [asyncio.ensure_future(self._run()) for _ in range(self.concurrency)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    def enqueue(self, grant_id: str, rebuild: bool = False, bypass_cache: bool = False) -> None:
+        """
+        Materialize `grant_id`'s alert in the background. `rebuild` refreshes the alert from the latest
+        score first (after a tier change); otherwise only a pending justification is filled in.
+        """
+        self.start()
+        self._stats["enqueued"] += 1
+        if grant_id in self._pending:
+            self._stats["coalesced"] += 1
+            prev_rebuild, prev_bypass = self._pending[grant_id]
+            self._pending[grant_id] = (prev_rebuild or rebuild, prev_bypass or bypass_cache)
+            return
+        self._pending[grant_id] = (rebuild, bypass_cache)
+        if grant_id not in self._active:
+            self._queue.put_nowait(grant_id)
+
+    def subscribe(self, grant_id: str) -> asyncio.Queue:
+        q: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(grant_id, []).append(q)
+        return q
+
+    def unsubscribe(self, grant_id: str, q: asyncio.Queue) -> None:
+        listeners = self._subscribers.get(grant_id, [])
+        if q in listeners:
+            listeners.remove(q)
+        if not listeners:
+            self._subscribers.pop(grant_id, None)
+
+    def _publish(self, grant_id: str, event: str, data: Dict[str, Any]) -> None:
+        for q in self._subscribers.get(grant_id, []):
+            q.put_nowait((event, data))
+
+    async def _run(self) -> None:
+        while True:
+            grant_id = await self._queue.get()
+            if grant_id not in self._pending or grant_id in self._active:
+                continue
+            rebuild, bypass_cache = self._pending.pop(grant_id)
+            self._active.add(grant_id)
+            try:
+                await self._process(grant_id, rebuild, bypass_cache)
+                self._stats["completed"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._stats["failed"] += 1
+                logger.exception("Alert materialization failed for %s", grant_id)
+            finally:
+                self._active.discard(grant_id)
+                # enqueued again while running: run once more with the merged options
+                if grant_id in self._pending and self._queue is not None:
+                    self._queue.put_nowait(grant_id)
+
+    async def _process(self, grant_id: str, rebuild: bool, bypass_cache: bool) -> None:
+        # listeners wait for a final event, so every way out of here sends one
+        final = {"justification_status": FAILED, "justification": None}
+        try:
+            await self._materialize(grant_id, rebuild, bypass_cache, final)
+        finally:
+            self._publish(grant_id, "justification", final)
+
+    async def _materialize(self, grant_id: str, rebuild: bool, bypass_cache: bool, final: Dict[str, Any]) -> None:
+        alert = None if rebuild else await write_behind.read("alerts", grant_id)
+        if alert is None:
+            alert = await build_alert(grant_id)
+            if alert is None:
+                final["justification_status"] = SKIPPED
+                return
+            await write_behind.upsert("alerts", grant_id, alert)
+            await apply_alerts([alert])
+
+        features, rule_hits = alert.get("computed_features") or {}, alert.get("rule_hits") or []
+        status = READY
+        try:
+            if self._subscribers.get(grant_id) and settings.GEMINI_STREAMING and not bypass_cache:
+                justification = await self._stream(grant_id, features, rule_hits)
+            else:
+                justification = await request_justification(features, rule_hits, bypass_cache=bypass_cache)
+        except Exception:
+            logger.exception("Gemini justification failed for %s", grant_id)
+            justification, status = dict(FALLBACK_JUSTIFICATION), FAILED
+
+        await write_behind.upsert("alerts", grant_id, {
+            "justification": justification, "justification_status": status, "justified_at": datetime.utcnow(),
+        })
+        final.update({"justification_status": status, "justification": justification})
+
+    async def _stream(self, grant_id: str, features: dict, rule_hits: list) -> dict:
+        # someone is watching: relay fragments as they arrive, then cache the assembled answer
+        prompt = justification_prompt(features, rule_hits)
+        pieces = []
+        try:
+            async for piece in gemini.stream(prompt):
+                pieces.append(piece)
+                self._publish(grant_id, "chunk", {"text": piece})
+        except RuntimeError:
+            if pieces:
+                raise
+            # nothing relayed yet: the cached, retried path is still worth a try
+            return await request_justification(features, rule_hits)
+        self._stats["streamed"] += 1
+
+        text = "".join(pieces)
+        try:
+            parsed = json.loads(text)
+        except ValueError:
+            parsed = None
+        await remember(prompt, {"text": text, "json": parsed})
+        return parsed or {"summary": text}
+
+
+alert_worker = AlertWorker()
+
+
+async def apply_score_alerts(changes: Iterable[Tuple[Optional[dict], dict]], rebuild: bool = True) -> Dict[str, int]:
+    """
+    Bring alerts in line with (previous score doc or None, new score doc) pairs: grants entering an alert tier
+    get their alert rebuilt in the background (unless `rebuild` is False because the caller writes those
+    alerts itself), a re-score within the same tier refreshes the open alert's score and rule hits, and
+    leaving the alert tiers resolves it. Failures are logged, never raised.
+    """
+    counts = {REBUILD: 0, REFRESH: 0, RESOLVE: 0}
+    refresh, resolve = [], []
+    for previous, score in changes:
+        action = alert_transition(previous, score)
+        if action is None:
+            continue
+        counts[action] += 1
+        grant_id = score["grant_id"]
+        if action == REBUILD:
+            if rebuild:
+                alert_worker.enqueue(grant_id, rebuild=True)
+        elif action == REFRESH:
+            refresh.append(UpdateOne({"grant_id": grant_id, "status": {"$ne": RESOLVED}}, {"$set": {
+                "risk_score": score.get("risk_score"),
+                "risk_tier": score.get("risk_tier"),
+                "rule_hits": _triggered(score.get("rule_hits")),
+            }}))
+        else:
+            resolve.append(grant_id)
+    if not (refresh or resolve):
+        return counts
+
+    try:
+        # buffered alert writes must land first, or they would overwrite these updates
+        await write_behind.flush(["alerts"])
+        if refresh:
+            await db.alerts.bulk_write(refresh, ordered=False)
+        if resolve:
+            await db.alerts.update_many(
+                {"grant_id": {"$in": resolve}, "status": {"$ne": RESOLVED}},
+                {"$set": {"status": RESOLVED, "resolved_at": datetime.utcnow()}},
+            )
+            await withdraw_alerts(resolve)
+    except Exception:
+        logger.exception("Failed to update alerts after re-scoring %d grants", len(refresh) + len(resolve))
+    return counts
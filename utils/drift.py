@@ -0,0 +1,152 @@
+import logging
+import math
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Optional
+
+from database import db
+from settings import settings
+
+logger = logging.getLogger("drift")
+
+# feature values go into fixed log-spaced bins: this many per decade between 10^MIN_DECADE and 10^MAX_DECADE,
+# plus one bin each for zero, negatives and either overflow; risk scores use SCORE_BINS equal bins over [0, 1]
+BINS_PER_DECADE = 4
+MIN_DECADE, MAX_DECADE = -3, 9
+SCORE_BINS = 20
+# proportions are floored at this so empty bins do not make PSI infinite
+PSI_EPSILON = 1e-4
+
+
+def feature_bin(value: float) -> str:
+    if value == 0:
+        return "zero"
+    if value < 0:
+        return "neg"
+    idx = math.floor(math.log10(value) * BINS_PER_DECADE)
+    if idx < MIN_DECADE * BINS_PER_DECADE:
+        return "under"
+    if idx >= MAX_DECADE * BINS_PER_DECADE:
+        return "over"
+    return f"b{idx}"
+
+
+def score_bin(value: float) -> str:
+    return f"s{min(max(int(value * SCORE_BINS), 0), SCORE_BINS - 1)}"
+
+
+def _numeric(value) -> Optional[float]:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+def bucket_start(ts: datetime) -> datetime:
+    size = settings.DRIFT_BUCKET_SEC
+    seconds = (ts - datetime(1970, 1, 1)).total_seconds()
+    return datetime(1970, 1, 1) + timedelta(seconds=seconds - seconds % size)
+
+
+class DriftSketch:
+    """
+    Bin counts for a batch of written features and risk scores, flushed to the current time bucket's
+    drift_sketches document with a single `$inc`.
+    """
+
+    def __init__(self):
+        self.features: Dict[str, Counter] = defaultdict(Counter)
+        self.scores: Counter = Counter()
+
+    def add_features(self, features: Dict[str, Any]) -> None:
+        for name, value in (features or {}).items():
+            value = _numeric(value)
+            # dotted or $-prefixed names cannot be Mongo field paths
+            if value is not None and "." not in name and not name.startswith("$"):
+                self.features[name][feature_bin(value)] += 1
+
+    def add_score(self, value) -> None:
+        value = _numeric(value)
+        if value is not None:
+            self.scores[score_bin(value)] += 1
+
+    def increments(self) -> Dict[str, int]:
+        inc = {f"features.{name}.{b}": n for name, bins in self.features.items() for b, n in bins.items()}
+        inc.update({f"scores.{b}": n for b, n in self.scores.items()})
+        return inc
+
+    async def record(self, now: Optional[datetime] = None) -> None:
+        """Add the counts to the current bucket. Drift is best effort: a failure is logged, never raised."""
+        inc = self.increments()
+        if not inc:
+            return
+        start = bucket_start(now or datetime.utcnow())
+        try:
+            await db.drift_sketches.update_one(
+                {"_id": start}, {"$inc": inc, "$setOnInsert": {"bucket": start}}, upsert=True
+            )
+        except Exception:
+            logger.exception("Failed to record drift sketch")
+
+
+async def record_features(features: Iterable[Dict[str, Any]]) -> None:
+    sketch = DriftSketch()
+    for f in features:
+        sketch.add_features(f)
+    await sketch.record()
+
+
+async def record_scores(scores: Iterable[float]) -> None:
+    sketch = DriftSketch()
+    for s in scores:
+        sketch.add_score(s)
+    await sketch.record()
+
+
+def psi(reference: Dict[str, int], current: Dict[str, int]) -> Optional[float]:
+    """Population stability index between two binned distributions; None below DRIFT_MIN_COUNT samples."""
+    ref_total, cur_total = sum(reference.values()), sum(current.values())
+    if min(ref_total, cur_total) < settings.DRIFT_MIN_COUNT:
+        return None
+    total = 0.0
+    for b in set(reference) | set(current):
+        r = max(reference.get(b, 0) / ref_total, PSI_EPSILON)
+        c = max(current.get(b, 0) / cur_total, PSI_EPSILON)
+        total += (c - r) * math.log(c / r)
+    return round(total, 4)
+
+
+def _merge(docs: Iterable[dict]):
+    features: Dict[str, Counter] = defaultdict(Counter)
+    scores: Counter = Counter()
+    for doc in docs:
+        for name, bins in (doc.get("features") or {}).items():
+            features[name].update(bins)
+        scores.update(doc.get("scores") or {})
+    return features, scores
+
+
+async def drift_summary(now: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    PSI of the last DRIFT_CURRENT_BUCKETS buckets against the DRIFT_REFERENCE_BUCKETS before them, per feature
+    and for risk_score. Reads at most current + reference bucket documents, however many grants there are.
+    """
+    size = timedelta(seconds=settings.DRIFT_BUCKET_SEC)
+    current_start = bucket_start(now or datetime.utcnow()) - size * (settings.DRIFT_CURRENT_BUCKETS - 1)
+    reference_start = current_start - size * settings.DRIFT_REFERENCE_BUCKETS
+    docs = await db.drift_sketches.find({"_id": {"$gte": reference_start}}).to_list(length=None)
+
+    ref_features, ref_scores = _merge(d for d in docs if d["_id"] < current_start)
+    cur_features, cur_scores = _merge(d for d in docs if d["_id"] >= current_start)
+    per_feature = {
+        name: psi(ref_features[name], cur_features[name])
+        for name in sorted(set(ref_features) & set(cur_features))
+    }
+    scored = [v for v in per_feature.values() if v is not None]
+    return {
+        "feature_psi": max(scored) if scored else None,
+        "prediction_drift": psi(ref_scores, cur_scores),
+        "per_feature_psi": per_feature,
+        "reference_window": {"from": reference_start, "to": current_start, "scores": sum(ref_scores.values())},
+        "current_window": {"from": current_start, "scores": sum(cur_scores.values())},
+    }
@@ -0,0 +1,105 @@
+import re
+import time
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# trailing legal-form tokens that do not distinguish one party from another
+LEGAL_SUFFIXES = {
+    "ltd", "limited", "llc", "llp", "inc", "incorporated", "corp", "corporation", "co", "company",
+    "plc", "pvt", "private", "gmbh", "ag", "sa", "bv", "nv", "trust",
+}
+# grams shared by more names than this carry no signal and only slow candidate generation down
+MAX_POSTING = 1000
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+_DIGITS = re.compile(r"[0-9]+")
+
+
+def normalize_name(value) -> str:
+    """Casefold, strip accents and punctuation, and drop trailing legal suffixes: 'ACME Ltd.' -> 'acme'."""
+    text = unicodedata.normalize("NFKD", str(value or "")).encode("ascii", "ignore").decode("ascii")
+    tokens = _NON_ALNUM.sub(" ", text.casefold()).split()
+    while len(tokens) > 1 and tokens[-1] in LEGAL_SUFFIXES:
+        tokens.pop()
+    return " ".join(tokens)
+
+
+def digit_runs(norm: str) -> Tuple[str, ...]:
+    """Account numbers, series and branch numbers: names differing here are different parties however similar."""
+    return tuple(_DIGITS.findall(norm))
+
+
+def trigrams(norm: str) -> Set[str]:
+    padded = f"  {norm} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class EntityIndex:
+    """
+    In-memory blocking index over known party names.
+    Exact normalized names resolve directly; otherwise candidates sharing character trigrams and exactly the
+    same digit runs are scored by trigram Jaccard similarity and the best one at or above `threshold` wins.
+    """
+
+    def __init__(self, threshold: float = 0.8):
+        self.threshold = threshold
+        self.built_at = time.monotonic()
+        self._exact: Dict[str, str] = {}
+        self._grams: List[Set[str]] = []
+        self._digits: List[Tuple[str, ...]] = []
+        self._canonical: List[str] = []
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+
+    def __len__(self) -> int:
+        return len(self._canonical)
+
+    def add(self, name, canonical_id: str) -> None:
+        norm = normalize_name(name)
+        if not norm or norm in self._exact:
+            return
+        self._exact[norm] = canonical_id
+        idx = len(self._canonical)
+        grams = trigrams(norm)
+        self._grams.append(grams)
+        self._digits.append(digit_runs(norm))
+        self._canonical.append(canonical_id)
+        for g in grams:
+            self._postings[g].append(idx)
+
+    def add_many(self, pairs: Iterable[Tuple[str, str]]) -> None:
+        for name, canonical_id in pairs:
+            self.add(name, canonical_id)
+
+    def match(self, name) -> Optional[Tuple[str, float, str]]:
+        """(canonical_id, confidence, method) for the best known match, or None."""
+        norm = normalize_name(name)
+        if not norm:
+            return None
+        if norm in self._exact:
+            return self._exact[norm], 1.0, "normalized"
+
+        grams = trigrams(norm)
+        shared: Dict[int, int] = defaultdict(int)
+        for g in grams:
+            posting = self._postings.get(g)
+            if posting and len(posting) <= MAX_POSTING:
+                for idx in posting:
+                    shared[idx] += 1
+
+        best, best_score = None, 0.0
+        n = len(grams)
+        digits = digit_runs(norm)
+        for idx, common in shared.items():
+            if self._digits[idx] != digits:
+                continue
+            m = len(self._grams[idx])
+            # Jaccard can't reach the threshold when the sizes are too far apart
+            if min(n, m) < self.threshold * max(n, m):
+                continue
+            score = common / (n + m - common)
+            if score > best_score:
+                best, best_score = idx, score
+        if best is None or best_score < self.threshold:
+            return None
+        return self._canonical[best], round(best_score, 4), "fuzzy"
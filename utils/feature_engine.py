@@ -0,0 +1,279 @@
+import math
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from operator import itemgetter
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+# inflows strictly below this amount count towards micro_count (overridable via theta_micro)
+MICRO_THRESHOLD = 1000.0
+# per-inflow cap used by twohop_amount_capped
+TWOHOP_CAP = 10000
+
+# features that are also reported per trailing window as `<name>_<w>d`
+WINDOW_FEATURES = (
+    "return_ratio",
+    "micro_count",
+    "fragmentation_index",
+    "twohop_amount_capped",
+    "relationship_overlap",
+    "burstiness",
+    "conduit_entropy",
+    "cycle_count",
+    "tx_count",
+)
+
+
+def parse_timestamp(value: Any) -> Optional[datetime]:
+    """
+    Parse a transaction timestamp (datetime or ISO string) into a naive UTC datetime.
+    Raises ValueError for values that are present but unparseable.
+    """
+    if value is None or value == "":
+        return None
+    ts = value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def _amount(txn: dict) -> float:
+    return abs(float(txn.get("amount") or 0))
+
+
+def nlogn(n: int) -> float:
+    return n * math.log(n) if n > 0 else 0.0
+
+
+def merge_moments(n_a: int, mean_a: float, m2_a: float, n_b: int, mean_b: float, m2_b: float) -> Tuple[float, float]:
+    """
+    Combine two Welford (count, mean, M2) summaries into the (mean, M2) of their union (Chan et al.).
+    utils.feature_state applies the same formula server-side when it folds a batch into stored state.
+    """
+    n = n_a + n_b
+    if not n:
+        return 0.0, 0.0
+    d = mean_b - mean_a
+    return mean_a + d * n_b / n, m2_a + m2_b + d * d * n_a * n_b / n
+
+
+class FeatureAccumulator:
+    """
+    Running aggregates for the basic transaction features.
+    Transactions can be added in any order; features() always matches a full recompute over everything added.
+    features() reads only scalars. The per-counterparty and per-pair counts are kept for membership tests
+    while adding, but are not part of to_state(): utils.feature_state stores them one row per key.
+    """
+
+    # state fields that combine by addition, so an increment computed from new records alone can be $inc'ed
+    ADDITIVE = ("tx_count", "sum_in", "sum_out", "micro_count", "twohop", "n_in", "cp_in_total")
+    # Welford moments over inflow amounts: persisted as they are and merged with merge_moments, never via a
+    # sum of squares, which loses the variance to cancellation once amounts are large next to their spread
+    MOMENTS = ("mean_in", "m2_in")
+
+    def __init__(self, micro_threshold: float = MICRO_THRESHOLD, cap: float = TWOHOP_CAP):
+        self.micro_threshold = micro_threshold
+        self.cap = cap
+        self.tx_count = 0
+        self.sum_in = 0.0
+        self.sum_out = 0.0
+        self.micro_count = 0
+        self.twohop = 0.0
+        # Welford running mean / M2 over inflow amounts (burstiness)
+        self.n_in = 0
+        self.mean_in = 0.0
+        self.m2_in = 0.0
+        # inflow counterparty counts (fragmentation_index, conduit_entropy) and outflow counterparty counts
+        self.cp_in: Counter = Counter()
+        self.cp_out: Counter = Counter()
+        self.cp_in_total = 0
+        self.cp_in_unique = 0
+        # sum of n*ln(n) over inflow counterparty counts: entropy = ln(total) - nlogn / total
+        self.cp_in_nlogn = 0.0
+        self.overlap = 0
+        # (from, to) pair counts; cycle_count = tx_count - distinct pairs
+        self.pairs: Counter = Counter()
+        self.pair_count = 0
+        self.has_timestamps = False
+        self.bad_timestamps = False
+
+    def add(self, txn: dict) -> None:
+        self.tx_count += 1
+        direction = txn.get("direction")
+        cp = txn.get("counterparty")
+
+        if direction == "in":
+            a = _amount(txn)
+            self.sum_in += a
+            if a < self.micro_threshold:
+                self.micro_count += 1
+            self.twohop += min(a, self.cap)
+            self.n_in += 1
+            delta = a - self.mean_in
+            self.mean_in += delta / self.n_in
+            self.m2_in += delta * (a - self.mean_in)
+            if cp:
+                n = self.cp_in[cp]
+                if not n:
+                    self.cp_in_unique += 1
+                    if cp in self.cp_out:
+                        self.overlap += 1
+                self.cp_in[cp] = n + 1
+                self.cp_in_nlogn += nlogn(n + 1) - nlogn(n)
+                self.cp_in_total += 1
+        elif direction == "out":
+            self.sum_out += _amount(txn)
+            if cp:
+                if cp not in self.cp_out and cp in self.cp_in:
+                    self.overlap += 1
+                self.cp_out[cp] += 1
+
+        pair = (txn.get("from"), txn.get("to"))
+        if pair not in self.pairs:
+            self.pair_count += 1
+        self.pairs[pair] += 1
+
+        ts = txn.get("timestamp")
+        if ts:
+            self.has_timestamps = True
+            # typed ingest stores datetimes; only legacy string rows need a parse
+            if not isinstance(ts, datetime):
+                try:
+                    parse_timestamp(ts)
+                except (TypeError, ValueError):
+                    self.bad_timestamps = True
+
+    @property
+    def cycle_count(self) -> int:
+        return self.tx_count - self.pair_count
+
+    def to_state(self) -> Dict[str, Any]:
+        """Scalars only, so the document stays the same size however long the grant's history grows."""
+        return {
+            "micro_threshold": self.micro_threshold,
+            "cap": self.cap,
+            **{name: getattr(self, name) for name in self.ADDITIVE + self.MOMENTS},
+            "cp_in_unique": self.cp_in_unique,
+            "cp_in_nlogn": self.cp_in_nlogn,
+            "overlap": self.overlap,
+            "pair_count": self.pair_count,
+            "has_timestamps": self.has_timestamps,
+            "bad_timestamps": self.bad_timestamps,
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "FeatureAccumulator":
+        """Scalars only: the result can report features() but not add() further records."""
+        acc = cls(state.get("micro_threshold", MICRO_THRESHOLD), state.get("cap", TWOHOP_CAP))
+        for name in cls.ADDITIVE + cls.MOMENTS + ("cp_in_unique", "cp_in_nlogn", "overlap", "pair_count",
+                                                  "has_timestamps", "bad_timestamps"):
+            if name in state:
+                setattr(acc, name, state[name])
+        if acc.n_in and "m2_in" not in state:
+            # states written before the moments were persisted carry a sum of squares instead
+            acc.mean_in = acc.sum_in / acc.n_in
+            acc.m2_in = max(state.get("sumsq_in", 0.0) - acc.n_in * acc.mean_in ** 2, 0.0)
+        return acc
+
+    def features(self) -> Dict[str, Any]:
+        if not self.tx_count:
+            return empty_features()
+
+        return_ratio = (self.sum_out / self.sum_in) if self.sum_in > 0 else 0.0
+        fragmentation_index = self.cp_in_unique / (self.n_in or 1)
+
+        burstiness = 0.0
+        if self.n_in and self.mean_in > 0:
+            burstiness = math.sqrt(max(self.m2_in, 0.0) / self.n_in) / self.mean_in
+
+        entropy = 0.0
+        if self.cp_in_total:
+            entropy = max(math.log(self.cp_in_total) - self.cp_in_nlogn / self.cp_in_total, 0.0)
+
+        # latency stays 0 until grant creation dates are ingested; None flags unparseable timestamps
+        latency_first_inflow_d = None if self.bad_timestamps else 0
+
+        return {
+            "return_ratio": round(return_ratio, 4),
+            "micro_count": int(self.micro_count),
+            "fragmentation_index": round(fragmentation_index, 4),
+            "latency_first_inflow_d": latency_first_inflow_d,
+            # round first so float summation order cannot flip the truncation
+            "twohop_amount_capped": int(round(self.twohop, 6)),
+            "relationship_overlap": int(self.overlap),
+            "burstiness": round(burstiness, 4),
+            "conduit_entropy": round(entropy, 4),
+            "cycle_count": int(self.cycle_count),
+            "tx_count": self.tx_count,
+        }
+
+
+def empty_features() -> Dict[str, Any]:
+    return {
+        "return_ratio": 0.0,
+        "micro_count": 0,
+        "fragmentation_index": 0.0,
+        "latency_first_inflow_d": None,
+        "twohop_amount_capped": 0,
+        "relationship_overlap": 0,
+        "burstiness": 0.0,
+        "conduit_entropy": 0.0,
+        "cycle_count": 0,
+        "tx_count": 0,
+    }
+
+
+def compute_window_features(
+    transactions: Iterable[dict],
+    micro_threshold: float = MICRO_THRESHOLD,
+    windows: Iterable[int] = (),
+    accumulator: Optional[FeatureAccumulator] = None,
+) -> Dict[str, Any]:
+    """
+    Full-history features plus `<feature>_<w>d` for each trailing window, in a single pass.
+    Windows end at the latest transaction timestamp. Transactions are walked newest first through one
+    accumulator and its state is snapshotted as each window boundary is crossed, so every extra window
+    costs one snapshot instead of another pass over the data.
+    Pass an empty `accumulator` to keep the full-history state (e.g. to persist it).
+    """
+    acc = accumulator if accumulator is not None else FeatureAccumulator(micro_threshold)
+    windows = sorted({int(w) for w in windows if int(w) > 0})
+    if not windows:
+        for t in transactions:
+            acc.add(t)
+        return acc.features()
+
+    timed, untimed = [], []
+    for t in transactions:
+        try:
+            ts = parse_timestamp(t.get("timestamp"))
+        except (TypeError, ValueError):
+            ts = None
+        if ts is None:
+            untimed.append(t)
+        else:
+            timed.append((ts, t))
+    timed.sort(key=itemgetter(0), reverse=True)
+
+    snapshots: Dict[int, Dict[str, Any]] = {}
+    if timed:
+        as_of = timed[0][0]
+        cutoffs = [(w, as_of - timedelta(days=w)) for w in windows]
+        i = 0
+        for ts, t in timed:
+            while i < len(cutoffs) and ts < cutoffs[i][1]:
+                snapshots[cutoffs[i][0]] = acc.features()
+                i += 1
+            acc.add(t)
+        for w, _ in cutoffs[i:]:
+            snapshots[w] = acc.features()
+    else:
+        snapshots = {w: empty_features() for w in windows}
+
+    for t in untimed:
+        acc.add(t)
+
+    features = acc.features()
+    for w in windows:
+        for name in WINDOW_FEATURES:
+            features[f"{name}_{w}d"] = snapshots[w][name]
+    return features
@@ -0,0 +1,155 @@
+import math
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List
+
+from models.schemas import AMOUNT_EXPR
+from utils.feature_engine import MICRO_THRESHOLD, TWOHOP_CAP, WINDOW_FEATURES, empty_features, parse_timestamp
+
+# mirrors the python engine's truthiness tests on counterparty and timestamp
+_FALSY = [None, "", 0, False]
+
+
+def _facets(micro_threshold: float, cap: float) -> Dict[str, List[dict]]:
+    return {
+        "inflow": [
+            {"$match": {"direction": "in"}},
+            {"$group": {
+                "_id": None,
+                "n": {"$sum": 1},
+                "sum": {"$sum": AMOUNT_EXPR},
+                "micro": {"$sum": {"$cond": [{"$lt": [AMOUNT_EXPR, micro_threshold]}, 1, 0]}},
+                "capped": {"$sum": {"$min": [AMOUNT_EXPR, cap]}},
+                "std": {"$stdDevPop": AMOUNT_EXPR},
+            }},
+        ],
+        "outflow": [
+            {"$match": {"direction": "out"}},
+            {"$group": {"_id": None, "sum": {"$sum": AMOUNT_EXPR}}},
+        ],
+        # entropy = ln(N) - sum(n ln n) / N, so only three numbers leave the server
+        "cp_in": [
+            {"$match": {"direction": "in", "counterparty": {"$nin": _FALSY}}},
+            {"$group": {"_id": "$counterparty", "n": {"$sum": 1}}},
+            {"$group": {
+                "_id": None,
+                "unique": {"$sum": 1},
+                "total": {"$sum": "$n"},
+                "nlogn": {"$sum": {"$multiply": ["$n", {"$ln": "$n"}]}},
+            }},
+        ],
+        "overlap": [
+            {"$match": {"direction": {"$in": ["in", "out"]}, "counterparty": {"$nin": _FALSY}}},
+            {"$group": {"_id": "$counterparty", "dirs": {"$addToSet": "$direction"}}},
+            {"$match": {"dirs.1": {"$exists": True}}},
+            {"$count": "n"},
+        ],
+        "pairs": [
+            {"$group": {"_id": {"f": {"$ifNull": ["$from", None]}, "t": {"$ifNull": ["$to", None]}}}},
+            {"$count": "n"},
+        ],
+        "total": [{"$count": "n"}],
+    }
+
+
+# present timestamps that are neither BSON dates nor parseable strings; the python engine reports
+# latency_first_inflow_d as None when there is any
+_BAD_TIMESTAMPS = [
+    {"$match": {"timestamp": {"$nin": _FALSY, "$not": {"$type": "date"}}}},
+    {"$project": {"_id": 0, "parsed": {"$cond": [
+        {"$eq": [{"$type": "$timestamp"}, "string"]},
+        {"$dateFromString": {"dateString": "$timestamp", "onError": None}},
+        None,
+    ]}}},
+    {"$match": {"parsed": None}},
+    {"$limit": 1},
+    {"$count": "n"},
+]
+
+
+def _first(out: Dict[str, list], key: str) -> Dict[str, Any]:
+    rows = out.get(key) or []
+    return rows[0] if rows else {}
+
+
+def _assemble(out: Dict[str, list], suffix: str) -> Dict[str, Any]:
+    total = _first(out, "total" + suffix).get("n", 0)
+    if not total:
+        return empty_features()
+
+    inflow = _first(out, "inflow" + suffix)
+    cp_in = _first(out, "cp_in" + suffix)
+    n_in = inflow.get("n", 0)
+    sum_in = inflow.get("sum", 0.0)
+    sum_out = _first(out, "outflow" + suffix).get("sum", 0.0)
+
+    mean = sum_in / n_in if n_in else 0.0
+    burstiness = (inflow.get("std") or 0.0) / mean if mean > 0 else 0.0
+
+    entropy = 0.0
+    if cp_in.get("total"):
+        entropy = math.log(cp_in["total"]) - cp_in["nlogn"] / cp_in["total"]
+
+    return {
+        "return_ratio": round(sum_out / sum_in, 4) if sum_in > 0 else 0.0,
+        "micro_count": int(inflow.get("micro", 0)),
+        "fragmentation_index": round(cp_in.get("unique", 0) / (n_in or 1), 4),
+        # latency stays 0 until grant creation dates are ingested, as in the python engine
+        "latency_first_inflow_d": None if _first(out, "bad_timestamps" + suffix).get("n") else 0,
+        "twohop_amount_capped": int(round(inflow.get("capped", 0.0), 6)),
+        "relationship_overlap": int(_first(out, "overlap" + suffix).get("n", 0)),
+        "burstiness": round(burstiness, 4),
+        "conduit_entropy": round(max(entropy, 0.0), 4),
+        "cycle_count": int(total - _first(out, "pairs" + suffix).get("n", 0)),
+        "tx_count": int(total),
+    }
+
+
+async def compute_features_pipeline(
+    transactions,
+    grant_id: str,
+    micro_threshold: float = MICRO_THRESHOLD,
+    windows: Iterable[int] = (),
+    cap: float = TWOHOP_CAP,
+) -> Dict[str, Any]:
+    """
+    Same features as utils.feature_engine.compute_window_features, aggregated inside MongoDB by one
+    $match/$facet pipeline over the `transactions` collection, so only a few numbers cross the network.
+    Window cutoffs are compared in the stored timestamp type, which assumes timestamps of a grant are
+    stored consistently (all BSON dates, or all ISO strings in the same format).
+    """
+    base = _facets(micro_threshold, cap)
+    facets = {**base, "bad_timestamps": _BAD_TIMESTAMPS}
+
+    windows = sorted({int(w) for w in windows if int(w) > 0})
+    if windows:
+        # windows end at the latest parseable timestamp; malformed values are skipped like the python engine does
+        as_of_raw = as_of = None
+        cursor = transactions.find(
+            {"grant_id": grant_id, "timestamp": {"$nin": _FALSY}}, {"_id": 0, "timestamp": 1}
+        ).sort("timestamp", -1)
+        async for latest in cursor:
+            try:
+                as_of = parse_timestamp(latest["timestamp"])
+            except (TypeError, ValueError):
+                continue
+            as_of_raw = latest["timestamp"]
+            break
+        for w in windows:
+            if as_of is None:
+                continue
+            cutoff = as_of - timedelta(days=w)
+            since = cutoff if isinstance(as_of_raw, datetime) else cutoff.isoformat()
+            # the upper bound keeps malformed strings that sort after every date out of the window
+            match = {"$match": {"timestamp": {"$gte": since, "$lte": as_of_raw}}}
+            for name, stages in base.items():
+                facets[f"{name}_{w}d"] = [match] + stages
+
+    rows = await transactions.aggregate([{"$match": {"grant_id": grant_id}}, {"$facet": facets}]).to_list(length=1)
+    out = rows[0] if rows else {}
+
+    features = _assemble(out, "")
+    for w in windows:
+        wf = _assemble(out, f"_{w}d")
+        for name in WINDOW_FEATURES:
+            features[f"{name}_{w}d"] = wf[name]
+    return features
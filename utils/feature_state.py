@@ -0,0 +1,201 @@
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Tuple
+from uuid import uuid4
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from database import db
+from utils.feature_engine import MICRO_THRESHOLD, TWOHOP_CAP, FeatureAccumulator, nlogn
+from utils.write_behind import write_behind
+
+logger = logging.getLogger("feature_state")
+
+# feature_state holds one document of scalars per grant; feature_keys holds one row per inflow/outflow
+# counterparty ({kind: "cp", key, in, out}) and per (from, to) pair ({kind: "pair", key: {f, t}, n}), so
+# neither grows with the other and an ingest touches only the keys its records mention
+KEYS_CHUNK = 1000
+
+
+def _pair_key(pair: Tuple[Any, Any]) -> Dict[str, Any]:
+    # an embedded document rather than an array, so the unique index does not go multikey
+    return {"f": pair[0], "t": pair[1]}
+
+
+def _key_rows(grant_id: str, acc: FeatureAccumulator) -> List[dict]:
+    rows = [
+        {"grant_id": grant_id, "kind": "cp", "key": cp, "in": acc.cp_in.get(cp, 0), "out": acc.cp_out.get(cp, 0)}
+        for cp in set(acc.cp_in) | set(acc.cp_out)
+    ]
+    rows += [{"grant_id": grant_id, "kind": "pair", "key": _pair_key(p), "n": n} for p, n in acc.pairs.items()]
+    return rows
+
+
+async def save_states(states: Iterable[Tuple[str, FeatureAccumulator]]) -> None:
+    """Replace grants' persisted state (scalars and key rows) after a full recompute."""
+    states = list(states)
+    if not states:
+        return
+    now = datetime.utcnow().isoformat()
+    await db.feature_state.bulk_write([
+        UpdateOne(
+            {"grant_id": gid},
+            {"$set": {"state": acc.to_state(), "rev": uuid4().hex, "updated_at": now}, "$inc": {"version": 1}},
+            upsert=True,
+        )
+        for gid, acc in states
+    ], ordered=False)
+    await db.feature_keys.delete_many({"grant_id": {"$in": [gid for gid, _ in states]}})
+    # upserts rather than inserts, so two recomputes of one grant racing here cannot collide
+    rows = [
+        UpdateOne({k: row[k] for k in ("grant_id", "kind", "key")}, {"$set": row}, upsert=True)
+        for gid, acc in states for row in _key_rows(gid, acc)
+    ]
+    for i in range(0, len(rows), KEYS_CHUNK):
+        await db.feature_keys.bulk_write(rows[i:i + KEYS_CHUNK], ordered=False)
+
+
+async def _bump(grant_id: str, kind: str, key: Any, inc: Dict[str, int]) -> dict:
+    # the returned post-update row tells this caller alone what the counts were before its increment
+    query = {"grant_id": grant_id, "kind": kind, "key": key}
+    for attempt in range(2):
+        try:
+            return await db.feature_keys.find_one_and_update(
+                query, {"$inc": inc}, upsert=True, return_document=ReturnDocument.AFTER, projection={"_id": 0}
+            )
+        except DuplicateKeyError:
+            # two first sightings of the same key raced on the upsert; the retry finds the winner's row
+            if attempt:
+                raise
+
+
+async def _key_increments(grant_id: str, delta: FeatureAccumulator) -> Dict[str, float]:
+    """
+    Apply a batch's per-key counts to feature_keys and derive the changes to the key-based scalars.
+    Each key is updated atomically, so concurrent ingests of one grant each see a distinct before/after.
+    """
+    cps = list(set(delta.cp_in) | set(delta.cp_out))
+    pairs = list(delta.pairs)
+    rows = await asyncio.gather(
+        *(_bump(grant_id, "cp", cp, {"in": delta.cp_in.get(cp, 0), "out": delta.cp_out.get(cp, 0)}) for cp in cps),
+        *(_bump(grant_id, "pair", _pair_key(p), {"n": delta.pairs[p]}) for p in pairs),
+    )
+    inc = {"cp_in_unique": 0, "cp_in_nlogn": 0.0, "overlap": 0, "pair_count": 0}
+    for cp, row in zip(cps, rows):
+        n_in, n_out = row.get("in", 0), row.get("out", 0)
+        was_in, was_out = n_in - delta.cp_in.get(cp, 0), n_out - delta.cp_out.get(cp, 0)
+        if n_in and not was_in:
+            inc["cp_in_unique"] += 1
+        inc["cp_in_nlogn"] += nlogn(n_in) - nlogn(was_in)
+        if n_in and n_out and not (was_in and was_out):
+            inc["overlap"] += 1
+    for p, row in zip(pairs, rows[len(cps):]):
+        if row["n"] == delta.pairs[p]:
+            inc["pair_count"] += 1
+    return inc
+
+
+def _add(field: str, value: Any) -> dict:
+    # $inc semantics inside an update pipeline: a missing field counts as 0
+    return {"$add": [{"$ifNull": [f"${field}", 0]}, value]}
+
+
+def _merged_moments(delta: FeatureAccumulator) -> dict:
+    """merge_moments(stored state, delta) as an aggregation expression yielding {mean, m2}."""
+    n_b, mean_b, m2_b = delta.n_in, delta.mean_in, delta.m2_in
+    return {"$let": {
+        "vars": {"n": {"$add": ["$state.n_in", n_b]}, "d": {"$subtract": [mean_b, "$state.mean_in"]}},
+        "in": {
+            "mean": {"$add": ["$state.mean_in", {"$divide": [{"$multiply": ["$$d", n_b]}, "$$n"]}]},
+            "m2": {"$add": ["$state.m2_in", m2_b, {"$divide": [{"$multiply": ["$$d", "$$d", "$state.n_in", n_b]}, "$$n"]}]},
+        },
+    }}
+
+
+def _state_update(delta: FeatureAccumulator, key_inc: Dict[str, float], now: str) -> List[dict]:
+    """
+    One atomic pipeline update folding a batch into a grant's state: the additive scalars are summed and
+    the inflow moments merged against the stored values, so concurrent ingests of one grant cannot interleave.
+    """
+    inc = {name: getattr(delta, name) for name in FeatureAccumulator.ADDITIVE}
+    inc.update(key_inc)
+    fields = {f"state.{k}": _add(f"state.{k}", v) for k, v in inc.items()}
+    fields.update({"version": _add("version", 1), "rev": uuid4().hex, "updated_at": now})
+    fields.update({f"state.{k}": True for k in ("has_timestamps", "bad_timestamps") if getattr(delta, k)})
+    if not delta.n_in:
+        return [{"$set": fields}]
+    # the merge reads the pre-update n_in and mean_in, so it is computed in a stage of its own
+    fields.update({"state.mean_in": "$_moments.mean", "state.m2_in": "$_moments.m2"})
+    return [{"$set": {"_moments": _merged_moments(delta)}}, {"$set": fields}, {"$unset": "_moments"}]
+
+
+async def apply_transactions(records: Iterable[dict]) -> int:
+    """
+    Fold newly inserted transactions into each grant's persisted state and refresh the full-history
+    features in `features`, so maintenance costs O(new records) rather than a full rescan: the scalars
+    are moved with one pipeline update per grant and only the counterparties and pairs the records
+    mention are read.
+    Windowed `<feature>_<w>d` values are left as they were; they move with the latest timestamp and
+    are refreshed by POST /features.
+    Must be called after the records are inserted: grants without state are seeded from a full scan.
+    Returns the number of grants updated.
+    """
+    pending: Dict[str, List[dict]] = defaultdict(list)
+    for r in records:
+        if r.get("grant_id") is not None:
+            pending[r["grant_id"]].append(r)
+    if not pending:
+        return 0
+
+    # the dotted feature updates below must land after any buffered full-document write
+    await write_behind.flush(["features"])
+    docs = {
+        d["grant_id"]: d
+        async for d in db.feature_state.find({"grant_id": {"$in": list(pending)}}, {"grant_id": 1, "state": 1})
+    }
+
+    # grants seen for the first time, or whose state predates the key rows or the persisted moments, are
+    # seeded from their history, which already includes these records
+    seeds = []
+    stale = [gid for gid in pending if not {"pair_count", "m2_in"} <= set((docs.get(gid) or {}).get("state", {}))]
+    for gid in stale:
+        acc = FeatureAccumulator()
+        async for t in db.transactions.find({"grant_id": gid}, {"_id": 0}):
+            acc.add(t)
+        seeds.append((gid, acc))
+        del pending[gid]
+    await save_states(seeds)
+
+    now = datetime.utcnow().isoformat()
+    deltas = {}
+    for gid, txs in pending.items():
+        state = docs[gid]["state"]
+        delta = deltas[gid] = FeatureAccumulator(state.get("micro_threshold", MICRO_THRESHOLD), state.get("cap", TWOHOP_CAP))
+        for t in txs:
+            delta.add(t)
+    key_incs = await asyncio.gather(*(_key_increments(gid, delta) for gid, delta in deltas.items()))
+
+    ops = [
+        UpdateOne({"grant_id": gid}, _state_update(delta, key_inc, now))
+        for (gid, delta), key_inc in zip(deltas.items(), key_incs)
+    ]
+    if ops:
+        await db.feature_state.bulk_write(ops, ordered=False)
+
+    features = {gid: acc.features() for gid, acc in seeds}
+    if pending:
+        async for d in db.feature_state.find({"grant_id": {"$in": list(pending)}}, {"grant_id": 1, "state": 1}):
+            features[d["grant_id"]] = FeatureAccumulator.from_state(d["state"]).features()
+    if features:
+        await db.features.bulk_write([
+            UpdateOne(
+                {"grant_id": gid},
+                {"$set": {"grant_id": gid, "computed_at": now, **{f"features.{k}": v for k, v in f.items()}}},
+                upsert=True,
+            )
+            for gid, f in features.items()
+        ], ordered=False)
+    return len(features)
@@ -0,0 +1,109 @@
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from database import db
+from settings import settings
+from utils.gemini_client import call_gemini, request_key
+
+logger = logging.getLogger("gemini_cache")
+
+_memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_stats = {"memory_hits": 0, "mongo_hits": 0, "misses": 0, "bypassed": 0, "errors": 0}
+
+
+def cache_stats() -> Dict[str, Any]:
+    lookups = _stats["memory_hits"] + _stats["mongo_hits"] + _stats["misses"]
+    hits = _stats["memory_hits"] + _stats["mongo_hits"]
+    return {
+        **_stats,
+        "memory_size": len(_memory),
+        "hit_ratio": round(hits / lookups, 4) if lookups else None,
+    }
+
+
+def clear_memory_cache() -> None:
+    _memory.clear()
+
+
+def _memory_get(key: str) -> Optional[Dict[str, Any]]:
+    entry = _memory.get(key)
+    if entry is None:
+        return None
+    expires, value = entry
+    if expires < time.time():
+        del _memory[key]
+        return None
+    _memory.move_to_end(key)
+    return value
+
+
+def _memory_put(key: str, value: Dict[str, Any], ttl: int) -> None:
+    _memory[key] = (time.time() + ttl, value)
+    _memory.move_to_end(key)
+    while len(_memory) > settings.GEMINI_CACHE_SIZE:
+        _memory.popitem(last=False)
+
+
+async def cached_call_gemini(
+    prompt: str,
+    max_output_tokens: int = 512,
+    temperature: float = 0.2,
+    bypass_cache: bool = False,
+) -> Dict[str, Any]:
+    """
+    call_gemini behind a two-tier cache keyed on request_key(model, prompt, temperature, max tokens):
+    an in-process LRU in front of a Mongo collection with a TTL index. Only successful responses are
+    cached. `bypass_cache` skips the lookup but still refreshes both tiers with the new answer.
+    The returned dict carries `cache`: "memory", "mongo", "miss" or "bypass".
+    """
+    ttl = settings.GEMINI_CACHE_TTL_SEC
+    if not settings.GEMINI_CACHE_ENABLED:
+        g = await call_gemini(prompt, max_output_tokens, temperature)
+        return {**g, "cache": "bypass"}
+
+    key = request_key(prompt, max_output_tokens, temperature)
+    if bypass_cache:
+        _stats["bypassed"] += 1
+    else:
+        hit = _memory_get(key)
+        if hit is not None:
+            _stats["memory_hits"] += 1
+            return {**hit, "cache": "memory"}
+        try:
+            doc = await db.gemini_cache.find_one({"_id": key, "expires_at": {"$gt": datetime.utcnow()}})
+        except Exception:
+            _stats["errors"] += 1
+            logger.exception("Gemini cache lookup failed")
+            doc = None
+        if doc:
+            _stats["mongo_hits"] += 1
+            _memory_put(key, doc["response"], ttl)
+            return {**doc["response"], "cache": "mongo"}
+        _stats["misses"] += 1
+
+    g = await call_gemini(prompt, max_output_tokens, temperature)
+    await remember(prompt, g, max_output_tokens, temperature)
+    return {**g, "cache": "bypass" if bypass_cache else "miss"}
+
+
+async def remember(prompt: str, g: Dict[str, Any], max_output_tokens: int = 512, temperature: float = 0.2) -> None:
+    """Store a response obtained outside cached_call_gemini (e.g. a streamed one) in both cache tiers."""
+    if not settings.GEMINI_CACHE_ENABLED:
+        return
+    ttl = settings.GEMINI_CACHE_TTL_SEC
+    key = request_key(prompt, max_output_tokens, temperature)
+    # the raw upstream payload is large and never read by callers; keep the parsed parts only
+    response = {"text": g.get("text"), "json": g.get("json")}
+    _memory_put(key, response, ttl)
+    try:
+        await db.gemini_cache.update_one(
+            {"_id": key},
+            {"$set": {"response": response, "expires_at": datetime.utcnow() + timedelta(seconds=ttl)}},
+            upsert=True,
+        )
+    except Exception:
+        _stats["errors"] += 1
+        logger.exception("Failed to persist Gemini cache entry")
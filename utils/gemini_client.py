@@ -1,46 +1,41 @@
+import asyncio
+import hashlib
 import json
 import logging
-from typing import Optional, Dict, Any
-import requests
+import random
+from typing import AsyncIterator, Optional, Dict, Any
+import httpx
 from settings import settings
+from utils.metrics import metrics
 
 logger = logging.getLogger("gemini_client")
 logger.setLevel(logging.INFO)
 
 GEMINI_ENDPOINT = f"{settings.GEMINI_URL}/{settings.GEMINI_MODEL}:generateContent"
-API_KEY_HEADER = {"X-goog-api-key": settings.GEMINI_API_KEY, "Content-Type": "application/json"}
 
+# upstream statuses worth retrying: rate limiting and transient server errors
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
 
-def call_gemini(prompt: str, max_output_tokens: int = 512, temperature: float = 0.2) -> Dict[str, Any]:
-    """
-    Calls Gemini generateContent and returns parsed JSON. The prompt *should* instruct Gemini to return JSON
-    if you expect structured output. This function does basic parsing but is defensive.
-    """
-    payload = {
-        "contents": [
-            {
-                "parts": [{"text": prompt}]
-            }
-        ],
-        "temperature": temperature,
-        "maxOutputTokens": max_output_tokens,
-    }
 
-    try:
-        resp = requests.post(GEMINI_ENDPOINT, headers=API_KEY_HEADER, json=payload, timeout=20)
-        resp.raise_for_status()
-        data = resp.json()
-    except requests.RequestException as e:
-        logger.exception("Gemini request failed")
-        raise RuntimeError(f"Gemini API request failed: {e}")
+def request_key(prompt: str, max_output_tokens: int = 512, temperature: float = 0.2, model: Optional[str] = None) -> str:
+    """Content address of a generateContent request: identical requests share a key."""
+    material = json.dumps([model or settings.GEMINI_MODEL, prompt, float(temperature), int(max_output_tokens)])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
 
+def _parse_response(data: Dict[str, Any]) -> Dict[str, Any]:
     # The API's response structure can vary. Try to extract candidate text(s).
-    # Typical shape: {'candidates':[{'output':'...'}], ...} or nested choices.
+    # Typical shape: {'candidates':[{'content':{'parts':[{'text':'...'}]}}], ...} or nested choices.
     text_out = ""
     try:
         # Try a few common shapes
         if "candidates" in data and isinstance(data["candidates"], list) and data["candidates"]:
-            text_out = data["candidates"][0].get("output", "") or data["candidates"][0].get("content", "")
+            candidate = data["candidates"][0]
+            content = candidate.get("content")
+            if isinstance(content, dict) and isinstance(content.get("parts"), list):
+                text_out = "".join(part.get("text", "") for part in content["parts"])
+            else:
+                text_out = candidate.get("output", "") or content or ""
         elif "output" in data and isinstance(data["output"], dict):
             # maybe output->content->parts
             out = data["output"]
@@ -65,3 +60,177 @@ def call_gemini(prompt: str, max_output_tokens: int = 512, temperature: float =
         return {"raw": data, "text": text_out, "json": parsed}
     except Exception:
         return {"raw": data, "text": text_out, "json": None}
+
+
+def _chunk_text(data: Dict[str, Any]) -> str:
+    # one streamGenerateContent event; events without candidate text (e.g. usage metadata) yield nothing
+    try:
+        parts = data["candidates"][0]["content"]["parts"]
+        return "".join(part.get("text", "") for part in parts)
+    except (KeyError, IndexError, TypeError, AttributeError):
+        return ""
+
+
+def _payload(prompt: str, max_output_tokens: int, temperature: float) -> Dict[str, Any]:
+    return {
+        "contents": [
+            {
+                "parts": [{"text": prompt}]
+            }
+        ],
+        "generationConfig": {
+            "temperature": temperature,
+            "maxOutputTokens": max_output_tokens,
+        },
+    }
+
+
+class GeminiClient:
+    """
+    Async generateContent client sharing one keep-alive connection pool.
+    At most `max_in_flight` requests are sent upstream at once; 429/5xx and transport errors are retried with
+    jittered exponential backoff; concurrent calls for the same request_key share a single upstream call.
+    `endpoint`, `api_key` and `transport` can be overridden to run against a local stub server.
+    """
+
+    def __init__(
+        self,
+        endpoint: str = GEMINI_ENDPOINT,
+        api_key: str = settings.GEMINI_API_KEY,
+        max_in_flight: int = settings.GEMINI_MAX_IN_FLIGHT,
+        max_retries: int = settings.GEMINI_MAX_RETRIES,
+        timeout: float = settings.GEMINI_TIMEOUT_SEC,
+        backoff_base: float = settings.GEMINI_BACKOFF_BASE_SEC,
+        backoff_max: float = settings.GEMINI_BACKOFF_MAX_SEC,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.endpoint = endpoint
+        self.stream_endpoint = endpoint.replace(":generateContent", ":streamGenerateContent")
+        self.headers = {"X-goog-api-key": api_key, "Content-Type": "application/json"}
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.transport = transport
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._pending: Dict[str, asyncio.Task] = {}
+        self._stats = {
+            "requests": 0, "streams": 0, "upstream_calls": 0, "coalesced": 0, "retries": 0, "failures": 0, "in_flight": 0,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._stats)
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            limits = httpx.Limits(
+                max_connections=settings.GEMINI_POOL_SIZE,
+                max_keepalive_connections=settings.GEMINI_POOL_SIZE,
+            )
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=limits, transport=self.transport)
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _backoff(self, attempt: int, retry_after: Optional[str]) -> float:
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        # full jitter: uniform over [0, base * 2^attempt], capped
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def _post(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        attempt = 0
+        while True:
+            retry_after = None
+            async with self._semaphore:
+                self._stats["upstream_calls"] += 1
+                self._stats["in_flight"] += 1
+                try:
+                    with metrics.track("dependency", "gemini", "generateContent") as timer:
+                        resp = await self._http().post(self.endpoint, headers=self.headers, json=payload)
+                        timer.failed = resp.status_code >= 400
+                    if resp.status_code not in RETRYABLE_STATUS:
+                        resp.raise_for_status()
+                        return _parse_response(resp.json())
+                    retry_after = resp.headers.get("Retry-After")
+                    error: Exception = httpx.HTTPStatusError(
+                        f"Gemini returned {resp.status_code}", request=resp.request, response=resp
+                    )
+                except httpx.TransportError as e:
+                    error = e
+                except (httpx.HTTPError, ValueError) as e:
+                    self._stats["failures"] += 1
+                    logger.exception("Gemini request failed")
+                    raise RuntimeError(f"Gemini API request failed: {e}")
+                finally:
+                    self._stats["in_flight"] -= 1
+
+            if attempt >= self.max_retries:
+                self._stats["failures"] += 1
+                logger.error("Gemini request failed after %d attempts: %s", attempt + 1, error)
+                raise RuntimeError(f"Gemini API request failed: {error}")
+            # sleep outside the semaphore so waiting retries do not hold a slot
+            delay = self._backoff(attempt, retry_after)
+            attempt += 1
+            self._stats["retries"] += 1
+            logger.warning("Gemini call failed (%s), retry %d in %.2fs", error, attempt, delay)
+            await asyncio.sleep(delay)
+
+    async def generate(self, prompt: str, max_output_tokens: int = 512, temperature: float = 0.2) -> Dict[str, Any]:
+        self._stats["requests"] += 1
+        key = request_key(prompt, max_output_tokens, temperature)
+        task = self._pending.get(key)
+        if task is not None:
+            self._stats["coalesced"] += 1
+        else:
+            task = asyncio.ensure_future(self._post(_payload(prompt, max_output_tokens, temperature)))
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        # shield: one caller giving up must not cancel the call other callers are waiting on
+        return await asyncio.shield(task)
+
+    async def stream(self, prompt: str, max_output_tokens: int = 512, temperature: float = 0.2) -> AsyncIterator[str]:
+        """
+        streamGenerateContent over SSE, yielding text fragments as Gemini produces them. Shares the pool and the
+        in-flight cap with generate(); not retried or coalesced, since callers have already consumed part of it.
+        """
+        self._stats["streams"] += 1
+        async with self._semaphore:
+            self._stats["upstream_calls"] += 1
+            self._stats["in_flight"] += 1
+            try:
+                with metrics.track("dependency", "gemini", "streamGenerateContent"):
+                    async with self._http().stream(
+                        "POST", self.stream_endpoint, headers=self.headers, params={"alt": "sse"},
+                        json=_payload(prompt, max_output_tokens, temperature),
+                    ) as resp:
+                        resp.raise_for_status()
+                        async for line in resp.aiter_lines():
+                            if line.startswith("data:"):
+                                text = _chunk_text(json.loads(line[5:]))
+                                if text:
+                                    yield text
+            except (httpx.HTTPError, ValueError) as e:
+                self._stats["failures"] += 1
+                logger.warning("Gemini stream failed: %s", e)
+                raise RuntimeError(f"Gemini API stream failed: {e}")
+            finally:
+                self._stats["in_flight"] -= 1
+
+
+gemini = GeminiClient()
+
+
+async def call_gemini(prompt: str, max_output_tokens: int = 512, temperature: float = 0.2) -> Dict[str, Any]:
+    """
+    Calls Gemini generateContent and returns parsed JSON. The prompt *should* instruct Gemini to return JSON
+    if you expect structured output. This function does basic parsing but is defensive.
+    """
+    return await gemini.generate(prompt, max_output_tokens=max_output_tokens, temperature=temperature)
@@ -0,0 +1,132 @@
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from database import db
+from settings import settings
+
+logger = logging.getLogger("indexes")
+
+# partial, so rows stored before keys existed do not collide on a missing key
+IDEMPOTENCY_INDEX = {"keys": [("idempotency_key", ASCENDING)], "unique": True,
+                     "partialFilterExpression": {"idempotency_key": {"$exists": True}}}
+
+# Every index the service relies on, by collection. Names are left to MongoDB's default
+# (<field>_<direction>_...) so indexes created elsewhere under the same keys are recognised.
+INDEX_SPECS: Dict[str, List[Dict[str, Any]]] = {
+    "transactions": [
+        # per-grant reads and the newest-first alert timeline
+        {"keys": [("grant_id", ASCENDING), ("timestamp", DESCENDING)]},
+        # /features/batch `since`
+        {"keys": [("timestamp", ASCENDING)]},
+        # /alerts/{grant_id}/subgraph expands counterparties as well as grants
+        {"keys": [("counterparty_key", ASCENDING)]},
+        # ... and, for rows not yet migrated to carry counterparty_key, by counterparty
+        {"keys": [("counterparty", ASCENDING)]},
+        IDEMPOTENCY_INDEX,
+    ],
+    "features": [
+        {"keys": [("grant_id", ASCENDING)], "unique": True},
+        # monitoring feature freshness
+        {"keys": [("computed_at", DESCENDING)]},
+    ],
+    "feature_state": [{"keys": [("grant_id", ASCENDING)], "unique": True}],
+    # one row per counterparty / (from, to) pair of a grant, see utils/feature_state.py
+    "feature_keys": [{"keys": [("grant_id", ASCENDING), ("kind", ASCENDING), ("key", ASCENDING)], "unique": True}],
+    "rules_eval": [{"keys": [("grant_id", ASCENDING)], "unique": True}],
+    "scores": [
+        {"keys": [("grant_id", ASCENDING)], "unique": True},
+        # /reports keyset pagination, optionally narrowed to one tier
+        {"keys": [("risk_score", DESCENDING), ("grant_id", DESCENDING)]},
+        {"keys": [("risk_tier", ASCENDING), ("risk_score", DESCENDING), ("grant_id", DESCENDING)]},
+    ],
+    "alerts": [
+        {"keys": [("grant_id", ASCENDING)], "unique": True},
+        # /alerts/today keyset pagination, optionally narrowed to one tier
+        {"keys": [("timestamp", DESCENDING), ("grant_id", DESCENDING)]},
+        {"keys": [("risk_tier", ASCENDING), ("timestamp", DESCENDING), ("grant_id", DESCENDING)]},
+    ],
+    "triage": [{"keys": [("grant_id", ASCENDING)], "unique": True}],
+    "entities": [
+        {"keys": [("party_id", ASCENDING)], "unique": True},
+        {"keys": [("canonical_id", ASCENDING)]},
+        IDEMPOTENCY_INDEX,
+    ],
+    "ingest_log": [{"keys": [("ts", DESCENDING)]}],
+    "gemini_cache": [{"keys": [("expires_at", ASCENDING)], "expireAfterSeconds": 0}],
+    # only the per-day alert counters carry `day`; the portfolio document never expires
+    "dashboard_summary": [{"keys": [("day", ASCENDING)], "expireAfterSeconds": settings.SUMMARY_RETENTION_DAYS * 86400}],
+    # drift sketches are looked up by _id (the bucket start); this only ages them out
+    "drift_sketches": [{"keys": [("bucket", ASCENDING)], "expireAfterSeconds": settings.DRIFT_RETENTION_DAYS * 86400}],
+}
+
+# the collections POST /ingest/* may write to: exactly those declaring the idempotency index
+INGEST_COLLECTIONS = tuple(name for name, specs in INDEX_SPECS.items() if IDEMPOTENCY_INDEX in specs)
+
+
+def _key_tuple(keys) -> tuple:
+    return tuple((field, int(direction) if isinstance(direction, (int, float)) else direction) for field, direction in keys)
+
+
+def _models(specs: List[Dict[str, Any]]) -> List[IndexModel]:
+    return [IndexModel(spec["keys"], **{k: v for k, v in spec.items() if k != "keys"}) for spec in specs]
+
+
+def _selected(collections: Optional[Iterable[str]]) -> Dict[str, List[Dict[str, Any]]]:
+    if collections is None:
+        return INDEX_SPECS
+    unknown = set(collections) - set(INDEX_SPECS)
+    if unknown:
+        raise ValueError(f"No index spec for {sorted(unknown)}; known collections are {sorted(INDEX_SPECS)}")
+    return {name: INDEX_SPECS[name] for name in collections}
+
+
+async def ensure_indexes(collections: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """
+    Create every index in INDEX_SPECS (or only those of `collections`). Idempotent: existing indexes with
+    the same keys and options are left alone. A collection whose indexes cannot be built (for example a
+    unique index over duplicate data) is logged and reported instead of failing the others.
+    """
+    report: Dict[str, Any] = {}
+    for name, specs in _selected(collections).items():
+        try:
+            report[name] = {"indexes": await db[name].create_indexes(_models(specs))}
+        except OperationFailure as e:
+            logger.error("Could not build indexes for %s: %s", name, e)
+            report[name] = {"error": str(e)}
+    return report
+
+
+async def _usage(collection) -> Optional[Dict[str, Dict[str, Any]]]:
+    try:
+        stats = await collection.aggregate([{"$indexStats": {}}]).to_list(length=None)
+    except OperationFailure:
+        # $indexStats needs the clusterMonitor role; report usage as unknown rather than failing the check
+        return None
+    return {s["name"]: {"ops": int(s.get("accesses", {}).get("ops", 0)), "since": s.get("accesses", {}).get("since")} for s in stats}
+
+
+async def check_indexes(collections: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """
+    Compare each collection's indexes with INDEX_SPECS: `missing` are declared but absent; `unused` exist
+    but have served no operation since the server last started (per $indexStats); `undeclared` exist but
+    are not in the spec.
+    """
+    report: Dict[str, Any] = {}
+    for name, specs in _selected(collections).items():
+        existing = await db[name].index_information()
+        by_keys = {_key_tuple(info["key"]): index_name for index_name, info in existing.items()}
+        declared = {_key_tuple(spec["keys"]) for spec in specs}
+        usage = await _usage(db[name])
+
+        report[name] = {
+            "missing": [[list(k) for k in keys] for keys in declared if keys not in by_keys],
+            "undeclared": sorted(n for keys, n in by_keys.items() if keys not in declared and n != "_id_"),
+            "unused": None if usage is None else sorted(
+                n for n, u in usage.items() if n != "_id_" and u["ops"] == 0
+            ),
+            "usage": usage,
+        }
+    return report
@@ -0,0 +1,232 @@
+import asyncio
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import monitoring
+
+# upper bounds in seconds; fixed buckets keep observe() to one bisect and an increment
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+# family -> (prometheus metric prefix, help text, label names)
+FAMILIES = {
+    "http": ("aml_http_request", "HTTP requests by route template", ("method", "route")),
+    "dependency": ("aml_dependency_call", "Calls to MongoDB and Gemini", ("dependency", "operation")),
+}
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram; quantiles are interpolated within the bucket that holds them."""
+
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = BUCKETS[i - 1] if i else 0.0
+                # the overflow bucket has no upper bound; report its lower edge
+                upper = BUCKETS[i] if i < len(BUCKETS) else lower
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return BUCKETS[-1]
+
+
+class _Series:
+    __slots__ = ("histogram", "errors", "in_flight")
+
+    def __init__(self):
+        self.histogram = Histogram()
+        self.errors = 0
+        self.in_flight = 0
+
+
+_ABANDONED = (asyncio.CancelledError, GeneratorExit)
+
+
+class _Timer:
+    __slots__ = ("registry", "family", "labels", "failed", "_started")
+
+    def __init__(self, registry: "MetricsRegistry", family: str, labels: Tuple[str, ...]):
+        self.registry = registry
+        self.family = family
+        self.labels = labels
+        self.failed = False
+
+    def __enter__(self) -> "_Timer":
+        self.registry.begin(self.family, self.labels)
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        # a caller that stops waiting (cancellation, a closed stream) is not a failure of the thing being timed
+        failed = self.failed or (exc_type is not None and not issubclass(exc_type, _ABANDONED))
+        self.registry.end(self.family, self.labels, time.perf_counter() - self._started, failed)
+
+
+class MetricsRegistry:
+    """
+    Latency histograms, error counts and in-flight gauges keyed by family and label values.
+    Safe to update from pymongo's monitoring threads as well as the event loop.
+    """
+
+    def __init__(self):
+        self._series: Dict[Tuple[str, Tuple[str, ...]], _Series] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, family: str, labels: Tuple[str, ...]) -> _Series:
+        key = (family, labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series.setdefault(key, _Series())
+        return series
+
+    def begin(self, family: str, labels: Tuple[str, ...]) -> None:
+        with self._lock:
+            self._get(family, labels).in_flight += 1
+
+    def end(self, family: str, labels: Tuple[str, ...], seconds: float, failed: bool = False) -> None:
+        with self._lock:
+            series = self._get(family, labels)
+            series.in_flight -= 1
+            series.histogram.observe(seconds)
+            if failed:
+                series.errors += 1
+
+    def track(self, family: str, *labels: str) -> _Timer:
+        """`with metrics.track("dependency", "gemini", "generateContent") as t:`; set t.failed for soft failures."""
+        return _Timer(self, family, labels)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+    def snapshot(self, family: str) -> Dict[str, Dict[str, Any]]:
+        """Per-series summary in milliseconds, keyed by the space-joined label values."""
+        with self._lock:
+            items = [(labels, s) for (f, labels), s in self._series.items() if f == family]
+            out = {}
+            for labels, s in sorted(items):
+                h = s.histogram
+                summary = {"count": h.count, "errors": s.errors, "in_flight": s.in_flight,
+                           "mean_ms": round(h.sum / h.count * 1000, 2) if h.count else None}
+                for q in QUANTILES:
+                    value = h.quantile(q)
+                    summary[f"p{int(q * 100)}_ms"] = round(value * 1000, 2) if value is not None else None
+                out[" ".join(labels)] = summary
+            return out
+
+    def render_prometheus(self) -> str:
+        """Prometheus text exposition format (0.0.4)."""
+        lines: List[str] = []
+        with self._lock:
+            for family, (prefix, help_text, label_names) in FAMILIES.items():
+                series = sorted((labels, s) for (f, labels), s in self._series.items() if f == family)
+                lines += [f"# HELP {prefix}_duration_seconds {help_text}: latency",
+                          f"# TYPE {prefix}_duration_seconds histogram"]
+                for labels, s in series:
+                    base = _labels(label_names, labels)
+                    cumulative = 0
+                    for bound, n in zip(BUCKETS + (float("inf"),), s.histogram.counts):
+                        cumulative += n
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f'{prefix}_duration_seconds_bucket{{{base},le="{le}"}} {cumulative}')
+                    lines.append(f"{prefix}_duration_seconds_sum{{{base}}} {s.histogram.sum}")
+                    lines.append(f"{prefix}_duration_seconds_count{{{base}}} {s.histogram.count}")
+                lines += [f"# HELP {prefix}_errors_total {help_text}: failures",
+                          f"# TYPE {prefix}_errors_total counter"]
+                lines += [f"{prefix}_errors_total{{{_labels(label_names, labels)}}} {s.errors}" for labels, s in series]
+                lines += [f"# HELP {prefix}s_in_flight {help_text}: in progress",
+                          f"# TYPE {prefix}s_in_flight gauge"]
+                lines += [f"{prefix}s_in_flight{{{_labels(label_names, labels)}}} {s.in_flight}" for labels, s in series]
+        return "\n".join(lines) + "\n"
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    def escape(v: str) -> str:
+        return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{n}="{escape(v)}"' for n, v in zip(names, values))
+
+
+metrics = MetricsRegistry()
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every MongoDB command by name and collection; pass to the client via event_listeners."""
+
+    def __init__(self, registry: MetricsRegistry = metrics):
+        self.registry = registry
+        self._labels: Dict[Tuple[int, Any], Tuple[str, str]] = {}
+
+    def started(self, event) -> None:
+        target = event.command.get(event.command_name)
+        # getMore carries the cursor id under its own name and the collection separately
+        collection = target if isinstance(target, str) else event.command.get("collection", "")
+        labels = ("mongo", f"{event.command_name} {collection}".strip())
+        self._labels[(event.request_id, event.connection_id)] = labels
+        self.registry.begin("dependency", labels)
+
+    def _finish(self, event, failed: bool) -> None:
+        labels = self._labels.pop((event.request_id, event.connection_id), None)
+        if labels is not None:
+            self.registry.end("dependency", labels, event.duration_micros / 1e6, failed)
+
+    def succeeded(self, event) -> None:
+        self._finish(event, False)
+
+    def failed(self, event) -> None:
+        self._finish(event, True)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing each HTTP request under its route template (e.g. /alerts/{grant_id}), so label
+    cardinality stays bounded. Responses with status >= 500 and unhandled exceptions count as errors.
+    Streaming responses are timed until their last chunk is sent.
+    """
+
+    def __init__(self, app, registry: MetricsRegistry = metrics):
+        self.app = app
+        self.registry = registry
+
+    @staticmethod
+    def _route(scope) -> str:
+        from starlette.routing import Match
+
+        app = scope.get("app")
+        for route in getattr(getattr(app, "router", None), "routes", []):
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, "path", scope["path"])
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        with self.registry.track("http", scope["method"], self._route(scope)) as timer:
+            await self.app(scope, receive, send_wrapper)
+            timer.failed = status["code"] >= 500
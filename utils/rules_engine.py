@@ -0,0 +1,275 @@
+import hashlib
+import json
+import logging
+import operator
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import yaml
+
+from database import db
+from settings import settings
+
+logger = logging.getLogger("rules_engine")
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# used when the rules file is missing; matches config/rules.yaml
+DEFAULT_RULES = {
+    "version": "r1.0",
+    "rules": [
+        {"id": "R1", "conditions": [
+            {"feature": "return_ratio", "op": ">", "value": 0.5},
+            {"feature": "micro_count", "op": ">", "value": 5},
+        ]},
+        {"id": "R2", "conditions": [
+            {"feature": "burstiness", "op": ">", "value": 1.0},
+        ]},
+        {"id": "R3", "conditions": [
+            {"feature": "fragmentation_index", "op": ">", "value": 0.5},
+            {"feature": "conduit_entropy", "op": ">", "value": 1.0},
+        ]},
+    ],
+}
+
+OPERATORS: Dict[str, Callable[[Any, Any], Any]] = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+MATCH_MODES = ("all", "any")
+
+
+def _number(v) -> Optional[float]:
+    try:
+        x = float(v)
+    except (TypeError, ValueError):
+        return None
+    return None if x != x else x
+
+
+class Ruleset:
+    """
+    Rules compiled once from their declarative spec.
+    evaluate() runs the compiled predicates against one feature dict; evaluate_many() evaluates the same
+    conditions as boolean masks over a feature matrix, one column per referenced feature.
+    """
+
+    def __init__(self, spec: Dict[str, Any]):
+        canonical = json.dumps(spec, sort_keys=True, default=str)
+        digest = hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+        self.version = f"{spec.get('version', 'unversioned')}+{digest[:8]}"
+        # the spec as hashed, so a stored copy recompiles to the same version
+        self.spec = json.loads(canonical)
+
+        self.rules: List[Dict[str, Any]] = []
+        seen = set()
+        for rule in spec.get("rules", []):
+            rule_id = str(rule["id"])
+            if rule_id in seen:
+                raise ValueError(f"Duplicate rule id '{rule_id}'")
+            seen.add(rule_id)
+            match = rule.get("match", "all")
+            if match not in MATCH_MODES:
+                raise ValueError(f"Rule {rule_id}: unknown match '{match}'; expected one of {MATCH_MODES}")
+            conditions = []
+            for cond in rule.get("conditions") or []:
+                op = cond.get("op", ">")
+                if op not in OPERATORS:
+                    raise ValueError(f"Rule {rule_id}: unknown operator '{op}'; expected one of {tuple(OPERATORS)}")
+                conditions.append({
+                    "feature": str(cond["feature"]),
+                    "op": OPERATORS[op],
+                    "value": float(cond["value"]),
+                    "default": cond.get("default", 0.0),
+                })
+            if not conditions:
+                raise ValueError(f"Rule {rule_id} has no conditions")
+            self.rules.append({
+                "id": rule_id,
+                "description": rule.get("description", ""),
+                "match": match,
+                "conditions": conditions,
+                "predicate": self._compile(conditions, match),
+            })
+
+        # every feature a rule reads, in first-use order; these are reported as the evaluation's signals
+        self.signals = list(dict.fromkeys(c["feature"] for r in self.rules for c in r["conditions"]))
+        # only for reporting a missing signal; every condition evaluates against its own default
+        self._signal_defaults = {}
+        for r in self.rules:
+            for c in r["conditions"]:
+                self._signal_defaults.setdefault(c["feature"], c["default"])
+
+    @staticmethod
+    def _compile(conditions: List[Dict[str, Any]], match: str) -> Callable[[Dict[str, Any]], bool]:
+        checks = [(c["feature"], c["op"], c["value"], c["default"]) for c in conditions]
+        combine = all if match == "all" else any
+
+        def predicate(features: Dict[str, Any]) -> bool:
+            def holds(feature, op, value, default):
+                x = _number(features.get(feature, default))
+                return x is not None and op(x, value)
+            return combine(holds(*check) for check in checks)
+
+        return predicate
+
+    def evaluate(self, features: Dict[str, Any]) -> Tuple[List[str], Dict[str, Any]]:
+        triggered = [r["id"] for r in self.rules if r["predicate"](features)]
+        signals = {name: features.get(name, self._signal_defaults[name]) for name in self.signals}
+        return triggered, signals
+
+    def evaluate_many(self, docs: List[Dict[str, Any]]) -> List[Tuple[List[str], Dict[str, Any]]]:
+        """evaluate() for every feature dict; conditions are applied column-wise instead of per row."""
+        n = len(docs)
+        signals = [{name: doc.get(name, self._signal_defaults[name]) for name in self.signals} for doc in docs]
+        # NaN marks values that are present but not numeric; they never satisfy a condition. Missing values
+        # are filled per condition below, since two conditions on one feature may default differently
+        X = np.full((n, len(self.signals)), np.nan, dtype=np.float64)
+        missing = np.zeros((n, len(self.signals)), dtype=bool)
+        for i, doc in enumerate(docs):
+            for j, name in enumerate(self.signals):
+                if name not in doc:
+                    missing[i, j] = True
+                    continue
+                x = _number(doc[name])
+                if x is not None:
+                    X[i, j] = x
+        col = {name: j for j, name in enumerate(self.signals)}
+
+        def mask(c: Dict[str, Any]) -> np.ndarray:
+            j = col[c["feature"]]
+            default = _number(c["default"])
+            values = np.where(missing[:, j], np.nan if default is None else default, X[:, j])
+            return ~np.isnan(values) & c["op"](values, c["value"])
+
+        hits = np.zeros((n, len(self.rules)), dtype=bool)
+        for r_idx, rule in enumerate(self.rules):
+            masks = [mask(c) for c in rule["conditions"]]
+            hits[:, r_idx] = np.logical_and.reduce(masks) if rule["match"] == "all" else np.logical_or.reduce(masks)
+
+        ids = [r["id"] for r in self.rules]
+        return [([ids[k] for k in np.flatnonzero(hits[i])], signals[i]) for i in range(n)]
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "ruleset_version": self.version,
+            "rules": [
+                {
+                    "id": r["id"],
+                    "description": r["description"],
+                    "match": r["match"],
+                    "conditions": [
+                        {"feature": c["feature"], "op": _op_symbol(c["op"]), "value": c["value"]}
+                        for c in r["conditions"]
+                    ],
+                }
+                for r in self.rules
+            ],
+        }
+
+
+def _op_symbol(fn) -> str:
+    return next(symbol for symbol, op in OPERATORS.items() if op is fn)
+
+
+def _rules_path(path: Optional[str] = None) -> str:
+    path = path or settings.RULES_PATH
+    return path if os.path.isabs(path) else os.path.join(BASE_DIR, path)
+
+
+def load_ruleset(path: Optional[str] = None) -> Ruleset:
+    path = _rules_path(path)
+    try:
+        with open(path) as fh:
+            spec = yaml.safe_load(fh) or {}
+    except FileNotFoundError:
+        logger.warning("Rules file %s not found, using built-in default", path)
+        spec = DEFAULT_RULES
+    return Ruleset(spec)
+
+
+_ruleset: Optional[Ruleset] = None
+_mtime: Optional[float] = None
+_checked_at = 0.0
+_reload_lock = threading.Lock()
+
+
+def _file_mtime(path: str) -> Optional[float]:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def get_ruleset() -> Ruleset:
+    """
+    The current compiled ruleset. The rules file's mtime is checked at most every
+    RULES_RELOAD_INTERVAL_SEC; a changed file is compiled off to the side and swapped in with a single
+    assignment, so in-flight evaluations finish on the ruleset they started with. A file that fails to
+    parse or compile is logged and the previous ruleset stays active.
+    """
+    global _ruleset, _mtime, _checked_at
+    now = time.monotonic()
+    if _ruleset is not None and now - _checked_at < settings.RULES_RELOAD_INTERVAL_SEC:
+        return _ruleset
+
+    with _reload_lock:
+        if _ruleset is not None and now - _checked_at < settings.RULES_RELOAD_INTERVAL_SEC:
+            return _ruleset
+        path = _rules_path()
+        mtime = _file_mtime(path)
+        if _ruleset is not None and mtime is None:
+            # a deleted file must not swap the rules under running evaluations for the built-in default
+            if _mtime is not None:
+                logger.error("Rules file %s is missing; keeping ruleset %s", path, _ruleset.version)
+            _mtime = None
+        elif _ruleset is None or mtime != _mtime:
+            try:
+                ruleset = load_ruleset(path)
+            except Exception:
+                if _ruleset is None:
+                    raise
+                logger.exception("Failed to reload rules from %s; keeping ruleset %s", path, _ruleset.version)
+            else:
+                if _ruleset is not None:
+                    logger.info("Rules reloaded: %s -> %s", _ruleset.version, ruleset.version)
+                _ruleset = ruleset
+            _mtime = mtime
+        _checked_at = now
+    return _ruleset
+
+
+_recorded: set = set()
+
+
+async def current_ruleset() -> Ruleset:
+    """
+    get_ruleset(), with its spec stored in `rulesets` under its version the first time it is used, so every
+    ruleset_version stamped on rules_eval can be looked up and re-run. Storing is retried on the next call
+    if it fails.
+    """
+    ruleset = get_ruleset()
+    if ruleset.version not in _recorded:
+        try:
+            await db.rulesets.update_one(
+                {"_id": ruleset.version},
+                {"$setOnInsert": {"spec": ruleset.spec, "first_used_at": datetime.utcnow()}},
+                upsert=True,
+            )
+            _recorded.add(ruleset.version)
+        except Exception:
+            logger.exception("Failed to store ruleset %s", ruleset.version)
+    return ruleset
+
+
+async def stored_ruleset(version: str) -> Optional[Dict[str, Any]]:
+    doc = await db.rulesets.find_one({"_id": version})
+    return {"ruleset_version": doc["_id"], "spec": doc["spec"], "first_used_at": doc.get("first_used_at")} if doc else None
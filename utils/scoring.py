@@ -0,0 +1,245 @@
+import logging
+import math
+import os
+from itertools import combinations
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import yaml
+
+from settings import settings
+
+logger = logging.getLogger("scoring")
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# used when the model file is missing; matches config/scoring_model.yaml
+DEFAULT_MODEL = {
+    "version": "v1.0",
+    "link": "clamp",
+    "intercept": 0.0,
+    "terms": [
+        {"feature": "return_ratio", "cap": 5.0, "weight": 0.4},
+        {"feature": "micro_count", "cap": 50, "weight": 0.2},
+        {"feature": "burstiness", "cap": 3.0, "weight": 0.2},
+        {"feature": "fragmentation_index", "cap": 1.0, "weight": 0.1},
+        {"feature": "conduit_entropy", "cap": 5.0, "weight": 0.1},
+    ],
+    "tiers": [
+        {"name": "High", "min": 0.75},
+        {"name": "Medium", "min": 0.4},
+        {"name": "Low", "min": 0.0},
+    ],
+}
+
+TERM_TYPES = ("linear", "interaction", "threshold")
+LINKS = ("clamp", "logistic")
+
+
+def _norm(v, cap):
+    try:
+        return min(max(float(v) / float(cap), 0.0), 1.0)
+    except Exception:
+        return 0.0
+
+
+class ScoringModel:
+    """
+    Risk score = link(intercept + sum of terms) over a handful of features.
+    explain() returns exact per-feature attributions: the terms themselves when the model is additive and the
+    link is inactive, otherwise Shapley values computed by enumerating every feature coalition.
+    """
+
+    def __init__(self, spec: Dict[str, Any]):
+        self.version = str(spec.get("version", "unversioned"))
+        self.link = spec.get("link", "clamp")
+        self.intercept = float(spec.get("intercept", 0.0))
+        if self.link not in LINKS:
+            raise ValueError(f"Unknown link '{self.link}'; expected one of {LINKS}")
+
+        self.terms: List[Dict[str, Any]] = []
+        for term in spec.get("terms", []):
+            kind = term.get("type", "linear")
+            if kind not in TERM_TYPES:
+                raise ValueError(f"Unknown term type '{kind}'; expected one of {TERM_TYPES}")
+            features = term.get("features") or [term["feature"]]
+            caps = term.get("caps") or [term.get("cap", 1.0)] * len(features)
+            self.terms.append({
+                "type": kind,
+                "features": list(features),
+                "caps": [float(c) for c in caps],
+                "weight": float(term.get("weight", 0.0)),
+                "above": float(term.get("above", 0.0)),
+            })
+
+        self.tiers = sorted(
+            ((t["name"], float(t["min"])) for t in spec.get("tiers", DEFAULT_MODEL["tiers"])),
+            key=lambda t: t[1],
+            reverse=True,
+        )
+        self.features = list(dict.fromkeys(f for t in self.terms for f in t["features"]))
+        self.additive = all(t["type"] == "linear" and len(t["features"]) == 1 for t in self.terms)
+
+    def _term(self, term: Dict[str, Any], values: Dict[str, Any]) -> float:
+        if term["type"] == "threshold":
+            try:
+                hit = float(values.get(term["features"][0]) or 0) > term["above"]
+            except (TypeError, ValueError):
+                hit = False
+            return term["weight"] if hit else 0.0
+        out = term["weight"]
+        for feature, cap in zip(term["features"], term["caps"]):
+            out *= _norm(values.get(feature, 0) or 0, cap)
+        return out
+
+    def _apply_link(self, raw: float) -> float:
+        if self.link == "logistic":
+            return 1.0 / (1.0 + math.exp(-raw))
+        return min(max(raw, 0.0), 1.0)
+
+    def score(self, features: Dict[str, Any]) -> float:
+        return self._apply_link(self.intercept + sum(self._term(t, features) for t in self.terms))
+
+    def tier(self, risk_score: float) -> str:
+        for name, minimum in self.tiers:
+            if risk_score >= minimum:
+                return name
+        return self.tiers[-1][0] if self.tiers else "Low"
+
+    def contributions(self, features: Dict[str, Any]) -> Dict[str, float]:
+        """Exact attribution of score(features) - score(all features zero) to each model feature."""
+        if self.additive and self.link == "clamp":
+            terms = [(t["features"][0], self._term(t, features)) for t in self.terms]
+            gain = sum(v for _, v in terms if v > 0)
+            loss = sum(v for _, v in terms if v < 0)
+            # every coalition stays inside [0, 1]: the clamp never bites, so the terms are the Shapley values
+            if 0.0 <= self.intercept + loss and self.intercept + gain <= 1.0:
+                out: Dict[str, float] = {}
+                for feature, v in terms:
+                    out[feature] = out.get(feature, 0.0) + v
+                return out
+        return self._shapley(features)
+
+    def _shapley(self, features: Dict[str, Any]) -> Dict[str, float]:
+        names = self.features
+        k = len(names)
+        if not k:
+            return {}
+        # value of every coalition (bitmask over names); absent features sit at the zero baseline
+        value = [0.0] * (1 << k)
+        for mask in range(1 << k):
+            present = {names[i]: features.get(names[i], 0) for i in range(k) if mask >> i & 1}
+            value[mask] = self.score(present)
+        weight = [math.factorial(s) * math.factorial(k - s - 1) / math.factorial(k) for s in range(k)]
+        out = {}
+        for i, name in enumerate(names):
+            bit = 1 << i
+            others = [j for j in range(k) if j != i]
+            phi = 0.0
+            for size in range(k):
+                for subset in combinations(others, size):
+                    mask = sum(1 << j for j in subset)
+                    phi += weight[size] * (value[mask | bit] - value[mask])
+            out[name] = phi
+        return out
+
+    def explain(self, features: Dict[str, Any], top: int = 4) -> List[Dict[str, Any]]:
+        contrib = self.contributions(features)
+        ranked = sorted(contrib.items(), key=lambda kv: abs(kv[1]), reverse=True)[:top]
+        return [
+            {"feature": name, "value": features.get(name), "contribution": round(c, 4)}
+            for name, c in ranked
+        ]
+
+    def matrix(self, docs: List[Dict[str, Any]]) -> np.ndarray:
+        """Feature matrix (rows = docs, columns = self.features); missing or non-numeric values become 0."""
+        X = np.zeros((len(docs), len(self.features)), dtype=np.float64)
+        for i, doc in enumerate(docs):
+            for j, name in enumerate(self.features):
+                try:
+                    X[i, j] = float(doc.get(name) or 0)
+                except (TypeError, ValueError):
+                    pass
+        return X
+
+    def _term_matrix(self, X: np.ndarray) -> np.ndarray:
+        # one column per term, evaluated over all rows at once
+        col = {name: j for j, name in enumerate(self.features)}
+        T = np.empty((X.shape[0], len(self.terms)), dtype=np.float64)
+        for t_idx, term in enumerate(self.terms):
+            if term["type"] == "threshold":
+                T[:, t_idx] = np.where(X[:, col[term["features"][0]]] > term["above"], term["weight"], 0.0)
+                continue
+            out = np.full(X.shape[0], term["weight"])
+            for feature, cap in zip(term["features"], term["caps"]):
+                out = out * np.clip(X[:, col[feature]] / cap, 0.0, 1.0)
+            T[:, t_idx] = out
+        return T
+
+    def score_matrix(self, X: np.ndarray) -> np.ndarray:
+        """Vectorized score(); terms are summed in model order so results match the scalar path exactly."""
+        T = self._term_matrix(X)
+        total = np.zeros(X.shape[0], dtype=np.float64)
+        for t_idx in range(T.shape[1]):
+            total += T[:, t_idx]
+        raw = self.intercept + total
+        if self.link == "logistic":
+            return 1.0 / (1.0 + np.exp(-raw))
+        return np.clip(raw, 0.0, 1.0)
+
+    def tier_array(self, scores: np.ndarray) -> np.ndarray:
+        tiers = np.full(scores.shape[0], self.tiers[-1][0] if self.tiers else "Low", dtype=object)
+        # tiers are sorted by descending minimum; assign from the lowest up so higher tiers win
+        for name, minimum in reversed(self.tiers):
+            tiers[scores >= minimum] = name
+        return tiers
+
+    def explain_matrix(self, X: np.ndarray, docs: List[Dict[str, Any]], top: int = 4) -> List[List[Dict[str, Any]]]:
+        """explain() for every row; additive rows are ranked vectorized, the rest fall back to Shapley per row."""
+        fast = np.zeros(X.shape[0], dtype=bool)
+        if self.additive and self.link == "clamp":
+            T = self._term_matrix(X)
+            gain = np.where(T > 0, T, 0.0).sum(axis=1)
+            loss = np.where(T < 0, T, 0.0).sum(axis=1)
+            fast = (self.intercept + loss >= 0.0) & (self.intercept + gain <= 1.0)
+            # terms map one-to-one onto features for additive models (repeated features are summed)
+            C = np.zeros_like(X)
+            col = {name: j for j, name in enumerate(self.features)}
+            for t_idx, term in enumerate(self.terms):
+                C[:, col[term["features"][0]]] += T[:, t_idx]
+            # stable sort on -|c| keeps model order among ties, like sorted() in explain()
+            order = np.argsort(-np.abs(C), axis=1, kind="stable")[:, :top]
+
+        out = []
+        for i, doc in enumerate(docs):
+            if fast[i]:
+                out.append([
+                    {"feature": self.features[j], "value": doc.get(self.features[j]), "contribution": round(float(C[i, j]), 4)}
+                    for j in order[i]
+                ])
+            else:
+                out.append(self.explain(doc, top=top))
+        return out
+
+
+_model: Optional[ScoringModel] = None
+
+
+def load_scoring_model(path: Optional[str] = None) -> ScoringModel:
+    path = path or settings.SCORING_MODEL_PATH
+    if not os.path.isabs(path):
+        path = os.path.join(BASE_DIR, path)
+    try:
+        with open(path) as fh:
+            spec = yaml.safe_load(fh) or {}
+    except FileNotFoundError:
+        logger.warning("Scoring model %s not found, using built-in default", path)
+        spec = DEFAULT_MODEL
+    return ScoringModel(spec)
+
+
+def get_scoring_model() -> ScoringModel:
+    global _model
+    if _model is None:
+        _model = load_scoring_model()
+    return _model
@@ -0,0 +1,117 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import logging
+
+from fastapi.concurrency import run_in_threadpool
+
+from database import db
+from settings import settings
+from utils.feature_engine import MICRO_THRESHOLD, FeatureAccumulator, compute_window_features
+from utils.feature_kernel import compute_features_vectorized
+from utils.scoring import ScoringModel
+from utils.txgraph import get_graph
+
+logger = logging.getLogger("stages")
+
+# features -> rules -> score building blocks shared by the per-stage routers and routers/pipeline.py
+# (the alert stage lives in utils/alert_worker.py)
+
+FEATURE_ENGINES = ("python", "numpy", "mongo")
+
+
+def resolve_engine(engine: Optional[str]) -> str:
+    """The requested feature engine, or FEATURE_ENGINE; ValueError for an unknown name."""
+    engine = engine or settings.FEATURE_ENGINE
+    if engine not in FEATURE_ENGINES:
+        raise ValueError(f"Unknown feature engine '{engine}'; expected one of {FEATURE_ENGINES}")
+    return engine
+
+
+def compute_features_with_state(
+    transactions: List[dict],
+    theta_micro: float = MICRO_THRESHOLD,
+    windows: List[int] = (),
+    engine: str = "python",
+) -> Tuple[dict, Optional[FeatureAccumulator]]:
+    # the python engine also hands back its full-history accumulator so ingest can keep it current
+    if engine == "numpy":
+        return compute_features_vectorized(transactions, micro_threshold=theta_micro, windows=windows), None
+    acc = FeatureAccumulator(theta_micro)
+    features = compute_window_features(transactions, micro_threshold=theta_micro, windows=windows, accumulator=acc)
+    return features, acc
+
+
+async def graph_features(grant_ids: List[str]) -> List[dict]:
+    # cycles and two-hop inflow come from the shared transaction graph, not from one grant's transactions
+    if not settings.TXGRAPH_FEATURES:
+        return [{} for _ in grant_ids]
+    graph = await get_graph()
+    if graph is None:
+        logger.warning("Transaction graph unavailable; graph features skipped")
+        return [{} for _ in grant_ids]
+    return await run_in_threadpool(lambda: [graph.features_for(gid) for gid in grant_ids])
+
+
+def features_doc(grant_id: str, features: dict, theta_micro: float, windows: List[int]) -> dict:
+    return {
+        "grant_id": grant_id,
+        "computed_at": datetime.utcnow().isoformat(),
+        "features": features,
+        "meta": {"theta_micro": theta_micro, "windows": windows},
+    }
+
+
+async def fetch_grant_transactions(grant_ids: List[str]) -> List[Tuple[str, List[dict]]]:
+    """
+    Load transactions for every requested grant from a single cursor sorted on grant_id.
+    Grants without any transactions get an empty list so they still get (empty) features.
+    """
+    groups: Dict[str, List[dict]] = {gid: [] for gid in grant_ids}
+    async for t in db.transactions.find({"grant_id": {"$in": grant_ids}}, {"_id": 0}).sort("grant_id", 1):
+        groups[t["grant_id"]].append(t)
+    return list(groups.items())
+
+
+def rules_eval_doc(grant_id: str, triggered: list, signals: dict, ruleset_version: str) -> dict:
+    return {
+        "grant_id": grant_id,
+        "triggered_rules": triggered,
+        "signals": signals,
+        "ruleset_version": ruleset_version,
+    }
+
+
+def score_result(grant_id: str, features: dict, rule_hits: dict, model: ScoringModel) -> dict:
+    # scoring and attribution both come from the configured model: deterministic and local
+    risk_score = model.score(features)
+    return {
+        "grant_id": grant_id,
+        "risk_score": round(risk_score, 4),
+        "risk_tier": model.tier(risk_score),
+        "rule_hits": rule_hits,
+        "top_shap_drivers": model.explain(features),
+        "model_version": model.version,
+        "scored_at": datetime.utcnow(),
+    }
+
+
+def score_results(grant_ids: List[str], features: List[dict], rule_hits: List[dict], model: ScoringModel) -> List[dict]:
+    """score_result for many grants at once: the model is evaluated as one matrix."""
+    X = model.matrix(features)
+    scores = model.score_matrix(X)
+    tiers = model.tier_array(scores)
+    drivers = model.explain_matrix(X, features)
+    scored_at = datetime.utcnow()
+    return [
+        {
+            "grant_id": gid,
+            "risk_score": round(float(scores[i]), 4),
+            "risk_tier": tiers[i],
+            "rule_hits": rule_hits[i],
+            "top_shap_drivers": drivers[i],
+            "model_version": model.version,
+            "scored_at": scored_at,
+        }
+        for i, gid in enumerate(grant_ids)
+    ]
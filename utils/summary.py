@@ -0,0 +1,158 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from database import db
+from settings import settings
+
+logger = logging.getLogger("summary")
+
+# dashboard_summary holds one portfolio document plus one alert counter per UTC day
+SUMMARY_ID = "portfolio"
+ALERT_FIELDS = ("grant_id", "risk_score", "risk_tier", "rule_hits", "timestamp")
+
+
+def _day_id(ts: datetime) -> str:
+    return f"alerts:{ts:%Y-%m-%d}"
+
+
+async def _write(ops: List[UpdateOne]) -> None:
+    # the summary trails the source collections by design: a failure is logged and `manage.py
+    # rebuild-summary` reconciles, so result writes never fail because of it
+    try:
+        await db.dashboard_summary.bulk_write(ops, ordered=True)
+    except Exception:
+        logger.exception("Failed to update dashboard summary")
+
+
+def score_increments(changes: Iterable[Tuple[Optional[dict], dict]]) -> Dict[str, float]:
+    """
+    The portfolio `$inc` for (previous score doc or None, new score doc) pairs: a first score adds to the
+    total, a re-score moves the grant between tiers and adjusts the score sum. A tier move's decrement and
+    increment always land in the same document, and changes that cancel out are dropped.
+    """
+    inc: Dict[str, float] = {}
+
+    def add(key, value):
+        inc[key] = inc.get(key, 0) + value
+
+    for previous, new in changes:
+        if previous and previous.get("risk_tier") is not None:
+            add(f"tiers.{previous['risk_tier']}", -1)
+            add("score_sum", -float(previous.get("risk_score") or 0.0))
+        else:
+            add("total", 1)
+        add(f"tiers.{new['risk_tier']}", 1)
+        add("score_sum", float(new.get("risk_score") or 0.0))
+    return {k: v for k, v in inc.items() if v}
+
+
+async def apply_scores(changes: Iterable[Tuple[Optional[dict], dict]]) -> None:
+    """
+    Fold score changes into the portfolio totals. Every delta goes out as a single `$inc` on the one
+    portfolio document, so readers never see a grant removed from its old tier but not yet in the new one.
+    """
+    inc = score_increments(changes)
+    if inc:
+        await _write([UpdateOne(
+            {"_id": SUMMARY_ID}, {"$inc": inc, "$set": {"updated_at": datetime.utcnow()}}, upsert=True
+        )])
+
+
+async def apply_alerts(alerts: List[dict]) -> None:
+    """Count freshly materialized alerts towards today's volume and put them at the head of latest_alerts."""
+    if not alerts:
+        return
+    latest = sorted(
+        ({k: a.get(k) for k in ALERT_FIELDS} for a in alerts),
+        key=lambda a: a["timestamp"] or datetime.min,
+        reverse=True,
+    )[:settings.SUMMARY_LATEST_ALERTS]
+    now = datetime.utcnow()
+    await _write([
+        # a re-alerted grant moves to the front instead of appearing twice
+        UpdateOne({"_id": SUMMARY_ID}, {"$pull": {"latest_alerts": {"grant_id": {"$in": [a["grant_id"] for a in latest]}}}}),
+        UpdateOne(
+            {"_id": SUMMARY_ID},
+            {
+                "$push": {"latest_alerts": {"$each": latest, "$position": 0, "$slice": settings.SUMMARY_LATEST_ALERTS}},
+                "$set": {"updated_at": now},
+            },
+            upsert=True,
+        ),
+        UpdateOne(
+            {"_id": _day_id(now)},
+            {"$inc": {"count": len(alerts)}, "$setOnInsert": {"day": now.replace(hour=0, minute=0, second=0, microsecond=0)}},
+            upsert=True,
+        ),
+    ])
+
+
+async def withdraw_alerts(grant_ids: List[str]) -> None:
+    """Take resolved alerts out of latest_alerts; they still count towards the day they were raised."""
+    if grant_ids:
+        await _write([UpdateOne({"_id": SUMMARY_ID}, {"$pull": {"latest_alerts": {"grant_id": {"$in": grant_ids}}}})])
+
+
+async def apply_ingest(transactions: int) -> None:
+    if transactions:
+        await _write([UpdateOne({"_id": SUMMARY_ID}, {"$inc": {"transactions": transactions}}, upsert=True)])
+
+
+async def read_summary(now: Optional[datetime] = None) -> Dict[str, Any]:
+    """The portfolio document and today's alert counter, fetched with one query."""
+    day = _day_id(now or datetime.utcnow())
+    docs = {d["_id"]: d async for d in db.dashboard_summary.find({"_id": {"$in": [SUMMARY_ID, day]}})}
+    portfolio = docs.get(SUMMARY_ID) or {}
+    total = portfolio.get("total", 0)
+    return {
+        "transactions": portfolio.get("transactions", 0),
+        "total": total,
+        "tiers": {k: v for k, v in (portfolio.get("tiers") or {}).items() if v},
+        "avg_score": round(portfolio.get("score_sum", 0.0) / total, 4) if total else None,
+        "latest_alerts": portfolio.get("latest_alerts", []),
+        "alerts_today": (docs.get(day) or {}).get("count", 0),
+        "updated_at": portfolio.get("updated_at"),
+    }
+
+
+async def alerts_today(now: Optional[datetime] = None) -> int:
+    doc = await db.dashboard_summary.find_one({"_id": _day_id(now or datetime.utcnow())}, {"count": 1})
+    return (doc or {}).get("count", 0)
+
+
+async def rebuild_summary() -> Dict[str, Any]:
+    """Recompute the portfolio document and today's alert counter from scores, alerts and transactions."""
+    tiers: Dict[str, int] = {}
+    total, score_sum = 0, 0.0
+    async for row in db.scores.aggregate([
+        {"$group": {"_id": "$risk_tier", "n": {"$sum": 1}, "sum": {"$sum": "$risk_score"}}},
+    ]):
+        tiers[str(row["_id"])] = row["n"]
+        total += row["n"]
+        score_sum += row["sum"] or 0.0
+
+    latest = await (
+        db.alerts.find(
+            {"timestamp": {"$type": "date"}, "status": {"$ne": "resolved"}}, {"_id": 0, **{k: 1 for k in ALERT_FIELDS}}
+        )
+        .sort([("timestamp", -1), ("grant_id", -1)])
+        .limit(settings.SUMMARY_LATEST_ALERTS)
+        .to_list(length=settings.SUMMARY_LATEST_ALERTS)
+    )
+    now = datetime.utcnow()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    portfolio = {
+        "transactions": await db.transactions.estimated_document_count(),
+        "total": total,
+        "tiers": tiers,
+        "score_sum": score_sum,
+        "latest_alerts": latest,
+        "updated_at": now,
+    }
+    raised_today = await db.alerts.count_documents({"timestamp": {"$gte": today, "$lt": today + timedelta(days=1)}})
+    await db.dashboard_summary.replace_one({"_id": SUMMARY_ID}, portfolio, upsert=True)
+    await db.dashboard_summary.replace_one({"_id": _day_id(now)}, {"count": raised_today, "day": today}, upsert=True)
+    return {**portfolio, "alerts_today": raised_today}
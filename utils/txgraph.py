@@ -0,0 +1,338 @@
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+
+from database import db
+from settings import settings
+
+logger = logging.getLogger("txgraph")
+
+# only the fields edge_of() reads cross the wire when the graph is built
+EDGE_PROJECTION = {"_id": 0, "grant_id": 1, "amount": 1, "direction": 1, "from": 1, "to": 1,
+                   "counterparty": 1, "counterparty_key": 1}
+
+
+# grants and parties (counterparties, from/to accounts) get separate node namespaces, so a counterparty
+# key that happens to equal some grant id is not the same node
+GRANT_PREFIX = "grant:"
+PARTY_PREFIX = "party:"
+
+
+def grant_node(grant_id: Any) -> str:
+    return f"{GRANT_PREFIX}{grant_id}"
+
+
+def party_node(key: Any) -> str:
+    return f"{PARTY_PREFIX}{key}"
+
+
+def edge_of(txn: Dict[str, Any]) -> Optional[Tuple[str, str, float, Optional[str]]]:
+    """
+    (source, target, amount, grant-side node) for a transaction, as namespaced node names. Explicit
+    `from`/`to` win (a value equal to the transaction's grant_id is the grant's node); otherwise the edge
+    runs between the counterparty and the grant along `direction`. None when there is no edge to draw.
+    """
+    try:
+        amount = abs(float(txn.get("amount") or 0.0))
+    except (TypeError, ValueError):
+        amount = 0.0
+    if not math.isfinite(amount):
+        amount = 0.0
+    direction = txn.get("direction")
+    src, dst = txn.get("from"), txn.get("to")
+    gid = txn.get("grant_id")
+    if src and dst:
+        src, dst = (grant_node(v) if gid and str(v) == str(gid) else party_node(v) for v in (src, dst))
+        own = dst if direction == "in" else src if direction == "out" else None
+        return src, dst, amount, own
+    cp = txn.get("counterparty_key") or txn.get("counterparty")
+    if not gid or not cp or direction not in ("in", "out"):
+        return None
+    gid, cp = grant_node(gid), party_node(cp)
+    return (cp, gid, amount, gid) if direction == "in" else (gid, cp, amount, gid)
+
+
+class TxGraph:
+    """
+    Directed transaction graph over integer node ids. Parallel edges are merged (summed amount, edge count).
+    The bulk of the graph lives in CSR arrays (out- and in-adjacency); edges added since the last compaction
+    sit in small dict-of-dict deltas that every query also reads, and are folded into the arrays once they
+    exceed `compact_ratio` of the compacted edges. Methods are thread-safe, so queries and ingest's edge
+    additions can run in different worker threads.
+    """
+
+    def __init__(self, compact_ratio: float = settings.TXGRAPH_COMPACT_RATIO):
+        self.compact_ratio = compact_ratio
+        self.built_at = time.monotonic()
+        self._lock = threading.RLock()
+        self._ids: Dict[str, int] = {}
+        self._names: List[str] = []
+        # grant_id -> node ids on the grant's side of its transactions
+        self._grant_nodes: Dict[str, Set[int]] = defaultdict(set)
+        empty_i, empty_f = np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float64)
+        self._out_ptr = np.zeros(1, dtype=np.int64)
+        self._out_idx, self._out_amt, self._out_cnt = empty_i, empty_f, np.zeros(0, dtype=np.int64)
+        self._in_ptr = np.zeros(1, dtype=np.int64)
+        self._in_idx, self._in_amt = empty_i, empty_f
+        self._base_nodes = 0
+        self._delta_out: Dict[int, Dict[int, List[float]]] = defaultdict(dict)
+        self._delta_in: Dict[int, Dict[int, float]] = defaultdict(dict)
+        self._delta_edges = 0
+
+    # building
+
+    def _node(self, name: str) -> int:
+        idx = self._ids.get(name)
+        if idx is None:
+            idx = self._ids[name] = len(self._names)
+            self._names.append(name)
+        return idx
+
+    def add_nodes(self, names: Iterable[str]) -> List[int]:
+        with self._lock:
+            return [self._node(str(name)) for name in names]
+
+    @property
+    def nodes(self) -> int:
+        return len(self._names)
+
+    @property
+    def edges(self) -> int:
+        return int(self._out_idx.size) + self._delta_edges
+
+    def add_edges(self, src: np.ndarray, dst: np.ndarray, amount: np.ndarray, count: Optional[np.ndarray] = None) -> None:
+        """Bulk-load integer edges (node ids must already exist) straight into the CSR arrays."""
+        with self._lock:
+            self._compact(extra=(src, dst, amount, np.ones(src.size, dtype=np.int64) if count is None else count))
+
+    def add_transactions(self, transactions: Iterable[Dict[str, Any]]) -> int:
+        """Add transactions as edges; returns how many became edges. Compacts when the delta grows too large."""
+        added = 0
+        with self._lock:
+            for txn in transactions:
+                edge = edge_of(txn)
+                if edge is None:
+                    continue
+                src, dst, amount, own = edge
+                s, d = self._node(src), self._node(dst)
+                if own is not None and txn.get("grant_id"):
+                    self._grant_nodes[str(txn["grant_id"])].add(self._ids[own])
+                entry = self._delta_out[s].get(d)
+                if entry is None:
+                    self._delta_out[s][d] = [amount, 1]
+                    self._delta_edges += 1
+                else:
+                    entry[0] += amount
+                    entry[1] += 1
+                self._delta_in[d][s] = self._delta_in[d].get(s, 0.0) + amount
+                added += 1
+            if self._delta_edges > max(1000, self.compact_ratio * self._out_idx.size):
+                self._compact()
+        return added
+
+    def compact(self) -> None:
+        with self._lock:
+            self._compact()
+
+    def _compact(self, extra=None) -> None:
+        n = self.nodes
+        if n == 0:
+            return
+        base_src = np.repeat(np.arange(self._base_nodes, dtype=np.int64), np.diff(self._out_ptr))
+        parts = [(base_src, self._out_idx.astype(np.int64), self._out_amt, self._out_cnt)]
+        if self._delta_edges:
+            rows = [(s, d, a, c) for s, targets in self._delta_out.items() for d, (a, c) in targets.items()]
+            s, d, a, c = zip(*rows)
+            parts.append((np.array(s, dtype=np.int64), np.array(d, dtype=np.int64),
+                          np.array(a, dtype=np.float64), np.array(c, dtype=np.int64)))
+        if extra is not None:
+            parts.append(tuple(np.asarray(x) for x in extra))
+        src = np.concatenate([p[0] for p in parts]).astype(np.int64)
+        dst = np.concatenate([p[1] for p in parts]).astype(np.int64)
+        amt = np.concatenate([p[2] for p in parts]).astype(np.float64)
+        cnt = np.concatenate([p[3] for p in parts]).astype(np.int64)
+
+        # merge parallel edges: one entry per (src, dst), ordered by src then dst
+        keys, inverse = np.unique(src * n + dst, return_inverse=True)
+        amt = np.bincount(inverse, weights=amt, minlength=keys.size)
+        cnt = np.bincount(inverse, weights=cnt, minlength=keys.size).astype(np.int64)
+        src, dst = keys // n, keys % n
+
+        self._out_ptr = np.concatenate(([0], np.cumsum(np.bincount(src, minlength=n)))).astype(np.int64)
+        self._out_idx, self._out_amt, self._out_cnt = dst.astype(np.int32), amt, cnt
+        order = np.lexsort((src, dst))
+        self._in_ptr = np.concatenate(([0], np.cumsum(np.bincount(dst, minlength=n)))).astype(np.int64)
+        self._in_idx, self._in_amt = src[order].astype(np.int32), amt[order]
+        self._base_nodes = n
+        self._delta_out.clear()
+        self._delta_in.clear()
+        self._delta_edges = 0
+
+    # queries
+
+    def _out(self, u: int) -> Iterable[int]:
+        base = self._out_idx[self._out_ptr[u]:self._out_ptr[u + 1]].tolist() if u < self._base_nodes else []
+        delta = self._delta_out.get(u)
+        return base if not delta else set(base).union(delta)
+
+    def _in(self, u: int) -> Dict[int, float]:
+        incoming: Dict[int, float] = {}
+        if u < self._base_nodes:
+            lo, hi = self._in_ptr[u], self._in_ptr[u + 1]
+            incoming = dict(zip(self._in_idx[lo:hi].tolist(), self._in_amt[lo:hi].tolist()))
+        for v, a in self._delta_in.get(u, {}).items():
+            incoming[v] = incoming.get(v, 0.0) + a
+        return incoming
+
+    def _distances_to(self, target: int, limit: int) -> Dict[int, int]:
+        # reverse BFS: hops from each node to `target`, up to `limit`
+        dist = {target: 0}
+        frontier = [target]
+        for depth in range(1, limit + 1):
+            nxt = []
+            for u in frontier:
+                for v in self._in(u):
+                    if v not in dist:
+                        dist[v] = depth
+                        nxt.append(v)
+            frontier = nxt
+        return dist
+
+    def cycles(self, node: int, max_len: int = settings.TXGRAPH_MAX_CYCLE_LEN,
+               limit: int = settings.TXGRAPH_MAX_CYCLES) -> Tuple[List[List[int]], bool]:
+        """
+        Simple directed cycles through `node` with 2..max_len edges, as node lists starting at `node`, and
+        whether enumeration stopped at `limit`. Branches that cannot get back to `node` in the remaining
+        hops are pruned with a reverse BFS, so cost follows the neighbourhood, not the graph.
+        """
+        with self._lock:
+            dist = self._distances_to(node, max_len - 1)
+            found: List[List[int]] = []
+            path = [node]
+            on_path = {node}
+
+            def walk(u: int) -> bool:
+                # hops left after stepping to the next node
+                remaining = max_len - len(path)
+                for v in self._out(u):
+                    if v == node:
+                        if len(path) >= 2:
+                            found.append(list(path))
+                            if len(found) >= limit:
+                                return True
+                    elif v not in on_path and dist.get(v, max_len) <= remaining:
+                        path.append(v)
+                        on_path.add(v)
+                        stop = walk(v)
+                        path.pop()
+                        on_path.discard(v)
+                        if stop:
+                            return True
+                return False
+
+            truncated = walk(node)
+            return found, truncated
+
+    def twohop_inflow(self, node: int) -> float:
+        """
+        Money that can have reached `node` over two hops: for each payer u, the edge u -> node capped by
+        everything u itself received, so pass-through funds count and u's own funds do not.
+        """
+        with self._lock:
+            return float(sum(min(amount, sum(self._in(u).values())) for u, amount in self._in(node).items()))
+
+    def twohop_inflow_all(self) -> np.ndarray:
+        """twohop_inflow for every node at once over the compacted arrays."""
+        with self._lock:
+            self._compact()
+            n = self.nodes
+            received = np.bincount(self._out_idx, weights=self._out_amt, minlength=n)
+            src = np.repeat(np.arange(n), np.diff(self._out_ptr))
+            return np.bincount(self._out_idx, weights=np.minimum(self._out_amt, received[src]), minlength=n)
+
+    def features_for(self, grant_id: str) -> Dict[str, Any]:
+        """Graph features of a grant: cycles through its nodes and two-hop inflow into them."""
+        with self._lock:
+            own = self._ids.get(grant_node(grant_id))
+            nodes = self._grant_nodes.get(grant_id) or ({own} if own is not None else set())
+            cycles, truncated = 0, False
+            for node in nodes:
+                found, cut = self.cycles(node)
+                cycles += len(found)
+                truncated = truncated or cut
+            return {
+                "graph_cycle_count": cycles,
+                "graph_cycles_truncated": truncated,
+                "graph_twohop_inflow": round(sum(self.twohop_inflow(node) for node in nodes), 6),
+            }
+
+    def name(self, node: int) -> str:
+        return self._names[node]
+
+
+def build_graph(transactions: Iterable[Dict[str, Any]]) -> TxGraph:
+    graph = TxGraph()
+    graph.add_transactions(transactions)
+    graph.compact()
+    return graph
+
+
+_graph: Optional[TxGraph] = None
+_refresh: Optional[asyncio.Task] = None
+
+
+async def _load_graph() -> None:
+    # a failed load keeps serving the previous graph
+    global _graph
+    started = time.perf_counter()
+    try:
+        graph = TxGraph()
+        batch: List[dict] = []
+        async for txn in db.transactions.find({}, EDGE_PROJECTION).batch_size(10000):
+            batch.append(txn)
+            if len(batch) >= 10000:
+                await run_in_threadpool(graph.add_transactions, batch)
+                batch = []
+        await run_in_threadpool(graph.add_transactions, batch)
+        await run_in_threadpool(graph.compact)
+    except Exception:
+        logger.exception("Failed to build the transaction graph")
+        return
+    _graph = graph
+    logger.info("Transaction graph built: %d nodes, %d edges in %.2fs",
+                graph.nodes, graph.edges, time.perf_counter() - started)
+
+
+def refresh_graph() -> asyncio.Task:
+    """Start a background load of the graph from `transactions` unless one is already running."""
+    global _refresh
+    if _refresh is None or _refresh.done():
+        _refresh = asyncio.create_task(_load_graph())
+    return _refresh
+
+
+async def get_graph() -> Optional[TxGraph]:
+    """
+    The process-wide graph, loaded at startup and reloaded in the background once older than
+    TXGRAPH_TTL_SEC while the previous one keeps serving. Only a caller arriving before the first load
+    completes waits for it; None when that load failed.
+    """
+    if _graph is None:
+        await asyncio.shield(refresh_graph())
+    elif time.monotonic() - _graph.built_at >= settings.TXGRAPH_TTL_SEC:
+        refresh_graph()
+    return _graph
+
+
+def add_to_graph(transactions: Iterable[Dict[str, Any]]) -> None:
+    """Add freshly ingested transactions; takes the graph lock and may compact, so call it off the event loop."""
+    # a graph that has not been built yet will read these from the collection when it is
+    if _graph is not None:
+        _graph.add_transactions(transactions)
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Iterable, Optional
+
+from pymongo import UpdateOne
+
+from database import db
+from settings import settings
+
+logger = logging.getLogger("write_behind")
+
+# per-collection durability modes
+SYNC = "sync"          # upsert before the request returns
+BUFFERED = "buffered"  # acknowledged once queued; written by the next periodic flush
+MODES = (SYNC, BUFFERED)
+
+
+class WriteBehind:
+    """
+    Per-grant `$set` upserts into the result collections (features, rules_eval, scores, alerts).
+    Collections in SYNC mode are written immediately. In BUFFERED mode writes are queued, repeated writes to
+    the same grant_id are merged into one, and the queue is written with one unordered bulk_write per
+    collection every `interval` seconds, when it reaches `max_pending`, and on shutdown. A crash loses at
+    most one interval of buffered writes, so only results that can be recomputed should be buffered.
+    Fields are top-level `$set` keys; read() overlays queued fields on the stored document.
+    """
+
+    def __init__(
+        self,
+        modes: Optional[Dict[str, str]] = None,
+        interval: float = settings.WRITE_BEHIND_FLUSH_INTERVAL_SEC,
+        max_pending: int = settings.WRITE_BEHIND_MAX_PENDING,
+        chunk_size: int = settings.WRITE_BEHIND_CHUNK,
+    ):
+        modes = settings.WRITE_BEHIND_MODES if modes is None else modes
+        unknown = {m for m in modes.values() if m not in MODES}
+        if unknown:
+            raise ValueError(f"Unknown write-behind mode(s) {sorted(unknown)}; expected one of {MODES}")
+        self.modes = dict(modes)
+        self.interval = interval
+        self.max_pending = max(1, max_pending)
+        self.chunk_size = max(1, chunk_size)
+        # collection -> grant_id -> merged fields, queued and currently being written
+        self._buffers: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._inflight: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {
+            "writes": 0, "coalesced": 0, "flushes": 0, "flushed_docs": 0, "errors": 0,
+            "last_flush_ms": None, "max_flush_ms": 0.0, "total_flush_ms": 0.0,
+        }
+
+    def mode(self, collection: str) -> str:
+        return self.modes.get(collection, SYNC)
+
+    def depth(self) -> Dict[str, int]:
+        return {name: len(buf) for name, buf in self._buffers.items() if buf}
+
+    def stats(self) -> Dict[str, Any]:
+        flushes = self._stats["flushes"]
+        return {
+            **self._stats,
+            "total_flush_ms": round(self._stats["total_flush_ms"], 2),
+            "avg_flush_ms": round(self._stats["total_flush_ms"] / flushes, 2) if flushes else None,
+            "queue_depth": self.depth(),
+            "modes": self.modes,
+        }
+
+    def start(self) -> None:
+        if self._task is None and BUFFERED in self.modes.values():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        if self.depth():
+            logger.error("Write-behind stopped with unwritten documents: %s", self.depth())
+
+    async def upsert(self, collection: str, grant_id: str, fields: Dict[str, Any]) -> None:
+        self._stats["writes"] += 1
+        if self.mode(collection) == SYNC:
+            await db[collection].update_one({"grant_id": grant_id}, {"$set": fields}, upsert=True)
+            return
+
+        buf = self._buffers.setdefault(collection, {})
+        if grant_id in buf:
+            self._stats["coalesced"] += 1
+            buf[grant_id].update(fields)
+        else:
+            buf[grant_id] = dict(fields)
+        self.start()
+        if len(buf) >= self.max_pending:
+            # backpressure: the caller pays for the flush instead of the queue growing without bound
+            await self.flush([collection])
+
+    def pending(self, collection: str, grant_id: str) -> Optional[Dict[str, Any]]:
+        """Fields queued (or being written) for `grant_id` that the collection may not show yet."""
+        inflight = self._inflight.get(collection, {}).get(grant_id)
+        queued = self._buffers.get(collection, {}).get(grant_id)
+        if inflight is None and queued is None:
+            return None
+        return {**(inflight or {}), **(queued or {})}
+
+    async def read(self, collection: str, grant_id: str) -> Optional[Dict[str, Any]]:
+        """find_one by grant_id (without _id) that also sees this process's unflushed writes."""
+        doc = await db[collection].find_one({"grant_id": grant_id}, {"_id": 0})
+        queued = self.pending(collection, grant_id)
+        if queued is None:
+            return doc
+        return {**(doc or {}), **queued}
+
+    async def flush(self, collections: Optional[Iterable[str]] = None) -> int:
+        """
+        Write the queued documents of `collections` (default: all) now. Call before bulk reads or writes that
+        must observe, or land after, earlier buffered writes. Failed documents are re-queued under any newer
+        fields and retried by the next flush. Returns the number of documents written.
+        """
+        names = list(self._buffers) if collections is None else [c for c in collections if self._buffers.get(c)]
+        if not names:
+            return 0
+        written = 0
+        async with self._lock:
+            for name in names:
+                batch = self._buffers.pop(name, None)
+                if not batch:
+                    continue
+                self._inflight[name] = batch
+                started = time.perf_counter()
+                try:
+                    items = list(batch.items())
+                    for i in range(0, len(items), self.chunk_size):
+                        await db[name].bulk_write(
+                            [UpdateOne({"grant_id": gid}, {"$set": fields}, upsert=True)
+                             for gid, fields in items[i:i + self.chunk_size]],
+                            ordered=False,
+                        )
+                    written += len(items)
+                    self._stats["flushed_docs"] += len(items)
+                except Exception:
+                    # upserts are idempotent, so re-queueing the whole batch is safe
+                    self._stats["errors"] += 1
+                    logger.exception("Write-behind flush of %s failed; %d documents re-queued", name, len(batch))
+                    buf = self._buffers.setdefault(name, {})
+                    for gid, fields in batch.items():
+                        buf[gid] = {**fields, **buf.get(gid, {})}
+                finally:
+                    self._inflight.pop(name, None)
+                    elapsed_ms = (time.perf_counter() - started) * 1000
+                    self._stats["flushes"] += 1
+                    self._stats["last_flush_ms"] = round(elapsed_ms, 2)
+                    self._stats["max_flush_ms"] = round(max(self._stats["max_flush_ms"], elapsed_ms), 2)
+                    self._stats["total_flush_ms"] += elapsed_ms
+        return written
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Periodic write-behind flush failed")
+
+
+write_behind = WriteBehind()